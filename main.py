@@ -1,49 +1,141 @@
 import os
-import sounddevice as sd
-import soundfile as sf
-import numpy as np
+import sys
 from tkinter import *
 from tkinter import ttk, filedialog, messagebox
 import threading
-import time
+import math
+import queue
 from datetime import datetime
-import keyboard
-from collections import deque
+
+from recorder.devices import SAMPLE_FORMATS
+from recorder.engine import CaptureEngine
+from recorder.lazy import LazyModule
+from recorder.lifecycle import FLUSHING
+from recorder.metering import LevelMeters
+from recorder.resampling import measure_resampler_throughput
+from recorder.writers import OUTPUT_FORMATS, measure_encoder_throughput
+
+# Хук клавиатуры ставится уже после того, как окно появилось
+keyboard = LazyModule('keyboard')
+
 
 class AudioRecorderApp:
+    NATIVE_RATE = "родная"
+    SESSION_RATES = (NATIVE_RATE, "44100", "48000", "88200", "96000")
+    CAPTURE_PROCESSES = ("0", "1", "2", "4", "8")
+
     def __init__(self, root):
         self.root = root
         self.root.title("Многодорожечный аудиорекордер")
-        self.root.geometry("800x750")
+        self.root.geometry("800x1100")
         
         # Переменные
         self.selected_inputs = set()
-        self.is_recording = False
-        self.is_buffering = False
-        self.recording_thread = None
-        self.timer_thread = None
-        self.buffer_thread = None
+        self.timer_job = None
         self.countdown_seconds = 0
-        self.output_dir = r"C:\MultiTrackRecorder"
-        self.streams = []
-        self.audio_data = {}
-        self.buffer_data = {}
         self.use_timer = BooleanVar(value=False)
         self.show_all_devices = False
         self.instant_replay = BooleanVar(value=False)
+        self.trigger_enabled = BooleanVar(value=False)
+        self.stream_to_disk = BooleanVar(value=False)
+        self.aggregate = BooleanVar(value=False)
+        self.segmented = BooleanVar(value=False)
+        self.export_metrics = BooleanVar(value=True)
+        self.analyze_takes = BooleanVar(value=False)
+        self.write_peaks = BooleanVar(value=True)
+        self.archive_takes = BooleanVar(value=False)
+        self.segment_limits = (None, None)
+        self.align_tracks = BooleanVar(value=True)
+        self.correct_drift = BooleanVar(value=False)
+        self.sample_format = StringVar(value='int16')
+        self.output_format = StringVar(value='WAV')
+        self.session_rate = StringVar(value=self.NATIVE_RATE)
+        self.capture_processes = StringVar(value="0")
         self.buffer_duration = IntVar(value=2)
+        self.buffer_on_disk = BooleanVar(value=False)
         self.hotkey = "shift+f10"
         self.record_hotkey = "ctrl+shift+r"
-        self.buffer_queue = {}
-        self.buffer_streams = []
         self.hotkey_listener = None
         self.record_hotkey_listener = None
-        self.last_buffer_duration = 2
-        
-        os.makedirs(self.output_dir, exist_ok=True)
+        # Окна повтора "сохранить последние N секунд" из общего буфера, у каждого своя клавиша
+        self.window_seconds = [StringVar(value="10"), StringVar(value="120"), StringVar(value="900")]
+        self.window_hotkeys = ["shift+f7", "shift+f8", "shift+f9"]
+        self.window_hotkey_listeners = []
+        self.window_hotkey_btns = []
+        self.buffer_resize_job = None
+        self.device_change_proc = None
+        
+        self.engine = CaptureEngine(r"C:\MultiTrackRecorder")
+        self.engine.on_error = lambda title, message: self.root.after(
+            0, lambda: messagebox.showerror(title, message))
+        self.engine.on_state_change = lambda what, state: self.root.after(
+            0, self.on_engine_state, what, state)
+        self.device_registry = self.engine.registry
+        self.device_registry.add_listener(lambda: self.root.after(0, self.update_device_list))
+        # Таблица устройств читается в фоне, пока строится окно
+        self.device_registry.start()
+        self.save_jobs = self.engine.save_jobs
+        self.meters = self.engine.meters
+        self.meter_rows = {}
+        self.metrics_window = None
         self.create_widgets()
         self.update_device_list()
-        self.setup_hotkeys()
+        # after_idle срабатывает вместе с первой отрисовкой окна, а after(0) из него - уже после неё
+        self.root.after_idle(self.root.after, 0, self.setup_hotkeys)
+        self.root.after_idle(self.root.after, 0, self.watch_device_changes)
+        self.poll_save_jobs()
+        self.poll_meters()
+        threading.Thread(target=self.recover_interrupted_segments, daemon=True).start()
+
+    @property
+    def is_recording(self):
+        return self.engine.is_recording
+
+    @property
+    def is_buffering(self):
+        return self.engine.is_buffering
+
+    @property
+    def output_dir(self):
+        return self.engine.output_dir
+
+    @output_dir.setter
+    def output_dir(self, directory):
+        self.engine.output_dir = directory
+
+    def apply_settings(self):
+        """Передаёт настройки из окна в движок записи"""
+        engine = self.engine
+        engine.sample_format = self.sample_format.get()
+        engine.output_format = self.output_format.get()
+        engine.stream_to_disk = self.stream_to_disk.get()
+        engine.aggregate = self.aggregate.get()
+        session_rate = self.session_rate.get()
+        engine.session_samplerate = None if session_rate == self.NATIVE_RATE else int(session_rate)
+        engine.segment_limits = self.segment_limits if self.segmented.get() else None
+        engine.align_tracks = self.align_tracks.get()
+        engine.correct_drift = self.correct_drift.get()
+        engine.export_metrics = self.export_metrics.get()
+        engine.analyze_takes = self.analyze_takes.get()
+        engine.write_peaks = self.write_peaks.get()
+        engine.archive_takes = self.archive_takes.get()
+        engine.capture_processes = int(self.capture_processes.get())
+        engine.buffer_minutes = self.buffer_duration.get()
+        engine.replay_windows = self.replay_window_seconds()
+        engine.buffer_on_disk = self.buffer_on_disk.get()
+
+    def replay_window_seconds(self):
+        """Длительности окон повтора в секундах; пустые и неверные поля пропускаются"""
+        limit = self.buffer_slider.cget('to') * 60
+        windows = []
+        for seconds in self.window_seconds:
+            try:
+                value = float(seconds.get())
+            except ValueError:
+                continue
+            if 0 < value <= limit:
+                windows.append(value)
+        return windows
 
     def toggle_recording(self):
         """Переключает состояние записи"""
@@ -53,14 +145,36 @@ class AudioRecorderApp:
             self.start_recording()
 
     def on_buffer_duration_change(self, event=None):
-        """Обработчик изменения длительности буфера"""
+        """Длительность буфера и окна повтора меняются на ходу, без перезапуска буферизации"""
+        if not self.is_buffering:
+            return
+        # Ползунок присылает значения, пока его тянут: кольца меняются, когда он остановится
+        if self.buffer_resize_job is not None:
+            self.root.after_cancel(self.buffer_resize_job)
+        self.buffer_resize_job = self.root.after(500, self.resize_buffer)
+
+    def resize_buffer(self):
+        self.buffer_resize_job = None
+        if not self.is_buffering:
+            return
+        self.engine.resize_buffer(self.buffer_duration.get(), self.replay_window_seconds())
+        self.update_buffer_status()
+
+    def update_buffer_status(self):
+        self.buffer_status.config(text=f"Буфер: активен ({self.engine.buffer_seconds() / 60:.3g} мин)", fg="green")
+
+    def toggle_buffer_on_disk(self):
+        """Буфер на диске может быть длиннее: до 4 часов вместо 20 минут"""
         if self.is_buffering:
-            self.buffer_slider.set(self.last_buffer_duration)
+            self.buffer_on_disk.set(not self.buffer_on_disk.get())
             messagebox.showwarning("Предупреждение", 
-                                "Нельзя изменять длительность буфера во время работы. "
+                                "Нельзя менять хранение буфера во время работы. "
                                 "Сначала остановите буферизацию.")
-        else:
-            self.last_buffer_duration = self.buffer_duration.get()
+            return
+        limit = 240 if self.buffer_on_disk.get() else 20
+        self.buffer_slider.config(to=limit)
+        if self.buffer_duration.get() > limit:
+            self.buffer_duration.set(limit)
     
     def remove_hotkeys(self):
         """Безопасное удаление горячих клавиш"""
@@ -77,6 +191,59 @@ class AudioRecorderApp:
                 self.record_hotkey_listener = None
         except Exception as e:
             print(f"Ошибка удаления record_hotkey: {e}")
+        
+        for listener in self.window_hotkey_listeners:
+            try:
+                keyboard.remove_hotkey(listener)
+            except Exception as e:
+                print(f"Ошибка удаления hotkey окна повтора: {e}")
+        self.window_hotkey_listeners = []
+
+    def watch_device_changes(self):
+        """Подключение и отключение устройств Windows сообщает окну (WM_DEVICECHANGE).
+
+        Tk таких сообщений не разбирает, поэтому оконная процедура
+        подменяется своей: она просит реестр перечитать устройства и
+        передаёт сообщение дальше. В других системах список обновляется
+        кнопкой.
+        """
+        if os.name != 'nt':
+            return
+        import ctypes
+        from ctypes import wintypes
+
+        WM_DEVICECHANGE = 0x0219
+        GWLP_WNDPROC = -4
+        user32 = ctypes.windll.user32
+        WNDPROC = ctypes.WINFUNCTYPE(ctypes.c_ssize_t, wintypes.HWND, wintypes.UINT, wintypes.WPARAM,
+                                     wintypes.LPARAM)
+        user32.GetParent.restype = wintypes.HWND
+        user32.GetParent.argtypes = [wintypes.HWND]
+        user32.SetWindowLongPtrW.restype = ctypes.c_void_p
+        user32.SetWindowLongPtrW.argtypes = [wintypes.HWND, ctypes.c_int, ctypes.c_void_p]
+        user32.DefWindowProcW.restype = ctypes.c_ssize_t
+        user32.DefWindowProcW.argtypes = [wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM]
+        user32.CallWindowProcW.restype = ctypes.c_ssize_t
+        user32.CallWindowProcW.argtypes = [ctypes.c_void_p, wintypes.HWND, wintypes.UINT, wintypes.WPARAM,
+                                           wintypes.LPARAM]
+        previous = None
+
+        def window_proc(hwnd, message, wparam, lparam):
+            if message == WM_DEVICECHANGE:
+                self.device_registry.request_refresh()
+            if previous is None:
+                return user32.DefWindowProcW(hwnd, message, wparam, lparam)
+            return user32.CallWindowProcW(previous, hwnd, message, wparam, lparam)
+
+        try:
+            # Сообщения получает рамка окна - родитель окна Tk
+            hwnd = user32.GetParent(self.root.winfo_id())
+            # Ссылка на процедуру должна жить, пока живёт окно
+            self.device_change_proc = WNDPROC(window_proc)
+            previous = user32.SetWindowLongPtrW(hwnd, GWLP_WNDPROC,
+                                                ctypes.cast(self.device_change_proc, ctypes.c_void_p))
+        except Exception as e:
+            print(f"Не удалось подписаться на подключение устройств: {e}")
 
     def setup_hotkeys(self):
         """Настройка горячих клавиш с обработкой ошибок"""
@@ -97,6 +264,12 @@ class AudioRecorderApp:
                     self.save_buffer_manually,
                     suppress=True
                 )
+                for index, hotkey in enumerate(self.window_hotkeys):
+                    self.window_hotkey_listeners.append(keyboard.add_hotkey(
+                        hotkey,
+                        lambda index=index: self.root.after(0, lambda: self.save_replay_window(index)),
+                        suppress=True
+                    ))
         except Exception as e:
             messagebox.showerror("Ошибка", f"Проблема с горячими клавишами: {str(e)}")
             self.instant_replay.set(False)
@@ -106,11 +279,40 @@ class AudioRecorderApp:
         """Безопасный вызов toggle_recording из другого потока"""
         self.root.after(0, self.toggle_recording)
 
-    def safe_save_buffer_manually(self):
+    def safe_save_buffer_manually(self, seconds=None):
         """Безопасный вызов save_buffer_manually из другого потока"""
-        self.root.after(0, self.save_buffer_manually)
+        self.root.after(0, lambda: self.save_buffer_manually(seconds))
+
+    def hotkey_in_use(self, hotkey, own):
+        """Название действия, за которым уже закреплена hotkey (кроме own), или None"""
+        assigned = [(self.record_hotkey, "для записи"), (self.hotkey, "для повтора")]
+        assigned += [(window_hotkey, f"для окна повтора {index + 1}")
+                     for index, window_hotkey in enumerate(self.window_hotkeys)]
+        for assigned_hotkey, action in assigned:
+            if assigned_hotkey is not own and assigned_hotkey.lower() == hotkey.lower():
+                return action
+        return None
 
     def set_hotkey(self):
+        def assign(hotkey):
+            self.hotkey = hotkey
+            self.hotkey_btn.config(text=hotkey)
+        self.ask_hotkey("Shift+F10", self.hotkey, assign)
+
+    def set_record_hotkey(self):
+        def assign(hotkey):
+            self.record_hotkey = hotkey
+            self.record_hotkey_btn.config(text=hotkey)
+        self.ask_hotkey("Ctrl+Shift+R", self.record_hotkey, assign)
+
+    def set_window_hotkey(self, index):
+        def assign(hotkey):
+            self.window_hotkeys[index] = hotkey
+            self.window_hotkey_btns[index].config(text=hotkey)
+        self.ask_hotkey("Shift+F7", self.window_hotkeys[index], assign)
+
+    def ask_hotkey(self, example, own, assign):
+        """Диалог выбора комбинации клавиш; assign(комбинация) вызывается после Enter"""
         if self.is_recording:
             messagebox.showwarning("Предупреждение", "Нельзя изменять настройки во время записи")
             return
@@ -120,7 +322,7 @@ class AudioRecorderApp:
         dialog.geometry("400x200")
         
         Label(dialog, text="Нажмите комбинацию клавиш (ТОЛЬКО АНГЛИЙСКИЕ БУКВЫ)").pack(pady=5)
-        Label(dialog, text="(Например: Shift+F10)").pack()
+        Label(dialog, text=f"(Например: {example})").pack()
         Label(dialog, text="Затем нажмите Enter для подтверждения").pack()
         
         key_combination = []
@@ -138,12 +340,12 @@ class AudioRecorderApp:
                 if key_combination:
                     new_hotkey = "+".join(key_combination)
                     
-                    if new_hotkey.lower() == self.record_hotkey.lower():
-                        error_label.config(text="Эта комбинация уже используется для записи!")
+                    action = self.hotkey_in_use(new_hotkey, own)
+                    if action:
+                        error_label.config(text=f"Эта комбинация уже используется {action}!")
                         return
                     
-                    self.hotkey = new_hotkey
-                    self.hotkey_btn.config(text=self.hotkey)
+                    assign(new_hotkey)
                     self.remove_hotkeys()
                     self.setup_hotkeys()
                     dialog.destroy()
@@ -167,63 +369,6 @@ class AudioRecorderApp:
         dialog.grab_set()
         dialog.focus_set()
 
-    def set_record_hotkey(self):
-        if self.is_recording:
-            messagebox.showwarning("Предупреждение", "Нельзя изменять настройки во время записи")
-            return
-            
-        dialog = Toplevel(self.root)
-        dialog.title("Установка горячей клавиши")
-        dialog.geometry("400x200")
-        
-        Label(dialog, text="Нажмите комбинацию клавиш (ТОЛЬКО АНГЛИЙСКИМИ БУКВАМИ)").pack(pady=5)
-        Label(dialog, text="(Например: Ctrl+Shift+R)").pack()
-        Label(dialog, text="Затем нажмите Enter для подтверждения").pack()
-        
-        key_combination = []
-        label = Label(dialog, text="", font=('Arial', 12))
-        label.pack(pady=10)
-        error_label = Label(dialog, text="", fg="red")
-        error_label.pack()
-        
-        def on_key(event):
-            if event.keysym.lower() in ['win_l', 'win_r', 'windows', 'meta_l', 'meta_r', '??']:
-                error_label.config(text="Кнопка запрещена!")
-                return
-                
-            if event.keysym == "Return":
-                if key_combination:
-                    new_hotkey = "+".join(key_combination)
-                    
-                    if new_hotkey.lower() == self.hotkey.lower():
-                        error_label.config(text="Эта комбинация уже используется для повтора!")
-                        return
-                    
-                    self.record_hotkey = new_hotkey
-                    self.record_hotkey_btn.config(text=self.record_hotkey)
-                    self.remove_hotkeys()
-                    self.setup_hotkeys()
-                    dialog.destroy()
-                return
-                
-            key_name = event.keysym.lower()
-            if key_name in ['shift_l', 'shift_r']:
-                key_name = 'shift'
-            elif key_name in ['alt_l', 'alt_r']:
-                key_name = 'alt'
-            elif key_name in ['control_l', 'control_r']:
-                key_name = 'ctrl'
-            
-            if key_name not in key_combination:
-                key_combination.append(key_name)
-                display_keys = [k.upper() for k in key_combination]
-                label.config(text=f"Выбрано: {'+'.join(display_keys)}")
-                error_label.config(text="")
-        
-        dialog.bind("<Key>", on_key)
-        dialog.grab_set()
-        dialog.focus_set()
-
     def validate_input_devices(self):
         """Проверяет доступность выбранных устройств"""
         if not self.device_tree.selection():
@@ -262,6 +407,49 @@ class AudioRecorderApp:
             self.instant_replay.set(False)
             self.setup_hotkeys()
 
+    def toggle_trigger(self):
+        """Включает и выключает запись по уровню сигнала"""
+        if not self.trigger_enabled.get():
+            self.engine.disarm_trigger()
+            self.trigger_status.config(text="")
+            return
+        
+        if not self.validate_input_devices():
+            self.trigger_enabled.set(False)
+            return
+        
+        try:
+            threshold_db = float(self.trigger_threshold_entry.get())
+            hold_seconds = float(self.trigger_hold_entry.get())
+            pre_roll_seconds = float(self.trigger_pre_roll_entry.get())
+            if hold_seconds <= 0 or pre_roll_seconds < 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Ошибка", "Введите корректные порог (дБ), удержание и предзапись (секунды)")
+            self.trigger_enabled.set(False)
+            return
+        
+        self.apply_settings()
+        self.engine.trigger_threshold_db = threshold_db
+        self.engine.trigger_hold_seconds = hold_seconds
+        self.engine.trigger_pre_roll_seconds = pre_roll_seconds
+        try:
+            self.engine.arm_trigger(self.selected_inputs)
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось включить запись по сигналу: {str(e)}")
+            self.trigger_enabled.set(False)
+            return
+        self.setup_meters()
+
+    def update_trigger_status(self):
+        trigger = self.engine.trigger
+        if trigger is None:
+            return
+        if trigger.recording:
+            self.trigger_status.config(text="Запись по сигналу...", fg="red")
+        else:
+            self.trigger_status.config(text=f"Ожидание сигнала (дублей: {trigger.takes})", fg="blue")
+
     def start_buffering(self):
         """Запускает буферизацию с проверкой состояния"""
         if self.is_buffering:
@@ -270,108 +458,40 @@ class AudioRecorderApp:
         if not self.selected_inputs:
             raise ValueError("Не выбраны устройства для буферизации")
         
-        self.is_buffering = True
-        self.buffer_data = {}
-        self.buffer_queue = {}
-        self.buffer_status.config(text=f"Буфер: активен ({self.buffer_duration.get()} мин)", fg="green")
+        self.apply_settings()
+        self.engine.start_buffering(self.selected_inputs)
+        self.update_buffer_status()
         self.save_buffer_btn.config(state="normal")
-        
-        # Останавливаем предыдущий поток, если он есть
-        if self.buffer_thread and self.buffer_thread.is_alive():
-            self.stop_buffering()
-            time.sleep(0.2)
-        
-        self.buffer_thread = threading.Thread(target=self.buffer_audio, daemon=True)
-        self.buffer_thread.start()
+        self.setup_meters()
 
     def stop_buffering(self):
         """Останавливает буферизацию с полной очисткой"""
         if not self.is_buffering:
             return
         
-        self.is_buffering = False
+        self.engine.stop_buffering()
         self.buffer_status.config(text="Буфер: выключен", fg="gray")
         self.save_buffer_btn.config(state="disabled")
-        
-        # Даем время потоку завершиться
-        time.sleep(0.1)
-        
-        # Очищаем данные буфера
-        self.buffer_queue = {}
-        self.buffer_data = {}
 
-    def buffer_audio(self):
-        """Функция буферизации аудио"""
-        sample_rate = 44100
-        buffer_duration_seconds = self.buffer_duration.get() * 60
-        max_samples = int(sample_rate * buffer_duration_seconds)
-        
-        self.buffer_queue = {idx: deque(maxlen=max_samples) for idx in self.selected_inputs}
-        
-        def callback(indata, frames, time, status, device_idx):
-            if self.is_buffering and device_idx in self.buffer_queue:
-                self.buffer_queue[device_idx].extend(indata.copy())
-        
-        self.buffer_streams = []
-        try:
-            for device_idx in self.selected_inputs:
-                device_info = sd.query_devices(device_idx)
-                channels = min(2, device_info['max_input_channels'])
-                
-                stream = sd.InputStream(
-                    device=device_idx,
-                    channels=channels,
-                    samplerate=sample_rate,
-                    callback=lambda indata, frames, time, status, idx=device_idx: callback(indata, frames, time, status, idx),
-                    dtype='float32'
-                )
-                self.buffer_streams.append(stream)
-                stream.start()
-            
-            while self.is_buffering:
-                time.sleep(0.1)
-            
-        except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("Ошибка буферизации", str(e)))
-        finally:
-            for stream in self.buffer_streams:
-                try:
-                    stream.stop()
-                    stream.close()
-                except:
-                    pass
-            self.buffer_streams = []
-
-    def save_buffer_manually(self):
-        if not self.is_buffering or not self.buffer_queue:
+    def save_buffer_manually(self, seconds=None):
+        """Сохраняет последние seconds секунд буфера (по умолчанию весь буфер)"""
+        if not self.is_buffering or not self.engine.buffer_queue:
             messagebox.showwarning("Предупреждение", "Буферизация не активна или данные отсутствуют")
             return
         
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        saved_files = []
-        
-        for device_idx, data_queue in self.buffer_queue.items():
-            if not data_queue:
-                continue
-                
-            try:
-                device_name = sd.query_devices(device_idx)['name']
-                safe_name = "".join(c if c.isalnum() else "_" for c in device_name)
-                filename = f"buffer_{safe_name}_{timestamp}.wav"
-                filepath = os.path.join(self.output_dir, filename)
-                
-                channels = min(2, sd.query_devices(device_idx)['max_input_channels'])
-                audio_data = np.array(list(data_queue)).reshape(-1, channels)
-                sf.write(filepath, audio_data, 44100, format='WAV')
-                saved_files.append(filepath)  # Сохраняем полный путь
-            except Exception as e:
-                messagebox.showerror("Ошибка сохранения", 
-                                   f"Не удалось сохранить буфер с устройства {device_idx}:\n{str(e)}")
-        
-        if saved_files:
-            messagebox.showinfo("Готово", 
-                              f"Буфер успешно сохранен по пути:\n{self.output_dir}\n\n"
-                              f"Сохраненные файлы:\n{'\n'.join(saved_files)}")
+        self.engine.output_format = self.output_format.get()
+        self.engine.save_buffer(seconds)
+
+    def save_replay_window(self, index):
+        """Сохраняет окно повтора index - последние N секунд общего буфера"""
+        try:
+            seconds = float(self.window_seconds[index].get())
+            if seconds <= 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Ошибка", f"Введите длительность окна повтора {index + 1} в секундах")
+            return
+        self.save_buffer_manually(seconds)
 
     def start_recording(self):
         """Начинает запись с проверкой устройств"""
@@ -380,29 +500,34 @@ class AudioRecorderApp:
             messagebox.showerror("Ошибка", "Выберите хотя бы одно устройство для записи")
             return
         
-        self.selected_inputs = set()
-        valid_devices = []
-        invalid_devices = []
+        try:
+            if self.use_timer.get():
+                self.countdown_seconds = int(self.timer_entry.get())
+                if self.countdown_seconds <= 0:
+                    raise ValueError
+            else:
+                self.countdown_seconds = 0
+        except ValueError:
+            messagebox.showerror("Ошибка", "Введите корректное значение таймера (положительное число)")
+            return
         
-        for item in selected_items:
-            values = self.device_tree.item(item, 'values')
-            device_idx = int(values[0])
-            device_name = values[1]
-            
-            try:
-                # Проверяем, что устройство действительно доступно для записи
-                device_info = sd.query_devices(device_idx)
-                if device_info['max_input_channels'] > 0:
-                    # Проверяем, что устройство можно открыть
-                    test_stream = sd.InputStream(device=device_idx, channels=1, samplerate=44100)
-                    test_stream.close()
-                    self.selected_inputs.add(device_idx)
-                    valid_devices.append(device_name)
-                else:
-                    invalid_devices.append(device_name)
-            except Exception as e:
-                invalid_devices.append(f"{device_name} (ошибка: {str(e)})")
-                continue
+        try:
+            if self.segmented.get():
+                segment_minutes = int(self.segment_minutes_entry.get() or 0)
+                segment_megabytes = int(self.segment_mb_entry.get() or 0)
+                if segment_minutes < 0 or segment_megabytes < 0 or not (segment_minutes or segment_megabytes):
+                    raise ValueError
+                # WAV не может быть больше 4 ГБ
+                segment_megabytes = min(segment_megabytes or 4000, 4000)
+                self.segment_limits = (segment_minutes * 60 or None, segment_megabytes * 1024 * 1024)
+        except ValueError:
+            messagebox.showerror("Ошибка", "Введите корректный размер сегмента (минуты и/или МБ)")
+            return
+        
+        self.apply_settings()
+        device_ids = [int(self.device_tree.item(item, 'values')[0]) for item in selected_items]
+        device_formats, invalid_devices = self.engine.prepare_devices(device_ids)
+        self.selected_inputs = set(device_formats)
         
         if not self.selected_inputs:
             messagebox.showerror("Ошибка", 
@@ -413,20 +538,12 @@ class AudioRecorderApp:
             messagebox.showwarning("Предупреждение", 
                 f"Следующие устройства не будут записаны:\n{', '.join(invalid_devices)}")
         
-        # Остальная часть метода остается без изменений
         try:
-            if self.use_timer.get():
-                self.countdown_seconds = int(self.timer_entry.get())
-                if self.countdown_seconds <= 0:
-                    raise ValueError
-            else:
-                self.countdown_seconds = 0
-        except ValueError:
-            messagebox.showerror("Ошибка", "Введите корректное значение таймера (положительное число)")
+            self.engine.start_recording(self.selected_inputs, device_formats,
+                                        duration=self.countdown_seconds or None)
+        except ValueError as e:
+            messagebox.showerror("Ошибка", f"Нельзя объединить устройства в один файл: {str(e)}")
             return
-        
-        self.audio_data = {idx: [] for idx in self.selected_inputs}
-        self.is_recording = True
         self.record_btn.config(state="disabled")
         self.stop_btn.config(state="normal")
         self.status_label.config(text="Запись...")
@@ -436,11 +553,9 @@ class AudioRecorderApp:
         
         if self.countdown_seconds > 0:
             self.timer_label.config(text=f"Таймер: {self.countdown_seconds} сек")
-            self.timer_thread = threading.Thread(target=self.countdown_timer, daemon=True)
-            self.timer_thread.start()
+            self.update_timer_display()
         
-        self.recording_thread = threading.Thread(target=self.record_audio, daemon=True)
-        self.recording_thread.start()
+        self.setup_meters()
 
     def treeview_sort_column(self, col, reverse):
         """Сортировка Treeview по колонке"""
@@ -461,97 +576,227 @@ class AudioRecorderApp:
 
     def stop_recording(self):
         """Останавливает запись"""
-        self.is_recording = False
+        self.engine.stop_recording()
+        if self.timer_job is not None:
+            self.root.after_cancel(self.timer_job)
+            self.timer_job = None
         self.stop_buffering()
         self.status_label.config(text="Запись остановлена")
         self.record_btn.config(state="normal")
         self.stop_btn.config(state="disabled")
 
-    def record_audio(self):
-        """Функция записи аудио"""
-        sample_rate = 44100
-        self.streams = []
-        
-        try:
-            for device_idx in self.selected_inputs:
-                device_info = sd.query_devices(device_idx)
-                channels = min(2, device_info['max_input_channels'])
-                
-                def make_callback(idx):
-                    return lambda indata, frames, time, status: self.audio_callback(indata, idx)
-                
-                stream = sd.InputStream(
-                    device=device_idx,
-                    channels=channels,
-                    samplerate=sample_rate,
-                    callback=make_callback(device_idx),
-                    dtype='float32'
-                )
-                self.streams.append(stream)
-                stream.start()
-            
-            while self.is_recording:
-                time.sleep(0.1)
-            
-        except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("Ошибка записи", str(e)))
-        finally:
-            for stream in self.streams:
-                try:
-                    stream.stop()
-                    stream.close()
-                except:
-                    pass
-            
-            self.root.after(0, self.save_audio_files, sample_rate)
+    def setup_meters(self):
+        """Строит индикаторы уровня для выбранных устройств"""
+        if set(self.meters.devices()) == self.selected_inputs:
+            return
+        self.meters.set_devices(self.selected_inputs)
+        for widgets in self.meter_rows.values():
+            widgets[0].destroy()
+        self.meter_rows = {}
+        
+        for device_idx in sorted(self.selected_inputs):
+            row = Frame(self.meters_frame)
+            row.pack(fill="x")
+            Label(row, text=self.device_registry.get(device_idx)['name'], width=35, anchor="w").pack(side="left")
+            canvas = Canvas(row, width=300, height=12, bg="black", highlightthickness=0)
+            canvas.pack(side="left", padx=5)
+            rms_bar = canvas.create_rectangle(0, 0, 0, 12, fill="#4CAF50", width=0)
+            peak_line = canvas.create_line(0, 0, 0, 12, fill="yellow")
+            value_label = Label(row, text="", width=18, anchor="w")
+            value_label.pack(side="left")
+            self.meter_rows[device_idx] = (row, canvas, rms_bar, peak_line, value_label)
 
-    def audio_callback(self, indata, device_idx):
-        """Callback для записи аудиоданных"""
-        if self.is_recording:
-            self.audio_data[device_idx].append(indata.copy())
+    def poll_meters(self):
+        """Обновляет индикаторы уровня (~30 раз в секунду)"""
+        floor = LevelMeters.FLOOR_DB
+        for device_idx, (peak, rms) in self.meters.read().items():
+            widgets = self.meter_rows.get(device_idx)
+            if widgets is None:
+                continue
+            _, canvas, rms_bar, peak_line, value_label = widgets
+            width = int(canvas['width'])
+            peak_db = LevelMeters.to_db(peak)
+            rms_db = LevelMeters.to_db(rms)
+            rms_x = width * (rms_db - floor) / -floor
+            peak_x = width * (peak_db - floor) / -floor
+            canvas.coords(rms_bar, 0, 0, rms_x, 12)
+            canvas.coords(peak_line, peak_x, 0, peak_x, 12)
+            canvas.itemconfig(peak_line, fill="red" if peak >= 0.999 else "yellow")
+            if self.is_recording or self.is_buffering or self.engine.trigger is not None:
+                value_label.config(text=f"пик {peak_db:.1f} / RMS {rms_db:.1f} дБ")
+            else:
+                value_label.config(text="")
+        self.update_trigger_status()
+        self.root.after(33, self.poll_meters)
 
-    def save_audio_files(self, sample_rate):
-        """Сохраняет записанные аудиофайлы"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        saved_files = []
+    def show_metrics(self):
+        """Открывает окно с метриками потоков текущего дубля и буфера"""
+        if self.metrics_window is not None and self.metrics_window.winfo_exists():
+            self.metrics_window.lift()
+            return
         
-        for device_idx, data_list in self.audio_data.items():
-            if not data_list:
-                continue
-                
+        self.metrics_window = window = Toplevel(self.root)
+        window.title("Метрики потоков")
+        window.geometry("980x300")
+        columns = ('source', 'device', 'callbacks', 'overflows', 'underflows', 'callback_ms',
+                   'latency_ms', 'blocks', 'queue', 'dropped', 'first_sample')
+        headings = ('Поток', 'Устройство', 'Вызовы', 'Overflow', 'Underflow', 'Callback, мс (ср/макс)',
+                    'Задержка АЦП, мс', 'Блоки', 'Очередь (тек/макс)', 'Потеряно', 'Первый сэмпл, мс')
+        tree = ttk.Treeview(window, columns=columns, show='headings')
+        for column, heading in zip(columns, headings):
+            tree.heading(column, text=heading)
+            tree.column(column, width=80, anchor='center')
+        tree.column('device', width=200, anchor='w')
+        tree.pack(fill="both", expand=True)
+        
+        def export():
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             try:
-                device_name = sd.query_devices(device_idx)['name']
-                safe_name = "".join(c if c.isalnum() else "_" for c in device_name)
-                filename = f"recording_{safe_name}_{timestamp}.wav"
-                filepath = os.path.join(self.output_dir, filename)
-                
-                audio_data = np.concatenate(data_list)
-                sf.write(filepath, audio_data, sample_rate, format='WAV')
-                saved_files.append(filepath)  # Сохраняем полный путь
+                self.engine.take_metrics.export(os.path.join(self.output_dir, f"metrics_{timestamp}"))
+                if self.engine.buffer_metrics.devices:
+                    self.engine.buffer_metrics.export(os.path.join(self.output_dir, f"metrics_buffer_{timestamp}"))
+                messagebox.showinfo("Готово", f"Метрики сохранены в {self.output_dir}", parent=window)
             except Exception as e:
-                messagebox.showerror("Ошибка сохранения", 
-                    f"Не удалось сохранить запись с устройства {device_idx}:\n{str(e)}")
+                messagebox.showerror("Ошибка", str(e), parent=window)
+        
+        Button(window, text="Экспорт JSON/CSV", command=export).pack(pady=5)
         
+        def refresh():
+            if not window.winfo_exists():
+                return
+            tree.delete(*tree.get_children())
+            sources = [("Запись", self.engine.take_metrics), ("Буфер", self.engine.buffer_metrics)]
+            if self.engine.trigger is not None:
+                sources.append(("По сигналу", self.engine.trigger.metrics))
+            for source, metrics in sources:
+                for row in metrics.summary():
+                    tree.insert('', 'end', values=(
+                        source, f"{row['device']}: {row['name']}", row['callbacks'],
+                        row['input_overflows'], row['input_underflows'],
+                        f"{row['callback_ms_avg']:.3f} / {row['callback_ms_max']:.3f}",
+                        f"{row['latency_ms_avg']:.1f} / {row['latency_ms_max']:.1f}",
+                        row['block_sizes'], f"{row['queue_depth']} / {row['queue_depth_max']}",
+                        row['dropped_blocks'],
+                        "" if row['first_sample_ms'] is None else f"{row['first_sample_ms']:.0f}"))
+            window.after(500, refresh)
+        
+        refresh()
+
+    def poll_save_jobs(self):
+        """Забирает из очереди события сохранения и обновляет GUI"""
+        try:
+            while True:
+                event, job = self.save_jobs.events.get_nowait()
+                if event == 'progress':
+                    self.save_status.config(
+                        text=f"Сохранение ({job['title']}): {job['done']}/{job['total']}", fg="blue")
+                elif event == 'finished':
+                    self.on_save_job_finished(job)
+        except queue.Empty:
+            pass
+        self.root.after(100, self.poll_save_jobs)
+
+    def on_save_job_finished(self, job):
+        """Сообщает о результатах завершённого сохранения"""
+        if not self.save_jobs.active_jobs():
+            self.save_status.config(text="", fg="gray")
+            if not self.is_recording:
+                self.status_label.config(text="Готов к записи")
+        saved_files = []
+        for result in job['results']:
+            segments = result.get('segments') or [os.path.basename(result['path'])]
+            saved_files += [os.path.join(self.output_dir, name) for name in segments]
+        problems = [result['warning'] for result in job['results'] if result.get('warning')]
+        problems += [f"Устройство {name}: {error}" for name, error in job['errors']]
+        
+        if problems:
+            messagebox.showerror("Ошибка сохранения", "\n".join(problems))
         if saved_files:
-            messagebox.showinfo("Готово", 
-                f"Аудиофайлы успешно сохранены по пути:\n{self.output_dir}\n\n"
-                f"Сохраненные файлы:\n{'\n'.join(saved_files)}")
+            files_list = "\n".join(saved_files)
+            messagebox.showinfo("Готово",
+                f"{job['done_text']} по пути:\n{self.output_dir}\n\n"
+                f"Сохраненные файлы:\n{files_list}")
+
+    def recover_interrupted_segments(self):
+        """Чинит сегменты, оставшиеся недописанными после аварийного завершения"""
+        try:
+            recovered, failed = self.engine.recover_interrupted_segments()
+        except Exception as e:
+            print(f"Ошибка проверки сегментов: {e}")
+            return
         
-        self.audio_data = {}
-        self.root.after(0, lambda: self.status_label.config(text="Готов к записи"))
+        if recovered or failed:
+            message = "Найдены недописанные сегменты прошлых записей.\n"
+            if recovered:
+                message += "\nВосстановлены:\n" + "\n".join(recovered)
+            if failed:
+                message += "\n\nНе удалось восстановить:\n" + "\n".join(failed)
+            self.root.after(0, lambda: messagebox.showwarning("Восстановление записей", message))
 
-    def countdown_timer(self):
-        while self.countdown_seconds > 0 and self.is_recording:
-            time.sleep(1)
-            self.countdown_seconds -= 1
-            self.root.after(0, self.update_timer_display, self.countdown_seconds)
+    def measure_output_formats(self):
+        """Замеряет скорость кодирования каждого формата для выбранных устройств"""
+        sample_format = self.sample_format.get()
+        formats = []
+        for item in self.device_tree.selection():
+            device_idx = int(self.device_tree.item(item, 'values')[0])
+            try:
+                formats.append(self.device_registry.probe(device_idx, sample_format))
+            except Exception:
+                continue
+        if not formats:
+            dtype, subtype = SAMPLE_FORMATS[sample_format]
+            formats = [{'name': '', 'samplerate': 48000, 'channels': 2, 'dtype': dtype, 'subtype': subtype}]
+        total_channels = sum(fmt['channels'] for fmt in formats)
+        self.apply_settings()
+        session_format = self.engine.session_format
+        
+        def measure():
+            lines = []
+            for output_format in OUTPUT_FORMATS:
+                try:
+                    results = [measure_encoder_throughput(output_format, session_format(fmt)) for fmt in formats]
+                except Exception as e:
+                    lines.append(f"{output_format}: не поддерживается ({e})")
+                    continue
+                # Все дорожки кодируются одновременно: складываем затраты времени
+                realtime = 1 / sum(1 / r['realtime'] for r in results)
+                size = sum(r['bytes_per_second'] for r in results) / 1024
+                mark = "" if realtime > 1.5 else "  - не успевает!"
+                lines.append(f"{output_format}: x{realtime:.1f} реального времени, {size:.0f} КБ/с{mark}")
+            
+            # Передискретизация идёт в своём потоке на устройство, отдельно от кодека
+            for fmt in formats:
+                target = session_format(fmt)['samplerate']
+                if target == fmt['samplerate']:
+                    continue
+                result = measure_resampler_throughput(fmt['samplerate'], target, fmt['channels'])
+                lines.append(f"Передискретизация {fmt['name'] or 'по умолчанию'} {fmt['samplerate']} -> {target} Гц: "
+                             f"x{result['realtime']:.1f}, {result['cpu_per_channel'] * 100:.2f}% ядра на канал")
+            
+            self.root.after(0, lambda: messagebox.showinfo(
+                "Скорость кодеков",
+                f"Устройств: {len(formats)}, каналов: {total_channels}\n\n" + "\n".join(lines)))
         
-        if self.countdown_seconds <= 0 and self.is_recording:
-            self.root.after(0, self.stop_recording)
+        threading.Thread(target=measure, daemon=True).start()
 
-    def update_timer_display(self, seconds):
-        """Обновляет отображение таймера"""
-        self.timer_label.config(text=f"Таймер: {seconds} сек")
+    def on_engine_state(self, what, state):
+        """Дубль по таймеру движок останавливает сам: окно только догоняет его"""
+        if what == 'recording' and state == FLUSHING and str(self.stop_btn['state']) == "normal":
+            self.stop_recording()
+
+    def update_timer_display(self):
+        """Обновляет отображение таймера.
+
+        Остаток считает движок по записанным кадрам; следующее обновление
+        ставится на момент, когда сменится целая секунда.
+        """
+        self.timer_job = None
+        seconds_left = self.engine.timer_seconds_left()
+        if seconds_left is None or not self.is_recording:
+            return
+        self.timer_label.config(text=f"Таймер: {math.ceil(seconds_left)} сек")
+        fraction = seconds_left - math.floor(seconds_left)
+        self.timer_job = self.root.after(int(fraction * 1000) + 5 if fraction else 1000, self.update_timer_display)
 
     def toggle_timer_entry(self):
         if self.use_timer.get():
@@ -569,8 +814,11 @@ class AudioRecorderApp:
 
     def update_device_list(self):
         """Обновляет список устройств с возможностью сортировки"""
+        if not self.device_registry.ready:
+            # Список заполнит слушатель реестра, когда фоновый опрос закончится
+            return
         self.device_tree.delete(*self.device_tree.get_children())
-        devices = sd.query_devices()
+        devices = self.device_registry.all()
         
         for i, dev in enumerate(devices):
             # Пропускаем чисто выходные устройства
@@ -648,6 +896,56 @@ class AudioRecorderApp:
         self.dir_entry.insert(0, self.output_dir)
         Button(dir_frame, text="Обзор...", command=self.browse_directory).pack(side="left")
         
+        # Потоковая запись сразу на диск
+        Checkbutton(settings_frame, text="Писать на диск во время записи", variable=self.stream_to_disk).pack(anchor="w")
+        Checkbutton(settings_frame, text="Объединять устройства в один многоканальный файл",
+                    variable=self.aggregate).pack(anchor="w")
+        Checkbutton(settings_frame, text="Сохранять метрики дубля (JSON/CSV)", variable=self.export_metrics).pack(anchor="w")
+        Checkbutton(settings_frame, text="Писать обзор волны для быстрого просмотра (.peaks)",
+                    variable=self.write_peaks).pack(anchor="w")
+        Checkbutton(settings_frame, text="Анализировать дубль: громкость, пики, клиппинг, паузы",
+                    variable=self.analyze_takes).pack(anchor="w")
+        Checkbutton(settings_frame, text="Упаковывать дубль с манифестом в один архив (.tar)",
+                    variable=self.archive_takes).pack(anchor="w")
+        
+        # Сегментная запись с защитой от сбоев
+        segment_frame = Frame(settings_frame)
+        segment_frame.pack(anchor="w", pady=2)
+        Checkbutton(segment_frame, text="Разбивать на сегменты: каждые", variable=self.segmented).pack(side="left")
+        self.segment_minutes_entry = Entry(segment_frame, width=5)
+        self.segment_minutes_entry.pack(side="left")
+        self.segment_minutes_entry.insert(0, "10")
+        Label(segment_frame, text="мин или").pack(side="left", padx=5)
+        self.segment_mb_entry = Entry(segment_frame, width=6)
+        self.segment_mb_entry.pack(side="left")
+        self.segment_mb_entry.insert(0, "1024")
+        Label(segment_frame, text="МБ").pack(side="left", padx=5)
+        Checkbutton(settings_frame, text="Выравнивать дорожки по времени", variable=self.align_tracks).pack(anchor="w")
+        Checkbutton(settings_frame, text="Корректировать дрейф частоты", variable=self.correct_drift).pack(anchor="w")
+        
+        # Формат хранения сэмплов
+        format_frame = Frame(settings_frame)
+        format_frame.pack(anchor="w", pady=2)
+        Label(format_frame, text="Формат сэмплов:").pack(side="left")
+        ttk.Combobox(format_frame, textvariable=self.sample_format, values=list(SAMPLE_FORMATS),
+                     state="readonly", width=10).pack(side="left", padx=5)
+        Label(format_frame, text="Формат файла:").pack(side="left", padx=(10, 0))
+        ttk.Combobox(format_frame, textvariable=self.output_format, values=list(OUTPUT_FORMATS),
+                     state="readonly", width=12).pack(side="left", padx=5)
+        Button(format_frame, text="Скорость кодеков", command=self.measure_output_formats).pack(side="left")
+        rate_frame = Frame(settings_frame)
+        rate_frame.pack(anchor="w", pady=2)
+        Label(rate_frame, text="Частота файлов, Гц:").pack(side="left")
+        ttk.Combobox(rate_frame, textvariable=self.session_rate, values=list(self.SESSION_RATES),
+                     state="readonly", width=10).pack(side="left", padx=5)
+        Label(rate_frame, text="(устройства пишутся на родной частоте и передискретизируются)").pack(side="left")
+        processes_frame = Frame(settings_frame)
+        processes_frame.pack(anchor="w", pady=2)
+        Label(processes_frame, text="Процессов захвата:").pack(side="left")
+        ttk.Combobox(processes_frame, textvariable=self.capture_processes, values=list(self.CAPTURE_PROCESSES),
+                     state="readonly", width=10).pack(side="left", padx=5)
+        Label(processes_frame, text="(0 - в этом процессе; больше - для десятка устройств и более)").pack(side="left")
+        
         # Настройки мгновенного повтора
         replay_frame = LabelFrame(main_frame, text="Мгновенный повтор", padx=5, pady=5)
         replay_frame.pack(fill="x", pady=5)
@@ -663,6 +961,22 @@ class AudioRecorderApp:
                                 variable=self.buffer_duration, command=self.on_buffer_duration_change)
         self.buffer_slider.pack(side="left", fill="x", expand=True, padx=5)
         Label(buffer_frame, text="мин").pack(side="left")
+        Checkbutton(replay_frame, text="Хранить буфер на диске (до 4 часов)", variable=self.buffer_on_disk,
+                  command=self.toggle_buffer_on_disk).pack(anchor="w")
+        
+        # Окна повтора: длительность и горячая клавиша; буфер растёт до самого длинного окна
+        windows_frame = Frame(replay_frame)
+        windows_frame.pack(fill="x", pady=2)
+        Label(windows_frame, text="Окна повтора, с:").pack(side="left")
+        for index, seconds in enumerate(self.window_seconds):
+            entry = Entry(windows_frame, textvariable=seconds, width=6)
+            entry.pack(side="left", padx=(5, 0))
+            entry.bind("<Return>", self.on_buffer_duration_change)
+            entry.bind("<FocusOut>", self.on_buffer_duration_change)
+            hotkey_btn = Button(windows_frame, text=self.window_hotkeys[index], width=10,
+                                command=lambda index=index: self.set_window_hotkey(index))
+            hotkey_btn.pack(side="left", padx=2)
+            self.window_hotkey_btns.append(hotkey_btn)
         
         # Горячие клавиши (фиксированного размера)
         hotkey_frame = Frame(replay_frame)
@@ -676,6 +990,29 @@ class AudioRecorderApp:
         self.record_hotkey_btn = Button(hotkey_frame, text=self.record_hotkey, command=self.set_record_hotkey, width=15)
         self.record_hotkey_btn.pack(side="left", padx=5)
         
+        # Запись по уровню сигнала
+        trigger_frame = LabelFrame(main_frame, text="Запись по сигналу", padx=5, pady=5)
+        trigger_frame.pack(fill="x", pady=5)
+        
+        trigger_settings = Frame(trigger_frame)
+        trigger_settings.pack(fill="x")
+        Checkbutton(trigger_settings, text="Включить", variable=self.trigger_enabled,
+                  command=self.toggle_trigger).pack(side="left")
+        Label(trigger_settings, text="Порог, дБ:").pack(side="left", padx=(10, 0))
+        self.trigger_threshold_entry = Entry(trigger_settings, width=6)
+        self.trigger_threshold_entry.pack(side="left", padx=5)
+        self.trigger_threshold_entry.insert(0, "-40")
+        Label(trigger_settings, text="Удержание, с:").pack(side="left")
+        self.trigger_hold_entry = Entry(trigger_settings, width=5)
+        self.trigger_hold_entry.pack(side="left", padx=5)
+        self.trigger_hold_entry.insert(0, "2")
+        Label(trigger_settings, text="Предзапись, с:").pack(side="left")
+        self.trigger_pre_roll_entry = Entry(trigger_settings, width=5)
+        self.trigger_pre_roll_entry.pack(side="left", padx=5)
+        self.trigger_pre_roll_entry.insert(0, "2")
+        self.trigger_status = Label(trigger_frame, text="", fg="blue")
+        self.trigger_status.pack(anchor="w")
+        
         # Управление записью
         control_frame = Frame(main_frame)
         control_frame.pack(fill="x", pady=5)
@@ -701,6 +1038,12 @@ class AudioRecorderApp:
                                       height=btn_height, font=btn_font)
         self.toggle_devices_btn.pack(side="left", expand=True, fill="x", padx=2)
         
+        Button(control_frame, text="Обновить список", command=self.device_registry.request_refresh,
+               height=btn_height, font=btn_font).pack(side="left", expand=True, fill="x", padx=2)
+        
+        Button(control_frame, text="Метрики", command=self.show_metrics,
+               height=btn_height, font=btn_font).pack(side="left", expand=True, fill="x", padx=2)
+        
         # Статус
         self.status_label = Label(main_frame, text="Готов к записи", relief="sunken", anchor="w")
         self.status_label.pack(fill="x", pady=5)
@@ -708,12 +1051,24 @@ class AudioRecorderApp:
         self.timer_label.pack(fill="x")
         self.buffer_status = Label(main_frame, text="Буфер: выключен", fg="gray")
         self.buffer_status.pack(fill="x")
+        self.save_status = Label(main_frame, text="", fg="gray")
+        self.save_status.pack(fill="x")
+        
+        # Индикаторы уровня входов
+        self.meters_frame = LabelFrame(main_frame, text="Уровни входов", padx=5, pady=5)
+        self.meters_frame.pack(fill="x", pady=5)
 
 if __name__ == "__main__":
+    # Процессы захвата запускаются через spawn, в том числе из собранного exe;
+    # без сборки freeze_support ничего не делает, и multiprocessing не нужен при запуске
+    if getattr(sys, 'frozen', False):
+        import multiprocessing
+        multiprocessing.freeze_support()
     root = Tk()
     app = AudioRecorderApp(root)
     
     try:
         root.mainloop()
     finally:
-        keyboard.unhook_all()
\ No newline at end of file
+        if keyboard.loaded:
+            keyboard.unhook_all()
\ No newline at end of file
@@ -0,0 +1,44 @@
+"""Ядро многодорожечного рекордера без зависимости от GUI.
+
+Имена пакета загружаются при первом обращении (PEP 562): from recorder
+import CaptureEngine импортирует только нужный модуль, а анализ, рабочие
+процессы и замеры с их multiprocessing - когда они понадобятся.
+"""
+
+import importlib
+
+_EXPORTS = {
+    'analysis': ('TakeAnalyzer', 'analyze_file'),
+    'alignment': ('LinearResampler', 'TakeAligner', 'correct_drift_file'),
+    'buffers': ('RingBuffer',),
+    'devices': ('SAMPLE_FORMATS', 'DeviceRegistry', 'probe_device'),
+    'engine': ('CaptureEngine',),
+    'jobs': ('SaveJobManager',),
+    'lazy': ('LazyModule',),
+    'lifecycle': ('ARMING', 'FLUSHING', 'IDLE', 'RECORDING', 'Lifecycle'),
+    'manifest': ('ChecksumFile', 'archive_take', 'verify_take'),
+    'metering': ('LevelMeters', 'StreamMetrics'),
+    'peaks': ('PeakFile', 'PeakWriter'),
+    'resampling': ('PolyphaseResampler', 'ResamplingStage', 'measure_resampler_throughput'),
+    'trigger': ('TriggeredRecorder',),
+    'workers': ('CapturePool', 'SharedRingBuffer'),
+    'writers': ('OPUS_SAMPLERATES', 'OUTPUT_FORMATS', 'AggregateTrackWriter', 'SegmentedTrackWriter',
+                'StreamingTrackWriter', 'aggregate_format', 'measure_encoder_throughput', 'recover_segments',
+                'repair_wav_header', 'resolve_output_format'),
+}
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = sorted(_MODULES)
+
+
+def __getattr__(name):
+    module = _MODULES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
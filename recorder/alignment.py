@@ -0,0 +1,182 @@
+"""Выравнивание дорожек дубля и коррекция дрейфа часов"""
+
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+from .lazy import LazyModule
+
+sf = LazyModule('soundfile')
+
+
+class TakeAligner:
+    """Выравнивание дорожек одного дубля по общему времени АЦП.
+
+    Время АЦП каждого блока (time.inputBufferAdcTime) переводится из часов
+    потока PortAudio в общие часы процесса (time.perf_counter). По нему
+    оцениваются момент первого сэмпла каждой дорожки и реальная частота
+    дискретизации устройства. Все дорожки дополняются тишиной в начале до
+    самого раннего старта, так что у всех файлов общий нулевой сэмпл.
+    """
+
+    SETTLE_BLOCKS = 16     # по скольким первым блокам оценивается старт
+    SETTLE_TIMEOUT = 1.0   # сколько ждать устройства, не приславшие данных
+    WINDOW_BLOCKS = 64     # окно оценки времени в конце дубля
+    MIN_DRIFT_SECONDS = 10.0
+
+    def __init__(self):
+        self.tracks = {}
+        self.first_block_time = None
+        self.wall_offset = time.time() - time.perf_counter()
+
+    def add_track(self, device_idx, samplerate):
+        self.tracks[device_idx] = {
+            'samplerate': samplerate,
+            'frames': 0,
+            'blocks': 0,
+            'start': None,
+            'window': None,
+            'last_window': None,
+        }
+
+    def on_block(self, device_idx, frames, time_info=None):
+        """Вызывается из callback: оценивает время первого сэмпла дорожки.
+
+        Блоки из процесса захвата несут время своего callback в host_time.
+        """
+        now = getattr(time_info, 'host_time', None) or time.perf_counter()
+        track = self.tracks[device_idx]
+        samplerate = track['samplerate']
+        if time_info is not None and time_info.currentTime and time_info.inputBufferAdcTime:
+            adc_time = now - (time_info.currentTime - time_info.inputBufferAdcTime)
+        else:
+            adc_time = now - frames / samplerate
+
+        # Задержка вызова callback только сдвигает оценку вправо,
+        # поэтому берём минимум по нескольким блокам
+        start = adc_time - track['frames'] / samplerate
+        if track['blocks'] < self.SETTLE_BLOCKS:
+            if track['start'] is None or start < track['start']:
+                track['start'] = start
+        else:
+            window = track['window']
+            if window is None or start < window[0]:
+                track['window'] = window = (start, track['frames'])
+            if track['blocks'] % self.WINDOW_BLOCKS == 0:
+                track['last_window'] = window
+                track['window'] = None
+
+        track['frames'] += frames
+        track['blocks'] += 1
+        if self.first_block_time is None:
+            self.first_block_time = now
+
+    def is_ready(self):
+        """Оценки старта всех дорожек готовы"""
+        if all(t['blocks'] >= self.SETTLE_BLOCKS for t in self.tracks.values()):
+            return True
+        return (self.first_block_time is not None
+                and time.perf_counter() - self.first_block_time > self.SETTLE_TIMEOUT)
+
+    def common_start(self):
+        starts = [t['start'] for t in self.tracks.values() if t['start'] is not None]
+        return min(starts) if starts else None
+
+    def offset_frames(self, device_idx, force=False):
+        """Сколько кадров тишины нужно добавить в начало дорожки (None - ещё рано)"""
+        if not force and not self.is_ready():
+            return None
+        track = self.tracks[device_idx]
+        common_start = self.common_start()
+        if track['start'] is None or common_start is None:
+            return 0
+        return int(round((track['start'] - common_start) * track['samplerate']))
+
+    def measured_samplerate(self, device_idx):
+        """Реальная частота устройства по часам процесса (None - мало данных)"""
+        track = self.tracks[device_idx]
+        window = track['window'] or track['last_window']
+        if track['start'] is None or window is None:
+            return None
+        start, frames = window
+        elapsed = frames / track['samplerate']
+        if elapsed < self.MIN_DRIFT_SECONDS:
+            return None
+        # start смещается на frames * (1/реальная - 1/номинальная)
+        return frames / (elapsed + start - track['start'])
+
+    def drift_factor(self, device_idx):
+        """Во сколько раз растянуть дорожку, чтобы она шла по часам опорной"""
+        rates = {idx: self.measured_samplerate(idx) for idx in self.tracks}
+        reference = next((idx for idx in self.tracks if rates[idx]), None)
+        if reference is None or not rates[device_idx]:
+            return 1.0
+        track = self.tracks[device_idx]
+        ref_track = self.tracks[reference]
+        ref_ratio = rates[reference] / ref_track['samplerate']
+        return ref_ratio * track['samplerate'] / rates[device_idx]
+
+    def describe(self, device_idx):
+        """Сведения о дорожке для файла описания дубля"""
+        track = self.tracks[device_idx]
+        measured = self.measured_samplerate(device_idx)
+        return {
+            'samplerate': track['samplerate'],
+            'frames_captured': track['frames'],
+            'offset_frames': self.offset_frames(device_idx, force=True),
+            'measured_samplerate': measured,
+            'drift_ppm': (measured / track['samplerate'] - 1) * 1e6 if measured else None,
+        }
+
+    def start_time(self):
+        """Время общего нулевого сэмпла дубля в формате ISO"""
+        common_start = self.common_start()
+        if common_start is None:
+            return None
+        return datetime.fromtimestamp(common_start + self.wall_offset).isoformat(timespec='microseconds')
+
+
+class LinearResampler:
+    """Потоковая линейная передискретизация с постоянным коэффициентом.
+
+    Используется для коррекции дрейфа часов устройства, где коэффициент
+    отличается от единицы на десятки ppm.
+    """
+
+    def __init__(self, factor):
+        self.step = 1.0 / factor
+        self.position = 0.0
+        self.carry = None
+
+    def process(self, block):
+        buf = block if self.carry is None else np.concatenate((self.carry, block))
+        last = len(buf) - 1
+        if last < 0 or self.position > last:
+            count = 0
+        else:
+            count = int((last - self.position) // self.step) + 1
+        positions = self.position + np.arange(count) * self.step
+        xp = np.arange(len(buf))
+        out = np.empty((count, buf.shape[1]), dtype=buf.dtype)
+        rounding = np.issubdtype(buf.dtype, np.integer)
+        for ch in range(buf.shape[1]):
+            resampled = np.interp(positions, xp, buf[:, ch])
+            out[:, ch] = np.rint(resampled) if rounding else resampled
+        # Последний входной сэмпл становится нулевым для следующего блока
+        self.position += count * self.step - last
+        self.carry = buf[-1:]
+        return out
+
+
+def correct_drift_file(filepath, factor, blocksize=65536):
+    """Переписывает файл с коррекцией дрейфа, не загружая его целиком"""
+    resampler = LinearResampler(factor)
+    temp_path = filepath + ".tmp"
+    with sf.SoundFile(filepath) as src:
+        with sf.SoundFile(temp_path, 'w', src.samplerate, src.channels,
+                          subtype=src.subtype, format=src.format) as dst:
+            for block in src.blocks(blocksize, dtype='float32', always_2d=True):
+                dst.write(resampler.process(block))
+    os.replace(temp_path, filepath)
@@ -0,0 +1,365 @@
+"""Анализ сохранённых дорожек: громкость, пики, клиппинг и карта тишины.
+
+Файл читается блоками по block_frames кадров, так что память не зависит
+от длины дубля. По каждому блоку векторно считаются:
+- громкость по EBU R128 (BS.1770): K-фильтр применяется свёрткой с его
+  усечённой импульсной характеристикой через БПФ (overlap-add), средний
+  квадрат копится по шагам 100 мс, из которых собираются перекрывающиеся
+  окна 400 мс с абсолютным (-70 LUFS) и относительным (-10 LU) гейтом;
+- true-peak по четырёхкратной передискретизации полифазным фильтром;
+- число клиппированных отсчётов и случаев клиппинга (серий подряд);
+- средний квадрат без фильтра по тем же шагам для карты тишины.
+Все каналы весят одинаково: у многоканальных устройств это отдельные
+микрофоны, а не раскладка 5.1. Результат пишется в <файл>.analysis.json.
+"""
+
+import concurrent.futures
+import json
+import os
+import threading
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+
+from .lazy import LazyModule
+
+sf = LazyModule('soundfile')
+# Пул процессов загружается при первом анализе: concurrent.futures отдаёт
+# ProcessPoolExecutor (и multiprocessing за ним) только по обращению
+multiprocessing = LazyModule('multiprocessing')
+
+ANALYSIS_BLOCK_FRAMES = 65536
+# Отсчёты не ниже этого уровня считаются клиппированными (-0.009 дБFS)
+CLIP_LEVEL = 0.999
+STEP_SECONDS = 0.1
+GATE_BLOCK_STEPS = 4
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+TRUE_PEAK_FACTOR = 4
+TRUE_PEAK_TAPS_PER_PHASE = 12
+
+
+def _k_weighting_biquads(samplerate):
+    """Коэффициенты (b, a) полки и ФВЧ K-фильтра BS.1770 для частоты samplerate.
+
+    Аналоговый прототип подобран так, что на 48 кГц получаются ровно
+    коэффициенты из таблиц BS.1770; на других частотах - его билинейное
+    преобразование.
+    """
+    gain_db, shelf_q, shelf_fc = 3.99984385397, 0.7071752369554193, 1681.9744509555319
+    highpass_q, highpass_fc = 0.5003270373253953, 38.13547087613982
+
+    k = np.tan(np.pi * shelf_fc / samplerate)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / shelf_q + k * k
+    shelf = (
+        ((vh + vb * k / shelf_q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / shelf_q + k * k) / a0),
+        (1.0, 2 * (k * k - 1) / a0, (1 - k / shelf_q + k * k) / a0),
+    )
+
+    k = np.tan(np.pi * highpass_fc / samplerate)
+    a0 = 1 + k / highpass_q + k * k
+    highpass = (
+        (1.0, -2.0, 1.0),
+        (1.0, 2 * (k * k - 1) / a0, (1 - k / highpass_q + k * k) / a0),
+    )
+    return shelf, highpass
+
+
+def _biquad_response(b, a, bins):
+    """Частотная характеристика биквада на сетке rfft из bins точек"""
+    z = np.exp(-1j * np.pi * np.arange(bins) / (bins - 1))
+    return (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+
+
+@lru_cache(maxsize=8)
+def k_weighting_ir(samplerate):
+    """Импульсная характеристика K-фильтра, усечённая до ~0.05 с.
+
+    Считается из частотной характеристики на сетке в 4 раза длиннее, так
+    что наложение хвоста при обратном БПФ пренебрежимо мало: полюса ФВЧ
+    38 Гц затухают за единицы миллисекунд, к концу окна хвост меньше 1e-9.
+    """
+    taps = 1 << int(np.ceil(np.log2(samplerate * 0.05)))
+    n = taps * 4
+    shelf, highpass = _k_weighting_biquads(samplerate)
+    response = _biquad_response(*shelf, n // 2 + 1) * _biquad_response(*highpass, n // 2 + 1)
+    return np.fft.irfft(response, n)[:taps]
+
+
+@lru_cache(maxsize=1)
+def true_peak_phases():
+    """Фазы интерполирующего фильтра (оконный sinc): массив (фазы, отводы)"""
+    length = TRUE_PEAK_FACTOR * TRUE_PEAK_TAPS_PER_PHASE
+    n = np.arange(length) - (length - 1) / 2
+    taps = np.sinc(n / TRUE_PEAK_FACTOR) * np.kaiser(length, 8.0)
+    phases = taps.reshape(TRUE_PEAK_TAPS_PER_PHASE, TRUE_PEAK_FACTOR).T
+    return (phases / phases.sum(axis=1, keepdims=True)).astype(np.float32)
+
+
+class FftFilter:
+    """Свёртка потока блоков с FIR через БПФ (overlap-add), по всем каналам сразу.
+
+    Блок режется на отрезки nfft - taps + 1 кадров при nfft около восьми
+    длин FIR: так БПФ короткие и почти не тратятся на нулевое дополнение.
+    """
+
+    def __init__(self, ir, channels):
+        self.taps = len(ir)
+        self.nfft = 1 << int(np.ceil(np.log2(8 * self.taps)))
+        self.segment = self.nfft - self.taps + 1
+        self.spectrum = np.fft.rfft(ir, self.nfft)
+        self.tail = np.zeros((channels, self.taps - 1))
+
+    def process(self, block):
+        """block (кадры, каналы) -> отфильтрованный блок той же формы"""
+        data = np.ascontiguousarray(block.T)
+        out = np.empty(data.shape)
+        for start in range(0, data.shape[1], self.segment):
+            part = data[:, start:start + self.segment]
+            frames = part.shape[1]
+            filtered = np.fft.irfft(np.fft.rfft(part, self.nfft) * self.spectrum, self.nfft)
+            filtered = filtered[:, :frames + self.taps - 1]
+            filtered[:, :self.taps - 1] += self.tail
+            out[:, start:start + frames] = filtered[:, :frames]
+            self.tail = filtered[:, frames:]
+        return out.T
+
+
+class StepPower:
+    """Средний квадрат по каналам на шагах step кадров для потока блоков"""
+
+    def __init__(self, step, channels):
+        self.step = step
+        self.rest = np.zeros((0, channels))
+        self.steps = []
+
+    def add(self, squares):
+        data = np.concatenate([self.rest, squares]) if len(self.rest) else squares
+        whole = len(data) // self.step * self.step
+        if whole:
+            self.steps.append(data[:whole].reshape(-1, self.step, data.shape[1]).mean(axis=1))
+        self.rest = data[whole:].copy()
+
+    def result(self, partial=False):
+        """Массив (шаги, каналы); partial - добавить неполный последний шаг"""
+        steps = self.steps + ([self.rest.mean(axis=0, keepdims=True)] if partial and len(self.rest) else [])
+        return np.concatenate(steps) if steps else np.zeros((0, self.rest.shape[1]))
+
+
+class PeakMeter:
+    """Пик отсчётов, true-peak и клиппинг по каналам для потока блоков.
+
+    Интерполированный отсчёт не больше суммы модулей отводов фазы,
+    умноженной на максимум окна, поэтому передискретизация считается только
+    для окон, где есть отсчёт не ниже текущего пика, делённого на эту
+    сумму. У обычного звука таких окон единицы процентов.
+    """
+
+    def __init__(self, channels, clip_level=CLIP_LEVEL):
+        self.clip_level = clip_level
+        phases = true_peak_phases()
+        # Отсчёты окна в порядке времени: фаза p даёт data[m:m + taps] @ reversed[p]
+        self.reversed_phases = np.ascontiguousarray(phases[:, ::-1].T)
+        self.gain = float(np.abs(phases).sum(axis=1).max())
+        self.taps = phases.shape[1]
+        self.history = np.zeros((self.taps - 1, channels), dtype=np.float32)
+        self.sample_peak = np.zeros(channels)
+        self.true_peak = np.zeros(channels)
+        self.clipped_samples = np.zeros(channels, dtype=np.int64)
+        self.clip_events = np.zeros(channels, dtype=np.int64)
+        self.last_clipped = np.zeros(channels, dtype=bool)
+
+    def add(self, block):
+        magnitude = np.abs(block)
+        block_peak = magnitude.max(axis=0)
+        self.sample_peak = np.maximum(self.sample_peak, block_peak)
+
+        clipped = magnitude >= self.clip_level
+        self.clipped_samples += clipped.sum(axis=0)
+        previous = np.vstack([self.last_clipped[None, :], clipped[:-1]])
+        self.clip_events += (clipped & ~previous).sum(axis=0)
+        self.last_clipped = clipped[-1]
+
+        data = np.concatenate([self.history, block])
+        self.history = data[-(self.taps - 1):]
+        self.true_peak = np.maximum(self.true_peak, block_peak)
+        loud = np.abs(data) >= self.true_peak / self.gain
+        counts = np.concatenate([np.zeros((1, loud.shape[1]), dtype=np.int64), np.cumsum(loud, axis=0)])
+        frames, channels = np.nonzero(counts[self.taps:] - counts[:-self.taps])
+        if len(frames):
+            windows = np.lib.stride_tricks.sliding_window_view(data, self.taps, axis=0)[frames, channels]
+            interpolated = np.abs(windows @ self.reversed_phases).max(axis=1)
+            np.maximum.at(self.true_peak, channels, interpolated)
+
+
+def _db(value, floor=None):
+    """Децибелы или None, если значение ниже floor (или нулевое)"""
+    if value <= 0:
+        return None
+    db = float(10 * np.log10(value))
+    return None if floor is not None and db < floor else round(db, 2)
+
+
+def integrated_loudness(block_powers):
+    """Интегральная громкость по средним квадратам окон 400 мс (окна, каналы)"""
+    if not len(block_powers):
+        return None
+    loudness = -0.691 + 10 * np.log10(np.maximum(block_powers.sum(axis=1), 1e-20))
+    gated = block_powers[loudness > ABSOLUTE_GATE_LUFS]
+    if not len(gated):
+        return None
+    relative_gate = -0.691 + 10 * np.log10(gated.mean(axis=0).sum()) + RELATIVE_GATE_LU
+    gated = block_powers[(loudness > ABSOLUTE_GATE_LUFS) & (loudness > relative_gate)]
+    if not len(gated):
+        return None
+    return round(float(-0.691 + 10 * np.log10(gated.mean(axis=0).sum())), 2)
+
+
+def activity_map(step_powers, step_seconds, silence_db, min_silence_seconds):
+    """Отрезки [начало, конец] в секундах, где хоть один канал громче silence_db.
+
+    Паузы короче min_silence_seconds отрезки не разрывают.
+    """
+    if not len(step_powers):
+        return []
+    active = step_powers.max(axis=1) > 10 ** (silence_db / 10)
+    edges = np.flatnonzero(np.diff(np.concatenate([[False], active, [False]]).astype(np.int8)))
+    segments = []
+    min_gap = int(np.ceil(min_silence_seconds / step_seconds))
+    for start, end in zip(edges[::2], edges[1::2]):
+        if segments and start - segments[-1][1] < min_gap:
+            segments[-1][1] = end
+        else:
+            segments.append([start, end])
+    return [[round(float(start * step_seconds), 3), round(float(end * step_seconds), 3)] for start, end in segments]
+
+
+def sidecar_path(path):
+    return os.path.splitext(path)[0] + ".analysis.json"
+
+
+def analyze_file(path, block_frames=ANALYSIS_BLOCK_FRAMES, silence_db=-60.0, min_silence_seconds=0.5,
+                 clip_level=CLIP_LEVEL):
+    """Анализирует файл блоками и пишет рядом JSON; возвращает сводку с путём к нему"""
+    with sf.SoundFile(path) as f:
+        samplerate, channels = f.samplerate, f.channels
+        step = int(round(samplerate * STEP_SECONDS))
+        k_filter = FftFilter(k_weighting_ir(samplerate), channels)
+        weighted = StepPower(step, channels)
+        raw = StepPower(step, channels)
+        peaks = PeakMeter(channels, clip_level)
+        frames = 0
+        energy = np.zeros(channels)
+        while True:
+            block = f.read(block_frames, dtype='float32', always_2d=True)
+            if not len(block):
+                break
+            frames += len(block)
+            squares = np.square(block, dtype=np.float64)
+            energy += squares.sum(axis=0)
+            raw.add(squares)
+            weighted.add(np.square(k_filter.process(block)))
+            peaks.add(block)
+
+    weighted_steps = weighted.result()
+    if len(weighted_steps) >= GATE_BLOCK_STEPS:
+        windows = np.lib.stride_tricks.sliding_window_view(weighted_steps, GATE_BLOCK_STEPS, axis=0)
+        block_powers = windows.mean(axis=2)
+    else:
+        block_powers = np.zeros((0, channels))
+
+    channel_info = []
+    for channel in range(channels):
+        channel_info.append({
+            'channel': channel + 1,
+            'integrated_lufs': integrated_loudness(block_powers[:, channel:channel + 1]),
+            'true_peak_dbtp': _db(peaks.true_peak[channel] ** 2),
+            'sample_peak_dbfs': _db(peaks.sample_peak[channel] ** 2),
+            'rms_dbfs': _db(energy[channel] / frames) if frames else None,
+            'clipped_samples': int(peaks.clipped_samples[channel]),
+            'clip_events': int(peaks.clip_events[channel]),
+            'silent': _db(peaks.sample_peak[channel] ** 2, silence_db) is None,
+        })
+
+    activity = activity_map(raw.result(partial=True), STEP_SECONDS, silence_db, min_silence_seconds)
+    duration = frames / samplerate
+    summary = {
+        'file': os.path.basename(path),
+        'analysed_at': datetime.now().isoformat(timespec='seconds'),
+        'samplerate': samplerate,
+        'channels': channels,
+        'frames': frames,
+        'duration': round(duration, 3),
+        'integrated_lufs': integrated_loudness(block_powers),
+        'true_peak_dbtp': _db(peaks.true_peak.max(initial=0.0) ** 2),
+        'sample_peak_dbfs': _db(peaks.sample_peak.max(initial=0.0) ** 2),
+        'clip_level': clip_level,
+        'clipped_samples': int(peaks.clipped_samples.sum()),
+        'clip_events': int(peaks.clip_events.sum()),
+        'silence_threshold_dbfs': silence_db,
+        'min_silence_seconds': min_silence_seconds,
+        'active_seconds': round(float(min(sum(end - start for start, end in activity), duration)), 3),
+        'activity': activity,
+        'channel_details': channel_info,
+    }
+    sidecar = sidecar_path(path)
+    with open(sidecar, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    summary['sidecar'] = sidecar
+    return summary
+
+
+def describe_problems(summary):
+    """Короткие предупреждения по сводке analyze_file: клиппинг и каналы без сигнала"""
+    problems = []
+    clipped = [info['channel'] for info in summary['channel_details'] if info['clipped_samples']]
+    if clipped:
+        problems.append(f"клиппинг ({summary['clipped_samples']} отсчётов) в каналах "
+                        + ", ".join(map(str, clipped)))
+    silent = [info['channel'] for info in summary['channel_details'] if info['silent']]
+    if silent:
+        problems.append("нет сигнала в каналах " + ", ".join(map(str, silent)))
+    return problems
+
+
+class TakeAnalyzer:
+    """Анализ сохранённых файлов в пуле процессов.
+
+    Пул создаётся при первом файле, так что без анализа лишних процессов
+    нет. Каждый файл считается в своём процессе, поэтому дорожки большой
+    сессии анализируются параллельно и не отнимают GIL у потоков записи.
+    options передаются в analyze_file.
+    """
+
+    def __init__(self, max_workers=None, **options):
+        self.max_workers = max_workers
+        self.options = options
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def submit(self, path):
+        """Future со сводкой analyze_file"""
+        with self.lock:
+            if self.executor is None:
+                # spawn, как у рабочих захвата: форк посреди потоков записи и сохранения небезопасен
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+            return self.executor.submit(analyze_file, path, **self.options)
+
+    def analyze(self, path):
+        """Задача для SaveJobManager: ждёт анализ файла и возвращает результат задания"""
+        summary = self.submit(path).result()
+        result = {'path': summary['sidecar']}
+        problems = describe_problems(summary)
+        if problems:
+            result['warning'] = f"{summary['file']}: " + "; ".join(problems)
+        return result
+
+    def shutdown(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown()
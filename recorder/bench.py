@@ -0,0 +1,583 @@
+"""Нагрузочный прогон движка на виртуальных устройствах.
+
+    python -m recorder bench --devices 4 --channels 8 --seconds 300 --speed 10
+    python -m recorder bench --scenario replay --buffer-minutes 20 --saves 5 --buffer-on-disk
+    python -m recorder bench --scenario replay --buffer-minutes 2 --resize-minutes 15 --saves 4
+    python -m recorder bench --scenario record --stream --takes 20 --speed 0 --json soak.json
+
+VirtualAudio подменяет в sounddevice таблицу устройств, проверку
+параметров и InputStream. Каждый виртуальный поток в своём потоке
+вызывает callback движка блоками blocksize кадров из заранее
+подготовленного шума, в speed раз быстрее реального времени (0 - без
+пауз). Если callback не успевает, поток, как PortAudio, выставляет
+input_overflow и пропускает отставшие кадры. Отчёт - время CPU в
+callback, RSS процесса, задержка сохранения и потерянные кадры для записи
+дубля и для буфера повтора, время проверки устройств и время до первого
+сэмпла; с --session-rate ещё и стоимость передискретизации на канал.
+Код возврата 1 - ошибки или потери в самом движке (недописанные кадры,
+выброшенные блоки очереди писателя).
+"""
+
+import json
+import math
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from .devices import SAMPLE_FORMATS
+from .engine import CaptureEngine
+from .lazy import LazyModule
+from .resampling import measure_resampler_throughput
+from .writers import OUTPUT_FORMATS
+
+# Модуль bench импортирует консольный режим: остальным командам PortAudio и libsndfile не нужны
+sd = LazyModule('sounddevice')
+sf = LazyModule('soundfile')
+
+CallbackTime = namedtuple('CallbackTime', 'inputBufferAdcTime currentTime outputBufferDacTime')
+
+
+class CallbackFlags:
+    """Флаги callback с тем же интерфейсом, что у sd.CallbackFlags"""
+
+    def __init__(self, input_overflow=False, input_underflow=False):
+        self.input_overflow = input_overflow
+        self.input_underflow = input_underflow
+
+    def __bool__(self):
+        return self.input_overflow or self.input_underflow
+
+
+INPUT_OVERFLOW = CallbackFlags(input_overflow=True)
+
+
+class VirtualInputStream:
+    """Замена sd.InputStream: генерирует блоки в своём потоке.
+
+    Блоки копируются в один и тот же массив indata, как у PortAudio, так
+    что движок, забывший скопировать блок, испортит записанный звук.
+    Время CPU каждого вызова callback меряется по часам этого потока.
+    """
+
+    # На сколько блоков поток может отстать от расписания до переполнения
+    MAX_LAG_BLOCKS = 8
+
+    def __init__(self, audio, device=None, channels=1, samplerate=48000, callback=None,
+                 dtype='float32', blocksize=None, **kwargs):
+        self.audio = audio
+        self.device = device
+        self.channels = channels
+        self.samplerate = int(samplerate)
+        self.callback = callback
+        self.dtype = np.dtype(dtype)
+        self.blocksize = blocksize or audio.blocksize
+        self.frames_delivered = 0
+        self.frames_dropped = 0
+        self.overflows = 0
+        self.callbacks = 0
+        self.cpu_seconds = 0.0
+        self.cpu_max = 0.0
+        self.closed = False
+        self._stopped = threading.Event()
+        self._thread = None
+        # Пробные потоки prepare_devices без callback в отчёт не попадают
+        if callback is not None:
+            audio.register(self)
+
+    @property
+    def frames_generated(self):
+        return self.frames_delivered + self.frames_dropped
+
+    def start(self):
+        if self.callback is not None and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"virtual-{self.device}", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def close(self):
+        self.stop()
+        self.closed = True
+
+    def _run(self):
+        signal = self.audio.signal(self.channels, self.samplerate, self.dtype, self.blocksize)
+        blocks = len(signal) // self.blocksize
+        indata = np.empty((self.blocksize, self.channels), dtype=self.dtype)
+        block_seconds = self.blocksize / self.samplerate
+        speed = self.audio.speed
+        started = time.perf_counter()
+        block = 0
+        while not self._stopped.is_set():
+            position = self.frames_generated / self.samplerate
+            status = None
+            if speed:
+                ahead = position / speed - (time.perf_counter() - started)
+                if ahead > 0:
+                    self._stopped.wait(ahead)
+                    continue
+                lag_blocks = int(-ahead * speed / block_seconds)
+                if lag_blocks > self.MAX_LAG_BLOCKS:
+                    # Как PortAudio при переполнении: отставшие кадры теряются
+                    self.frames_dropped += lag_blocks * self.blocksize
+                    self.overflows += 1
+                    block += lag_blocks
+                    position = self.frames_generated / self.samplerate
+                    status = INPUT_OVERFLOW
+
+            offset = block % blocks * self.blocksize
+            np.copyto(indata, signal[offset:offset + self.blocksize])
+            time_info = CallbackTime(position, position + block_seconds, 0.0)
+            cpu_started = time.thread_time()
+            self.callback(indata, self.blocksize, time_info, status)
+            cpu = time.thread_time() - cpu_started
+            self.cpu_seconds += cpu
+            if cpu > self.cpu_max:
+                self.cpu_max = cpu
+            self.callbacks += 1
+            self.frames_delivered += self.blocksize
+            block += 1
+
+
+class VirtualAudio:
+    """Виртуальные входы вместо устройств sounddevice (контекстный менеджер).
+
+    Подменяет sd.query_devices, sd.check_input_settings и sd.InputStream,
+    поэтому DeviceRegistry, probe_device и движок работают без изменений.
+    Движок нужно создавать внутри блока with.
+    """
+
+    def __init__(self, devices=2, channels=2, samplerate=48000, blocksize=256, speed=10.0):
+        self.device_table = [{
+            'name': f"Virtual {device_idx + 1}",
+            'hostapi': 0,
+            'max_input_channels': channels,
+            'max_output_channels': 0,
+            'default_samplerate': float(samplerate),
+        } for device_idx in range(devices)]
+        self.blocksize = blocksize
+        self.speed = speed
+        self.streams = []
+        self.lock = threading.Lock()
+        self._signals = {}
+        self._saved = None
+
+    def __enter__(self):
+        # Подменяем в самом модуле: через него работают заместители во всех модулях движка
+        module = sd.module
+        self._saved = (module.InputStream, module.query_devices, module.check_input_settings)
+        module.InputStream = lambda *args, **kwargs: VirtualInputStream(self, *args, **kwargs)
+        module.query_devices = self.query_devices
+        module.check_input_settings = lambda *args, **kwargs: None
+        return self
+
+    def __exit__(self, *exc_info):
+        for stream in list(self.streams):
+            stream.close()
+        module = sd.module
+        module.InputStream, module.query_devices, module.check_input_settings = self._saved
+
+    def query_devices(self, device=None, kind=None):
+        if device is None:
+            return [dict(dev) for dev in self.device_table]
+        return dict(self.device_table[device])
+
+    def device_ids(self):
+        return list(range(len(self.device_table)))
+
+    def register(self, stream):
+        with self.lock:
+            self.streams.append(stream)
+
+    def signal(self, channels, samplerate, dtype, blocksize):
+        """Около секунды шума -20 дБFS, общая для потоков с одинаковыми параметрами"""
+        key = (channels, samplerate, dtype, blocksize)
+        with self.lock:
+            if key not in self._signals:
+                frames = math.ceil(samplerate / blocksize) * blocksize
+                rng = np.random.default_rng(len(self._signals))
+                noise = np.clip(rng.standard_normal((frames, channels), dtype=np.float32) * 0.1, -1.0, 0.999)
+                if dtype.kind == 'i':
+                    noise = noise * -np.iinfo(dtype).min
+                self._signals[key] = noise.astype(dtype)
+            return self._signals[key]
+
+    def wait_frames(self, streams, frames):
+        """Ждёт, пока каждый из streams выдаст frames кадров"""
+        while min(stream.frames_generated for stream in streams) < frames:
+            time.sleep(0.01)
+
+
+def memory_usage():
+    """(текущий, пиковый) RSS процесса в байтах; None, где узнать нельзя"""
+    try:
+        with open('/proc/self/status') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['VmRSS'].split()[0]) * 1024, int(fields['VmHWM'].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        pass
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                    'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        kernel32, psapi = ctypes.windll.kernel32, ctypes.windll.psapi
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        psapi.GetProcessMemoryInfo.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters),
+                                               wintypes.DWORD]
+        if psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize, counters.PeakWorkingSetSize
+        return None, None
+    try:
+        import resource
+    except ImportError:
+        return None, None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return None, peak if sys.platform == 'darwin' else peak * 1024
+
+
+class MemorySampler:
+    """Фоновый замер RSS: начальный, последний и максимальный"""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.samples = []
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bench-memory", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self.summary()
+
+    def _run(self):
+        while True:
+            current, _ = memory_usage()
+            if current is not None:
+                self.samples.append(current)
+            if self._stopped.wait(self.interval):
+                break
+
+    def summary(self):
+        _, peak = memory_usage()
+        result = {'peak_rss_mb': _megabytes(peak)}
+        if self.samples:
+            result.update(start_rss_mb=_megabytes(self.samples[0]), end_rss_mb=_megabytes(self.samples[-1]),
+                          max_sampled_rss_mb=_megabytes(max(self.samples)))
+        return result
+
+
+def _megabytes(value):
+    return None if value is None else round(value / (1024 * 1024), 1)
+
+
+class JobWatcher:
+    """Фоновый сбор заданий сохранения, начатых после создания наблюдателя.
+
+    Время окончания отмечается сразу по событию, так что задержка
+    сохранения не зависит от того, чем занят основной поток прогона.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.first_job_id = engine.save_jobs.next_job_id
+        self.finished = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bench-jobs", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        events = self.engine.save_jobs.events
+        while not self._stopped.is_set():
+            try:
+                event, job = events.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            if event == 'finished' and job['id'] >= self.first_job_id:
+                self.finished[job['id']] = (time.perf_counter(), job)
+
+    def wait(self):
+        """Ждёт окончания всех начатых заданий: {номер: (время окончания, задание)}"""
+        while len(self.finished) < self.engine.save_jobs.next_job_id - self.first_job_id:
+            time.sleep(0.01)
+        self._stopped.set()
+        self._thread.join()
+        return self.finished
+
+
+def saved_frames(job, output_dir):
+    """Кадры во всех файлах задания (сегменты складываются)"""
+    frames = 0
+    for result in job['results']:
+        paths = [os.path.join(output_dir, name) for name in result['segments']] if result.get('segments') \
+            else [result['path']]
+        frames += sum(sf.info(path).frames for path in paths)
+    return frames
+
+
+def stream_report(streams, engine_metrics):
+    """Сводка по устройствам: CPU callback виртуальных потоков и метрики движка"""
+    engine_rows = {row['device']: row for row in engine_metrics.summary()}
+    rows = []
+    for device_idx in sorted({stream.device for stream in streams}):
+        device_streams = [stream for stream in streams if stream.device == device_idx]
+        callbacks = sum(stream.callbacks for stream in device_streams)
+        block_seconds = device_streams[0].blocksize / device_streams[0].samplerate
+        cpu_avg = sum(stream.cpu_seconds for stream in device_streams) / (callbacks or 1)
+        engine_row = engine_rows.get(device_idx, {})
+        rows.append({
+            'device': device_idx,
+            'callbacks': callbacks,
+            'cpu_ms_avg': round(cpu_avg * 1000, 4),
+            'cpu_ms_max': round(max(stream.cpu_max for stream in device_streams) * 1000, 4),
+            # Доля времени блока, которую callback занимает процессор
+            'callback_load_pct': round(cpu_avg / block_seconds * 100, 2),
+            'overflows': sum(stream.overflows for stream in device_streams),
+            'frames_generated': sum(stream.frames_generated for stream in device_streams),
+            'frames_dropped': sum(stream.frames_dropped for stream in device_streams),
+            'queue_depth_max': engine_row.get('queue_depth_max', 0),
+            'dropped_blocks': engine_row.get('dropped_blocks', 0),
+        })
+    return rows
+
+
+def bench_record(engine, audio, args):
+    """Дубли по args.seconds виртуальных секунд: CPU callback, задержка сохранения, потери"""
+    device_ids = audio.device_ids()
+    takes = []
+    for take in range(args.takes):
+        # Как окно перед каждым дублем: первый раз устройства проверяются, дальше - из кэша
+        prepare_started = time.perf_counter()
+        formats, invalid = engine.prepare_devices(device_ids)
+        prepare_ms = (time.perf_counter() - prepare_started) * 1000
+        if invalid:
+            raise RuntimeError("Виртуальные устройства не открылись: " + ", ".join(invalid))
+        first_stream = len(audio.streams)
+        watcher = JobWatcher(engine)
+        engine.start_recording(formats, formats)
+        while len(audio.streams) - first_stream < len(formats):
+            time.sleep(0.001)
+        streams = audio.streams[first_stream:]
+        audio.wait_frames(streams, int(args.seconds * args.samplerate))
+
+        stop_started = time.perf_counter()
+        engine.stop_recording()
+        engine.wait_recording()
+        streams_closed = time.perf_counter()
+        finished = watcher.wait()
+        saved = sum(saved_frames(job, engine.output_dir) for _, job in finished.values())
+        captured = {row['device']: row['frames'] for row in engine.take_metrics.summary()}
+        # Передискретизация даёт ceil(кадры * частота файла / частота устройства)
+        file_rate = engine.session_samplerate or args.samplerate
+        in_file = [-(-frames * file_rate // args.samplerate) for frames in captured.values()]
+        # В общий файл каждое устройство пишет свои столбцы тех же кадров
+        expected = max(in_file, default=0) if engine.aggregate else sum(in_file)
+        takes.append({
+            'take': take + 1,
+            'prepare_ms': round(prepare_ms, 3),
+            'first_sample_ms': engine.take_metrics.first_sample_ms(),
+            'stop_ms': round((streams_closed - stop_started) * 1000, 1),
+            'save_latency_ms': round((max((t for t, _ in finished.values()), default=streams_closed)
+                                      - stop_started) * 1000, 1),
+            'frames_captured': sum(captured.values()),
+            'frames_saved': saved,
+            'frames_missing': expected - saved,
+            'save_errors': [f"{name}: {error}" for _, job in finished.values() for name, error in job['errors']],
+            'devices': stream_report(streams, engine.take_metrics),
+        })
+    return takes
+
+
+def bench_replay(engine, audio, args):
+    """Буфер повтора на args.seconds виртуальных секунд с args.saves сохранениями"""
+    device_ids = audio.device_ids()
+    engine.buffer_minutes = args.buffer_minutes
+    engine.buffer_on_disk = args.buffer_on_disk
+    first_stream = len(audio.streams)
+    watcher = JobWatcher(engine)
+    engine.start_buffering(device_ids)
+    while len(audio.streams) - first_stream < len(device_ids):
+        time.sleep(0.001)
+    streams = audio.streams[first_stream:]
+
+    saves = []
+    resize_ms = None
+    total_frames = int(args.seconds * args.samplerate)
+    for save in range(args.saves):
+        # Сохранения равномерно по прогону, последнее - в самом конце
+        audio.wait_frames(streams, total_frames * (save + 1) // args.saves)
+        started = time.perf_counter()
+        job_id = engine.save_buffer(args.save_seconds)
+        saves.append({'job': job_id, 'started': started, 'ack_ms': round((time.perf_counter() - started) * 1000, 3)})
+        if args.resize_minutes and save == 0:
+            # Длина буфера меняется на ходу после первого сохранения
+            started = time.perf_counter()
+            engine.resize_buffer(args.resize_minutes)
+            resize_ms = round((time.perf_counter() - started) * 1000, 3)
+    audio.wait_frames(streams, total_frames)
+
+    finished = watcher.wait()
+    buffer_metrics = engine.buffer_metrics
+    engine.stop_buffering()
+    results = []
+    for save in saves:
+        finished_at, job = finished.get(save['job'], (None, None))
+        if job is None:
+            results.append({'ack_ms': save['ack_ms'], 'error': "буфер пуст или не активен"})
+            continue
+        results.append({
+            'ack_ms': save['ack_ms'],
+            'save_latency_ms': round((finished_at - save['started']) * 1000, 1),
+            'frames_saved': saved_frames(job, engine.output_dir),
+            'warnings': [result['warning'] for result in job['results'] if result.get('warning')],
+            'save_errors': [f"{name}: {error}" for name, error in job['errors']],
+        })
+    return {'saves': results, 'resize_ms': resize_ms, 'first_sample_ms': buffer_metrics.first_sample_ms(),
+            'devices': stream_report(streams, buffer_metrics)}
+
+
+def add_bench_options(parser):
+    parser.add_argument('--scenario', choices=['record', 'replay', 'both'], default='both')
+    parser.add_argument('--devices', type=int, default=2, help="число виртуальных устройств")
+    parser.add_argument('--channels', type=int, default=2, help="каналов на устройство")
+    parser.add_argument('--samplerate', type=int, default=48000)
+    parser.add_argument('--blocksize', type=int, default=256, help="кадров в блоке callback")
+    parser.add_argument('--speed', type=float, default=10.0,
+                        help="во сколько раз быстрее реального времени (0 - без пауз)")
+    parser.add_argument('--seconds', type=float, default=60.0, help="длительность дубля или прогона буфера, с")
+    parser.add_argument('--takes', type=int, default=1, help="сколько дублей записать подряд")
+    parser.add_argument('--sample-format', choices=list(SAMPLE_FORMATS), default='int16')
+    parser.add_argument('--format', dest='output_format', choices=list(OUTPUT_FORMATS), default='WAV')
+    parser.add_argument('--stream', action='store_true', help="писать на диск во время записи")
+    parser.add_argument('--segment-mb', type=int, default=0, help="размер сегмента, МБ")
+    parser.add_argument('--aggregate', action='store_true', help="все устройства в один файл")
+    parser.add_argument('--session-rate', type=int,
+                        help="частота файлов, Гц: передискретизировать из --samplerate")
+    parser.add_argument('--buffer-minutes', type=float, default=2.0)
+    parser.add_argument('--buffer-on-disk', action='store_true')
+    parser.add_argument('--resize-minutes', type=float,
+                        help="после первого сохранения изменить длину буфера на ходу, мин")
+    parser.add_argument('--saves', type=int, default=3, help="сколько раз сохранить буфер за прогон")
+    parser.add_argument('--save-seconds', type=float, help="длина сохраняемого окна, с (по умолчанию весь буфер)")
+    parser.add_argument('-o', '--output-dir', help="куда сохранять (по умолчанию - временная директория)")
+    parser.add_argument('--json', help="записать отчёт в JSON-файл")
+
+
+def run_bench(args):
+    if min(args.devices, args.channels, args.samplerate, args.blocksize, args.takes, args.saves) <= 0 \
+            or args.seconds <= 0 or args.speed < 0 or (args.session_rate is not None and args.session_rate <= 0) \
+            or (args.resize_minutes is not None and args.resize_minutes <= 0):
+        print("Ошибка: параметры прогона должны быть положительными", file=sys.stderr)
+        return 2
+
+    output_dir = os.path.abspath(args.output_dir) if args.output_dir else tempfile.mkdtemp(prefix="recorder-bench-")
+    errors = []
+    memory = MemorySampler()
+    memory.start()
+    report = {'config': {key: value for key, value in vars(args).items() if key != 'command'}}
+    try:
+        with VirtualAudio(args.devices, args.channels, args.samplerate, args.blocksize, args.speed) as audio:
+            engine = CaptureEngine(output_dir)
+            engine.on_error = lambda title, message: errors.append(f"{title}: {message}")
+            engine.sample_format = args.sample_format
+            engine.output_format = args.output_format
+            engine.stream_to_disk = args.stream
+            engine.aggregate = args.aggregate
+            engine.session_samplerate = args.session_rate
+            if args.segment_mb:
+                engine.segment_limits = (None, min(args.segment_mb, 4000) * 1024 * 1024)
+            # Часы виртуальных потоков идут быстрее настоящих, выравнивание по ним бессмысленно
+            engine.align_tracks = False
+            engine.export_metrics = False
+
+            if args.session_rate and args.session_rate != args.samplerate:
+                resampler = measure_resampler_throughput(args.samplerate, args.session_rate, args.channels,
+                                                         blocksize=args.blocksize)
+                report['resampler'] = {'realtime': round(resampler['realtime'], 1), 'taps': resampler['taps'],
+                                       'cpu_pct_per_channel': round(resampler['cpu_per_channel'] * 100, 3)}
+
+            started = time.perf_counter()
+            if args.scenario in ('record', 'both'):
+                report['record'] = bench_record(engine, audio, args)
+            if args.scenario in ('replay', 'both'):
+                report['replay'] = bench_replay(engine, audio, args)
+            report['wall_seconds'] = round(time.perf_counter() - started, 2)
+    finally:
+        report['memory'] = memory.stop()
+        report['errors'] = errors
+        if not args.output_dir:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    problems = errors + [error for take in report.get('record', []) for error in take['save_errors']]
+    # Переполнения виртуальных потоков говорят о загрузке машины прогона, их только показываем
+    lost = any(take['frames_missing'] or any(row['dropped_blocks'] for row in take['devices'])
+               for take in report.get('record', []))
+    return 1 if problems or lost else 0
+
+
+def print_report(report):
+    def print_devices(rows):
+        for row in rows:
+            print(f"  устройство {row['device']}: callback CPU {row['cpu_ms_avg']:.3f} мс в среднем, "
+                  f"{row['cpu_ms_max']:.3f} мс макс. ({row['callback_load_pct']:.2f}% блока); "
+                  f"переполнений {row['overflows']}, потеряно кадров {row['frames_dropped']}, "
+                  f"блоков в очереди писателя макс. {row['queue_depth_max']}, "
+                  f"выброшено {row['dropped_blocks']}")
+
+    for take in report.get('record', []):
+        print(f"Дубль {take['take']}: проверка устройств {take['prepare_ms']:.1f} мс, "
+              f"первый сэмпл через {take['first_sample_ms'] or 0:.1f} мс, остановка {take['stop_ms']:.1f} мс, "
+              f"сохранение {take['save_latency_ms']:.1f} мс, кадров записано {take['frames_captured']}, "
+              f"сохранено {take['frames_saved']}, не хватает {take['frames_missing']}")
+        print_devices(take['devices'])
+    replay = report.get('replay')
+    if replay:
+        for number, save in enumerate(replay['saves'], 1):
+            if 'error' in save:
+                print(f"Сохранение буфера {number}: {save['error']}")
+                continue
+            print(f"Сохранение буфера {number}: ответ {save['ack_ms']:.3f} мс, "
+                  f"готово через {save['save_latency_ms']:.1f} мс, кадров {save['frames_saved']}")
+            for warning in save['warnings']:
+                print(f"  {warning}")
+            if number == 1 and replay['resize_ms'] is not None:
+                print(f"Длина буфера изменена на ходу за {replay['resize_ms']:.3f} мс")
+        print(f"Буфер повтора (первый сэмпл через {replay['first_sample_ms'] or 0:.1f} мс):")
+        print_devices(replay['devices'])
+    resampler = report.get('resampler')
+    if resampler:
+        config = report['config']
+        print(f"Передискретизация {config['samplerate']} -> {config['session_rate']} Гц ({resampler['taps']} отводов): "
+              f"x{resampler['realtime']:.1f} реального времени на устройство, "
+              f"{resampler['cpu_pct_per_channel']:.3f}% ядра на канал")
+    memory = report['memory']
+    print(f"Память: пиковый RSS {memory['peak_rss_mb']} МБ"
+          + (f", в начале {memory['start_rss_mb']} МБ, в конце {memory['end_rss_mb']} МБ"
+             if 'start_rss_mb' in memory else ""))
+    if 'wall_seconds' in report:
+        print(f"Время прогона: {report['wall_seconds']:.1f} с")
+    for error in report['errors']:
+        print(error, file=sys.stderr)
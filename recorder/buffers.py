@@ -0,0 +1,275 @@
+"""Кольцевые буферы мгновенного повтора"""
+
+import os
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class RingBuffer:
+    """Кольцевой буфер фиксированного размера для многоканального аудио.
+
+    Память выделяется один раз непрерывным массивом, запись идёт срезами
+    по одному индексу. Рассчитан на одного писателя (callback потока) и
+    одного читателя (сохранение буфера).
+
+    Кадры нумеруются сквозным счётчиком frames_written. Сохранение
+    помечает окно методом snapshot (без копирования) и потом читает его
+    кусками через iter_window, пока callback продолжает писать: кадры,
+    которые за это время успели перезаписаться, обнаруживаются по счётчику.
+
+    Размер меняется на ходу без копирования накопленного: новое кольцо
+    создаётся с predecessor - прежним кольцом, и callback переключается на
+    него. С первой записью (first_frame) прежнее кольцо замирает, и кадры
+    до first_frame читаются из него, пока новое не заполнится настолько,
+    что они выйдут из окна; тогда trim его освобождает. До первой записи
+    frames_written нового кольца не действителен - всё читается из прежнего.
+    """
+
+    def __init__(self, capacity, channels, dtype='float32', predecessor=None):
+        self.capacity = int(capacity)
+        self.channels = channels
+        self.data = self._allocate(np.dtype(dtype))
+        self.predecessor = predecessor
+        if predecessor is None:
+            self.first_frame = 0
+            self.frames_written = 0
+            self.max_block = 0
+        else:
+            self.first_frame = None
+            self.frames_written = predecessor.frames_written
+            self.max_block = predecessor.max_block
+        self.write_index = self.frames_written % self.capacity
+        # Кольцо заменено новым и больше не пишется
+        self.frozen = False
+
+    def __len__(self):
+        return self._written() - self.oldest_frame()
+
+    def _written(self):
+        """Сквозной номер кадра, следующего за последним записанным"""
+        if self.first_frame is None:
+            return self.predecessor._written()
+        return self.frames_written
+
+    def oldest_frame(self):
+        """Сквозной номер самого старого кадра, который ещё можно прочитать"""
+        return max(self._written() - self.capacity, self._oldest_kept())
+
+    def _oldest_kept(self):
+        """Самый старый кадр, который ещё хранится в этом кольце или прежних"""
+        predecessor = self.predecessor
+        if self.first_frame is None:
+            return predecessor._oldest_kept()
+        own = self.frames_written - self.capacity
+        if predecessor is None or own >= self.first_frame:
+            return max(own, self.first_frame)
+        return predecessor._oldest_kept()
+
+    def _begin(self):
+        """Первая запись в новое кольцо: прежнее с этого кадра больше не пишется"""
+        self.predecessor._finish_writes()
+        start = self.predecessor._written()
+        self.frames_written = start
+        self.write_index = start % self.capacity
+        self.max_block = max(self.max_block, self.predecessor.max_block)
+        self.first_frame = start
+
+    def _finish_writes(self):
+        """Дожидается, пока в кольцо допишется всё, что в него уже передано"""
+        if self.first_frame is None:
+            self.predecessor._finish_writes()
+        self.frozen = True
+
+    def trim(self):
+        """Освобождает прежние кольца, кадры которых вышли из окна.
+
+        Вызывается не из callback: освобождение большого массива или
+        удаление файла может занять заметное время.
+        """
+        self._trim(self._written() - self.capacity)
+
+    def _trim(self, oldest):
+        predecessor = self.predecessor
+        if predecessor is None:
+            return
+        if self.first_frame is not None and oldest >= self.first_frame:
+            self.predecessor = None
+            predecessor.close()
+        else:
+            predecessor._trim(oldest)
+
+    def _allocate(self, dtype):
+        return np.zeros((self.capacity, self.channels), dtype=dtype)
+
+    def close(self):
+        if self.predecessor is not None:
+            self.predecessor.close()
+
+    def write(self, block):
+        """Записывает блок кадров, затирая самые старые данные"""
+        if self.first_frame is None:
+            self._begin()
+        frames = len(block)
+        if frames > self.max_block:
+            self.max_block = frames
+        if frames >= self.capacity:
+            # Остаются последние capacity кадров блока, каждый на своём месте
+            # (frames_written + i) % capacity, как их ищут views и iter_window
+            tail = block[frames - self.capacity:]
+            begin = (self.frames_written + frames - self.capacity) % self.capacity
+            split = self.capacity - begin
+            self.data[begin:] = tail[:split]
+            self.data[:begin] = tail[split:]
+            self.write_index = (self.frames_written + frames) % self.capacity
+        else:
+            end = self.write_index + frames
+            if end <= self.capacity:
+                self.data[self.write_index:end] = block
+            else:
+                split = self.capacity - self.write_index
+                self.data[self.write_index:] = block[:split]
+                self.data[:frames - split] = block[split:]
+            self.write_index = end % self.capacity
+        self.frames_written += frames
+
+    def snapshot(self, frames=None, reserve=0):
+        """Помечает окно последних frames кадров: (номер первого кадра, число кадров).
+
+        Самые старые кадры полного буфера callback затрёт первыми, поэтому
+        окно не заходит в последние reserve кадров (и не меньше одного блока),
+        пока сохранение не успело их прочитать. До первой записи в новое
+        кольцо окно целиком читается из прежнего, которое ещё пишется,
+        поэтому размер и запас считаются по нему.
+        """
+        if self.first_frame is None:
+            return self.predecessor.snapshot(frames, reserve)
+        end = self._written()
+        available = min(len(self), self.capacity - max(self.max_block, int(reserve)))
+        frames = available if frames is None else min(int(frames), available)
+        return end - frames, frames
+
+    def overwritten(self, start):
+        """Сколько кадров, начиная со сквозного номера start, уже могло быть затёрто.
+
+        Блок, который callback пишет прямо сейчас, ещё не учтён в
+        frames_written, поэтому запас - размер самого большого блока
+        (у замороженного кольца запаса нет).
+        """
+        margin = 0 if self.frozen else self.max_block
+        return max(0, self.frames_written + margin - self.capacity - start)
+
+    def views(self, start, frames):
+        """Один или два среза-представления массива для кадров [start, start + frames)"""
+        begin = start % self.capacity
+        end = begin + frames
+        if end <= self.capacity:
+            return [self.data[begin:end]]
+        return [self.data[begin:], self.data[:end - self.capacity]]
+
+    def iter_window(self, start, frames, chunk_frames=65536):
+        """Читает окно кусками по chunk_frames кадров, начиная с самых старых.
+
+        Отдаёт пары (копия куска, сколько кадров в его начале потеряно).
+        Потерянные (уже перезаписанные новыми данными) кадры заменяются
+        тишиной, чтобы длина и выравнивание окна сохранились. Кадры до
+        first_frame читаются из прежнего кольца; если его уже освободил
+        trim, они тоже считаются потерянными.
+        """
+        position = start
+        end = start + frames
+        while position < end:
+            first_frame = self.first_frame
+            if first_frame is None or position < first_frame:
+                count = end - position if first_frame is None else min(end, first_frame) - position
+                predecessor = self.predecessor
+                if predecessor is not None:
+                    yield from predecessor.iter_window(position, count, chunk_frames)
+                else:
+                    for offset in range(0, count, chunk_frames):
+                        lost = min(chunk_frames, count - offset)
+                        yield np.zeros((lost, self.channels), dtype=self.data.dtype), lost
+                position += count
+                continue
+            count = min(chunk_frames, end - position)
+            lost = min(count, self.overwritten(position))
+            views = self.views(position, count)
+            chunk = views[0].copy() if len(views) == 1 else np.concatenate(views)
+            # Проверяем после копирования: callback мог успеть перезаписать начало куска
+            lost = max(lost, min(count, self.overwritten(position)))
+            if lost:
+                chunk[:lost] = 0
+            yield chunk, lost
+            position += count
+
+
+class MappedRingBuffer(RingBuffer):
+    """Кольцевой буфер в файле, отображённом в память.
+
+    Файл выделяется целиком при создании (posix_fallocate там, где он
+    есть), так что место на диске не кончится посреди работы, а за
+    резидентность страниц отвечает кэш ОС: буфер на часы не держится в
+    RAM. Обращение к странице файла может обернуться чтением с диска,
+    поэтому callback только кладёт копию блока в очередь, а в отображение
+    её переносит отдельный поток; при переполнении очереди блок
+    отбрасывается и учитывается в dropped_blocks. Окно сохранения
+    читается прямо из отображения. Новое кольцо при изменении размера
+    пишет свой файл, прежний удаляется, когда освобождается.
+    """
+
+    def __init__(self, filepath, capacity, channels, dtype='float32', max_blocks=1024, predecessor=None):
+        self.filepath = filepath
+        self.max_blocks = max_blocks
+        self.queue = deque()
+        self.dropped_blocks = getattr(predecessor, 'dropped_blocks', 0)
+        super().__init__(capacity, channels, dtype, predecessor)
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _allocate(self, dtype):
+        size = self.capacity * self.channels * dtype.itemsize
+        with open(self.filepath, 'wb') as f:
+            f.truncate(size)
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(f.fileno(), 0, size)
+        return np.memmap(self.filepath, dtype=dtype, mode='r+', shape=(self.capacity, self.channels))
+
+    def write(self, block):
+        """Вызывается из callback потока: копирует блок в очередь"""
+        if len(self.queue) >= self.max_blocks:
+            self.dropped_blocks += 1
+            return
+        self.queue.append(block.copy())
+
+    def _run(self):
+        while True:
+            try:
+                block = self.queue.popleft()
+            except IndexError:
+                if self._closing.is_set():
+                    break
+                self._closing.wait(0.005)
+                continue
+            RingBuffer.write(self, block)
+
+    def _finish_writes(self):
+        self._closing.set()
+        self._thread.join()
+        super()._finish_writes()
+
+    def close(self):
+        """Останавливает перенос блоков и удаляет файл буфера.
+
+        Отображение остаётся доступным сохранениям, которые ещё читают окно.
+        В Windows отображённый файл удалить нельзя - он будет перезаписан
+        при следующем запуске буфера.
+        """
+        self._closing.set()
+        self._thread.join()
+        try:
+            os.remove(self.filepath)
+        except OSError:
+            pass
+        super().close()
@@ -0,0 +1,311 @@
+"""Консольный режим без GUI.
+
+    python -m recorder devices
+    python -m recorder record -d 3 -d 5 --duration 60
+    python -m recorder daemon -d 3 -d 5 --buffer-minutes 5 --take-seconds 3600
+    python -m recorder daemon -d 3 --replay-window 10 --replay-window 900 --control-port 8765
+    python -m recorder trigger -d 3 -d 5 --threshold-db -35 --hold 3 --pre-roll 2
+    python -m recorder bench --devices 4 --channels 8 --seconds 300
+    python -m recorder verify take_20240101_120000.tar
+
+Запись останавливается по Ctrl+C или SIGTERM. В режиме daemon сигнал
+SIGUSR1 сохраняет буфер мгновенного повтора, а с --control-port или
+--control-socket им можно управлять по HTTP (см. recorder.control).
+"""
+
+import argparse
+import os
+import queue
+import signal
+import sys
+import threading
+
+from .bench import add_bench_options, run_bench
+from .control import ControlServer
+from .devices import SAMPLE_FORMATS, DeviceRegistry
+from .engine import CaptureEngine
+from .manifest import verify_take
+from .writers import OUTPUT_FORMATS, aggregate_format
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m recorder",
+                                     description="Многодорожечный аудиорекордер без GUI")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('devices', help="список входных устройств")
+
+    record = commands.add_parser('record', help="записать дубль (или несколько подряд)")
+    add_capture_options(record)
+    record.add_argument('--duration', type=float,
+                        help="длительность дубля, с (по умолчанию - до Ctrl+C)")
+    record.add_argument('--takes', type=int, default=1, help="сколько дублей записать подряд")
+
+    trigger = commands.add_parser('trigger', help="записывать дубли, когда есть сигнал")
+    add_capture_options(trigger)
+    trigger.add_argument('--threshold-db', type=float, default=-40.0,
+                         help="порог RMS, дБFS (по любому каналу любого устройства)")
+    trigger.add_argument('--hold', type=float, default=2.0,
+                         help="сколько секунд тишины заканчивает дубль")
+    trigger.add_argument('--pre-roll', type=float, default=2.0,
+                         help="сколько секунд до срабатывания попадает в дубль")
+
+    daemon = commands.add_parser('daemon', help="фоновый буфер повтора и/или дубли по расписанию")
+    add_capture_options(daemon)
+    daemon.add_argument('--buffer-minutes', type=float, default=2,
+                        help="длительность буфера повтора, мин (0 - без буфера)")
+    daemon.add_argument('--buffer-on-disk', action='store_true',
+                        help="держать буфер повтора в файле в директории сохранения")
+    daemon.add_argument('--replay-window', type=float, action='append', default=[], metavar='SECONDS',
+                        help="окно повтора, с (можно несколько раз; буфер не короче самого длинного)")
+    daemon.add_argument('--take-seconds', type=float,
+                        help="писать дубли подряд указанной длительности, с")
+    daemon.add_argument('--control-port', type=int, help="порт HTTP-управления на 127.0.0.1")
+    daemon.add_argument('--control-socket', help="Unix-сокет HTTP-управления")
+
+    bench = commands.add_parser('bench', help="нагрузочный прогон на виртуальных устройствах (см. recorder.bench)")
+    add_bench_options(bench)
+
+    verify = commands.add_parser('verify', help="сверить дубли с манифестами (take_*.json или архивы .tar)")
+    verify.add_argument('paths', nargs='+', help="манифесты или архивы дублей")
+    return parser
+
+
+def add_capture_options(parser):
+    parser.add_argument('-d', '--device', type=int, action='append', required=True,
+                        help="индекс входного устройства (можно несколько раз)")
+    parser.add_argument('-o', '--output-dir', default=".", help="директория для сохранения")
+    parser.add_argument('--sample-format', choices=list(SAMPLE_FORMATS), default='int16')
+    parser.add_argument('--format', dest='output_format', choices=list(OUTPUT_FORMATS), default='WAV')
+    parser.add_argument('--stream', action='store_true', help="писать на диск во время записи")
+    parser.add_argument('--segment-minutes', type=int, default=0, help="длина сегмента, мин")
+    parser.add_argument('--segment-mb', type=int, default=0, help="размер сегмента, МБ")
+    parser.add_argument('--aggregate', action='store_true',
+                        help="писать все устройства в один многоканальный файл")
+    parser.add_argument('--session-rate', type=int,
+                        help="частота файлов, Гц: устройства с другой частотой передискретизируются")
+    parser.add_argument('--no-align', action='store_true', help="не выравнивать дорожки по времени")
+    parser.add_argument('--correct-drift', action='store_true', help="корректировать дрейф частоты")
+    parser.add_argument('--no-metrics', action='store_true', help="не сохранять метрики дубля")
+    parser.add_argument('--no-peaks', action='store_true', help="не писать обзор волны (.peaks)")
+    parser.add_argument('--analyze', action='store_true',
+                        help="после сохранения считать громкость, пики, клиппинг и паузы (.analysis.json)")
+    parser.add_argument('--archive', action='store_true',
+                        help="упаковывать каждый дубль с манифестом в один .tar вместо отдельных файлов")
+    parser.add_argument('--capture-processes', type=int, default=0,
+                        help="открывать потоки устройств в N рабочих процессах (0 - в этом процессе)")
+
+
+def create_engine(args):
+    engine = CaptureEngine(os.path.abspath(args.output_dir))
+    engine.sample_format = args.sample_format
+    engine.output_format = args.output_format
+    engine.stream_to_disk = args.stream
+    engine.aggregate = args.aggregate
+    if args.session_rate is not None and args.session_rate <= 0:
+        raise ValueError("Частота сессии должна быть больше нуля")
+    engine.session_samplerate = args.session_rate
+    engine.align_tracks = not args.no_align
+    engine.correct_drift = args.correct_drift
+    engine.export_metrics = not args.no_metrics
+    engine.write_peaks = not args.no_peaks
+    engine.analyze_takes = args.analyze
+    engine.archive_takes = args.archive
+    if args.capture_processes < 0:
+        raise ValueError("Число процессов захвата не может быть отрицательным")
+    engine.capture_processes = args.capture_processes
+    if args.segment_minutes < 0 or args.segment_mb < 0:
+        raise ValueError("Размер сегмента не может быть отрицательным")
+    if args.segment_minutes or args.segment_mb:
+        # WAV не может быть больше 4 ГБ
+        segment_megabytes = min(args.segment_mb or 4000, 4000)
+        engine.segment_limits = (args.segment_minutes * 60 or None, segment_megabytes * 1024 * 1024)
+    if args.command == 'trigger':
+        if args.pre_roll < 0 or args.hold <= 0:
+            raise ValueError("Предзапись не может быть отрицательной, удержание должно быть больше нуля")
+        engine.trigger_threshold_db = args.threshold_db
+        engine.trigger_hold_seconds = args.hold
+        engine.trigger_pre_roll_seconds = args.pre_roll
+    if args.command == 'daemon':
+        if any(seconds <= 0 for seconds in args.replay_window):
+            raise ValueError("Окно повтора должно быть больше нуля")
+        engine.replay_windows = sorted(args.replay_window)
+    return engine
+
+
+def report_jobs(engine, wait=False):
+    """Печатает результаты сохранения; при wait ждёт окончания всех заданий"""
+    events = engine.save_jobs.events
+    while True:
+        try:
+            event, job = events.get(timeout=0.1) if wait else events.get_nowait()
+        except queue.Empty:
+            if wait and engine.save_jobs.active_jobs():
+                continue
+            return
+        if event != 'finished':
+            continue
+        for result in job['results']:
+            for name in result.get('segments') or [os.path.basename(result['path'])]:
+                print(f"Сохранено: {os.path.join(engine.output_dir, name)}")
+            if result.get('warning'):
+                print(result['warning'], file=sys.stderr)
+        for name, error in job['errors']:
+            print(f"Ошибка сохранения ({job['title']}), устройство {name}: {error}", file=sys.stderr)
+
+
+def list_devices():
+    for device_idx, dev in enumerate(DeviceRegistry().all()):
+        if dev['max_input_channels'] > 0:
+            print(f"{device_idx:4d}  {dev['name']}  (входов: {dev['max_input_channels']}, "
+                  f"{int(dev['default_samplerate'])} Гц)")
+    return 0
+
+
+def verify_takes(paths):
+    failed = False
+    for path in paths:
+        try:
+            problems = verify_take(path)
+        except Exception as e:
+            problems = [f"не удалось прочитать ({e})"]
+        for problem in problems:
+            print(f"{path}: {problem}", file=sys.stderr)
+        if problems:
+            failed = True
+        else:
+            print(f"{path}: в порядке")
+    return 1 if failed else 0
+
+
+def run_record(engine, formats, args, stop):
+    # Ctrl+C останавливает текущий дубль сразу, а не на следующем опросе
+    threading.Thread(target=lambda: stop.wait() and engine.stop_recording(), daemon=True).start()
+    for take in range(args.takes):
+        if stop.is_set():
+            break
+        # --duration отсчитывается в кадрах устройств: дубль останавливается сам
+        engine.start_recording(formats, formats, duration=args.duration)
+        if stop.is_set():
+            engine.stop_recording()
+        print(f"Запись дубля {take + 1}/{args.takes}...")
+        # Ожидание с таймаутом: сигнал может прийти в другой поток, и обработчик
+        # Python выполнится только когда главный поток проснётся
+        while not engine.wait_recording_stop(0.5):
+            pass
+        engine.stop_recording()
+        engine.wait_recording()
+        report_jobs(engine)
+
+
+def run_trigger(engine, formats, args, stop):
+    engine.arm_trigger(formats, formats)
+    print(f"Ожидание сигнала выше {args.threshold_db:g} дБFS...")
+    recording = False
+    try:
+        while not stop.wait(0.2):
+            if engine.trigger.recording != recording:
+                recording = engine.trigger.recording
+                print("Запись по сигналу..." if recording else "Ожидание сигнала...")
+            report_jobs(engine)
+    finally:
+        engine.disarm_trigger()
+
+
+def run_daemon(engine, formats, args, stop, save_requested):
+    if args.buffer_minutes > 0:
+        engine.buffer_minutes = args.buffer_minutes
+        engine.buffer_on_disk = args.buffer_on_disk
+        engine.start_buffering(formats)
+        print(f"Буфер повтора: {engine.buffer_seconds() / 60:.3g} мин")
+        if engine.replay_windows:
+            print("Окна повтора, с: " + ", ".join(f"{seconds:g}" for seconds in engine.replay_windows))
+
+    control = None
+    if args.control_port is not None or args.control_socket:
+        control = ControlServer(engine, list(formats), port=args.control_port, unix_path=args.control_socket)
+        control.start()
+        for address in control.addresses():
+            print(f"Управление: {address}")
+
+    if args.take_seconds:
+        # Длительность дубля отсчитывается в кадрах устройств: дубль останавливается сам
+        engine.start_recording(formats, formats, duration=args.take_seconds)
+
+    try:
+        while not stop.is_set():
+            # Ожидание с таймаутом: сигнал обработается, только когда главный поток проснётся
+            if not args.take_seconds:
+                stop.wait(0.2)
+            elif engine.wait_recording_stop(0.2) and not stop.is_set():
+                # Следующий дубль начинается сразу после закрытия потоков предыдущего
+                engine.wait_recording()
+                engine.start_recording(formats, formats, duration=args.take_seconds)
+            if save_requested.is_set():
+                save_requested.clear()
+                if engine.save_buffer() is None:
+                    print("Буферизация не активна или данные отсутствуют", file=sys.stderr)
+            report_jobs(engine)
+    finally:
+        if control is not None:
+            control.stop()
+        engine.stop_recording()
+        engine.wait_recording()
+        engine.stop_buffering()
+        engine.disarm_trigger()
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == 'devices':
+        return list_devices()
+    if args.command == 'bench':
+        return run_bench(args)
+    if args.command == 'verify':
+        return verify_takes(args.paths)
+
+    try:
+        engine = create_engine(args)
+    except ValueError as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 2
+    engine.on_error = lambda title, message: print(f"{title}: {message}", file=sys.stderr)
+
+    recovered, failed = engine.recover_interrupted_segments()
+    for path in recovered:
+        print(f"Восстановлен сегмент: {path}")
+    for path in failed:
+        print(f"Не удалось восстановить: {path}", file=sys.stderr)
+
+    formats, invalid = engine.prepare_devices(args.device)
+    for device in invalid:
+        print(f"Устройство не будет записано: {device}", file=sys.stderr)
+    if not formats:
+        print("Нет ни одного рабочего входного устройства", file=sys.stderr)
+        return 1
+    if engine.aggregate:
+        try:
+            aggregate_format({idx: engine.session_format(fmt) for idx, fmt in formats.items()})
+        except ValueError as e:
+            print(f"Ошибка: {e}", file=sys.stderr)
+            return 2
+
+    stop = threading.Event()
+    save_requested = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: save_requested.set())
+
+    try:
+        if args.command == 'record':
+            run_record(engine, formats, args, stop)
+        elif args.command == 'trigger':
+            run_trigger(engine, formats, args, stop)
+        else:
+            run_daemon(engine, formats, args, stop, save_requested)
+    finally:
+        engine.stop_recording()
+        engine.wait_recording()
+        report_jobs(engine, wait=True)
+        engine.analyzer.shutdown()
+    return 0
@@ -0,0 +1,344 @@
+"""Управление движком по HTTP на localhost или через Unix-сокет.
+
+    POST /record/start   {"devices": [3, 5], "duration": 60} - начать дубль (duration - таймер, с)
+    POST /record/stop                           - остановить дубль
+    POST /replay/start   {"devices": [...], "minutes": 240, "on_disk": true, "windows": [10, 120, 900]}
+    POST /replay/stop
+    POST /replay/save    {"seconds": 30}        - сохранить буфер повтора
+    POST /replay/resize  {"minutes": 15, "windows": [10, 120]} - изменить буфер на ходу
+    POST /trigger/arm    {"devices": [...], "threshold_db": -40, "hold": 2, "pre_roll": 2}
+    POST /trigger/disarm                        - перестать ждать сигнал
+    GET  /status
+    GET  /metrics
+    GET  /jobs/<номер>                          - результат сохранения
+
+Ответы - JSON. Соединение можно держать открытым (keep-alive), так что
+подтверждение сохранения буфера приходит сразу после пометки окна:
+копирование, кодирование и запись идут в пуле SaveJobManager, а результат можно
+узнать по номеру задания.
+"""
+
+import asyncio
+import json
+import os
+import threading
+from urllib.parse import parse_qsl, urlsplit
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found",
+               405: "Method Not Allowed", 409: "Conflict", 500: "Internal Server Error"}
+
+
+class ControlError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ControlServer:
+    """Асинхронный сервер управления CaptureEngine.
+
+    Слушает только 127.0.0.1 (port) и/или Unix-сокет (unix_path) в своём
+    потоке с циклом asyncio. Медленные команды (открытие и закрытие
+    устройств) выполняются в потоках, чтобы не задерживать остальные
+    запросы; запуск и остановка сериализуются. device_ids - устройства по
+    умолчанию, если в запросе они не указаны.
+    """
+
+    def __init__(self, engine, device_ids=(), port=None, host='127.0.0.1', unix_path=None):
+        self.engine = engine
+        self.device_ids = list(device_ids)
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.loop = None
+        self._servers = []
+        self._thread = None
+        self._started = threading.Event()
+        self._start_error = None
+        self._command_lock = None
+
+    def start(self):
+        """Запускает сервер в фоновом потоке и ждёт, пока он начнёт слушать"""
+        self._thread = threading.Thread(target=self._run, name="control", daemon=True)
+        self._thread.start()
+        self._started.wait()
+        if self._start_error is not None:
+            raise self._start_error
+
+    def stop(self):
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._listen())
+        except Exception as e:
+            self._start_error = e
+            self._started.set()
+            return
+        self._started.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            for server in self._servers:
+                server.close()
+            if self.unix_path and os.path.exists(self.unix_path):
+                os.unlink(self.unix_path)
+            self.loop.close()
+
+    async def _listen(self):
+        self._command_lock = asyncio.Lock()
+        if self.port is not None:
+            self._servers.append(await asyncio.start_server(self._handle, self.host, self.port))
+        if self.unix_path:
+            if os.path.exists(self.unix_path):
+                os.unlink(self.unix_path)
+            self._servers.append(await asyncio.start_unix_server(self._handle, self.unix_path))
+            os.chmod(self.unix_path, 0o600)
+
+    def addresses(self):
+        result = []
+        for server in self._servers:
+            for sock in server.sockets:
+                result.append(sock.getsockname())
+        return result
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length') or 0)
+                body = await reader.readexactly(length) if length else b''
+
+                try:
+                    status, payload = 200, await self.dispatch(method, target, body)
+                except ControlError as e:
+                    status, payload = e.status, {'ok': False, 'error': str(e)}
+                except Exception as e:
+                    status, payload = 500, {'ok': False, 'error': str(e)}
+
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and version.upper() == 'HTTP/1.1')
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                    f"Content-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, target, body):
+        """Выполняет команду и возвращает словарь ответа"""
+        url = urlsplit(target)
+        path = url.path.rstrip('/') or '/'
+        params = dict(parse_qsl(url.query))
+        if body:
+            try:
+                params.update(json.loads(body))
+            except (ValueError, TypeError):
+                raise ControlError(400, "Тело запроса должно быть объектом JSON")
+
+        routes = {
+            ('GET', '/status'): self.get_status,
+            ('GET', '/metrics'): self.get_metrics,
+            ('POST', '/record/start'): self.start_recording,
+            ('POST', '/record/stop'): self.stop_recording,
+            ('POST', '/replay/start'): self.start_buffering,
+            ('POST', '/replay/stop'): self.stop_buffering,
+            ('POST', '/replay/save'): self.save_buffer,
+            ('POST', '/replay/resize'): self.resize_buffer,
+            ('POST', '/trigger/arm'): self.arm_trigger,
+            ('POST', '/trigger/disarm'): self.disarm_trigger,
+        }
+        handler = routes.get((method, path))
+        if handler is not None:
+            return await handler(params)
+        if method == 'GET' and path.startswith('/jobs/'):
+            return self.get_job(path[len('/jobs/'):])
+        if any(route_path == path for _, route_path in routes):
+            raise ControlError(405, f"Метод {method} не поддерживается для {path}")
+        raise ControlError(404, f"Неизвестная команда {path}")
+
+    def _devices(self, params):
+        devices = params.get('devices', self.device_ids)
+        if isinstance(devices, str):
+            devices = devices.split(',')
+        try:
+            devices = [int(device_idx) for device_idx in devices]
+        except (TypeError, ValueError):
+            raise ControlError(400, "devices - список индексов устройств")
+        if not devices:
+            raise ControlError(400, "Не выбраны устройства")
+        return devices
+
+    async def get_status(self, params):
+        return dict(self.engine.status(), ok=True)
+
+    async def get_metrics(self, params):
+        return {
+            'ok': True,
+            'recording': self.engine.take_metrics.summary(),
+            'buffer': self.engine.buffer_metrics.summary(),
+            'trigger': self.engine.trigger.metrics.summary() if self.engine.trigger else [],
+        }
+
+    async def start_recording(self, params):
+        devices = self._devices(params)
+        duration = None
+        if params.get('duration') is not None:
+            try:
+                duration = float(params['duration'])
+            except (TypeError, ValueError):
+                duration = 0
+            if duration <= 0:
+                raise ControlError(400, "duration - положительное число секунд")
+        async with self._command_lock:
+            if self.engine.is_recording:
+                raise ControlError(409, "Запись уже идёт")
+            formats, invalid = await asyncio.to_thread(self.engine.prepare_devices, devices)
+            if not formats:
+                raise ControlError(409, "Нет ни одного рабочего входного устройства: " + ", ".join(invalid))
+            try:
+                self.engine.start_recording(formats, formats, duration=duration)
+            except ValueError as e:
+                raise ControlError(409, str(e))
+        return {'ok': True, 'devices': sorted(formats), 'invalid': invalid}
+
+    async def stop_recording(self, params):
+        async with self._command_lock:
+            if not self.engine.is_recording:
+                raise ControlError(409, "Запись не идёт")
+            self.engine.stop_recording()
+            await asyncio.to_thread(self.engine.wait_recording)
+        return {'ok': True}
+
+    async def start_buffering(self, params):
+        devices = self._devices(params)
+        async with self._command_lock:
+            if self.engine.is_buffering:
+                raise ControlError(409, "Буферизация уже идёт")
+            minutes, windows = self._buffer_size(params)
+            self.engine.resize_buffer(minutes, windows)
+            if 'on_disk' in params:
+                self.engine.buffer_on_disk = params['on_disk'] in (True, 1, '1', 'true')
+            self.engine.start_buffering(devices)
+        return {'ok': True, 'devices': devices, 'minutes': self.engine.buffer_minutes,
+                'windows': self.engine.replay_windows, 'on_disk': self.engine.buffer_on_disk}
+
+    def _buffer_size(self, params):
+        """(minutes, windows) из параметров; None - не менять"""
+        minutes = windows = None
+        if 'minutes' in params:
+            try:
+                minutes = float(params['minutes'])
+            except (TypeError, ValueError):
+                minutes = 0
+            if minutes <= 0:
+                raise ControlError(400, "minutes - положительное число")
+        if 'windows' in params:
+            windows = params['windows']
+            if isinstance(windows, str):
+                windows = [window for window in windows.split(',') if window]
+            try:
+                windows = [float(seconds) for seconds in windows]
+            except (TypeError, ValueError):
+                windows = [0]
+            if any(seconds <= 0 for seconds in windows):
+                raise ControlError(400, "windows - список положительных длительностей, с")
+        return minutes, windows
+
+    async def resize_buffer(self, params):
+        minutes, windows = self._buffer_size(params)
+        if minutes is None and windows is None:
+            raise ControlError(400, "Укажите minutes и/или windows")
+        async with self._command_lock:
+            await asyncio.to_thread(self.engine.resize_buffer, minutes, windows)
+        return {'ok': True, 'minutes': self.engine.buffer_minutes, 'windows': self.engine.replay_windows,
+                'buffer_seconds': self.engine.buffer_seconds()}
+
+    async def stop_buffering(self, params):
+        async with self._command_lock:
+            if not self.engine.is_buffering:
+                raise ControlError(409, "Буферизация не идёт")
+            await asyncio.to_thread(self.engine.stop_buffering)
+        return {'ok': True}
+
+    async def save_buffer(self, params):
+        seconds = params.get('seconds')
+        if seconds is not None:
+            try:
+                seconds = float(seconds)
+            except (TypeError, ValueError):
+                seconds = 0
+            if seconds <= 0:
+                raise ControlError(400, "seconds - положительное число")
+        job_id = self.engine.save_buffer(seconds)
+        if job_id is None:
+            raise ControlError(409, "Буферизация не активна или данные отсутствуют")
+        return {'ok': True, 'job': job_id}
+
+    async def arm_trigger(self, params):
+        devices = self._devices(params)
+        settings = {}
+        for key, attr in (('threshold_db', 'trigger_threshold_db'), ('hold', 'trigger_hold_seconds'),
+                          ('pre_roll', 'trigger_pre_roll_seconds')):
+            if key in params:
+                try:
+                    settings[attr] = float(params[key])
+                except (TypeError, ValueError):
+                    raise ControlError(400, f"{key} - число")
+        if settings.get('trigger_hold_seconds', 1) <= 0 or settings.get('trigger_pre_roll_seconds', 0) < 0:
+            raise ControlError(400, "hold - больше нуля, pre_roll - не меньше нуля")
+        async with self._command_lock:
+            if self.engine.trigger is not None:
+                raise ControlError(409, "Запись по сигналу уже включена")
+            for attr, value in settings.items():
+                setattr(self.engine, attr, value)
+            await asyncio.to_thread(self.engine.arm_trigger, devices)
+        return {'ok': True, 'devices': devices, 'threshold_db': self.engine.trigger_threshold_db,
+                'hold': self.engine.trigger_hold_seconds, 'pre_roll': self.engine.trigger_pre_roll_seconds}
+
+    async def disarm_trigger(self, params):
+        async with self._command_lock:
+            if self.engine.trigger is None:
+                raise ControlError(409, "Запись по сигналу не включена")
+            await asyncio.to_thread(self.engine.disarm_trigger)
+        return {'ok': True}
+
+    def get_job(self, job_id):
+        try:
+            job = self.engine.save_jobs.find(int(job_id))
+        except ValueError:
+            job = None
+        if job is None:
+            raise ControlError(404, f"Неизвестное задание {job_id}")
+        return {
+            'ok': True,
+            'job': job['id'],
+            'title': job['title'],
+            'total': job['total'],
+            'done': job['done'],
+            'finished': job['finished'],
+            'files': [result['path'] for result in job['results']],
+            'errors': [f"{name}: {error}" for name, error in job['errors']],
+        }
@@ -0,0 +1,215 @@
+"""Таблица аудиоустройств и подбор родных параметров входа"""
+
+import threading
+import time
+
+from .lazy import LazyModule
+
+sd = LazyModule('sounddevice')
+
+
+# Форматы хранения сэмплов: dtype потока и буфера, subtype WAV.
+# 24-битный звук PortAudio отдаёт в int32, в файл пишутся старшие 3 байта.
+SAMPLE_FORMATS = {
+    'int16': ('int16', 'PCM_16'),
+    'int24': ('int32', 'PCM_24'),
+    'float32': ('float32', 'FLOAT'),
+}
+
+
+class DeviceRegistry:
+    """Кэш таблицы аудиоустройств.
+
+    sd.query_devices() вызывается один раз, дальше имена, каналы и частоты
+    берутся из кэша по индексу. Первый опрос делает фоновый поток сразу
+    после start (окно появляется, не дожидаясь PortAudio, и получает
+    таблицу через listeners); get и all до него ждут опроса или делают
+    его сами, если start не вызывали. Повторный опрос - тот же поток,
+    только по request_refresh: его вызывают кнопка обновления и
+    уведомление о подключении устройства (окно получает его от системы);
+    запросы в пределах debounce склеиваются. Новые устройства PortAudio
+    видит только после переинициализации, поэтому пока открыты потоки
+    (is_busy), опрос откладывается и повторяется раз в RETRY_INTERVAL.
+
+    probe кэширует подобранные параметры устройств, пока устройство не
+    изменится в таблице. Переинициализация и проверки устройств идут под
+    lock, чтобы PortAudio не перезапустился посреди проверки.
+    """
+
+    RETRY_INTERVAL = 2.0
+
+    def __init__(self, is_busy=None, debounce=0.5):
+        self.is_busy = is_busy or (lambda: False)
+        self.debounce = debounce
+        self.lock = threading.RLock()
+        self.listeners = []
+        self.devices = []
+        self._probed = {}
+        self._loaded = threading.Event()
+        self._refresh_requested = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    @property
+    def ready(self):
+        """Прочитана ли таблица устройств (get и all не будут ждать)"""
+        return self._loaded.is_set()
+
+    def _ensure_loaded(self):
+        if self._loaded.is_set():
+            return
+        # Если первый опрос уже идёт в фоне, lock отпустится, когда он закончится
+        with self.lock:
+            if not self._loaded.is_set():
+                self.devices = [dict(dev) for dev in sd.query_devices()]
+                self._loaded.set()
+
+    def get(self, device_idx):
+        """Сведения об устройстве из кэша"""
+        self._ensure_loaded()
+        return self.devices[device_idx]
+
+    def all(self):
+        self._ensure_loaded()
+        return list(self.devices)
+
+    def probe_format(self, device_idx, sample_format='int16'):
+        """probe_device с кэшем по устройству и формату.
+
+        Пробных потоков не открывает. Вызывающий держит lock: rescan не
+        переинициализирует PortAudio посреди проверки, а проверки разных
+        устройств не идут одновременно (Pa_IsFormatSupported в WASAPI и ASIO
+        не обещает безопасности из нескольких потоков); probe берёт его сам.
+        """
+        device_info = self.get(device_idx)
+        key = (device_idx, self._signature(device_info), sample_format)
+        cached = self._probed.get(key)
+        if cached is not None:
+            return dict(cached[0])
+        fmt = probe_device(device_idx, sample_format, device_info)
+        self._probed.setdefault(key, (fmt, False))
+        return dict(fmt)
+
+    def probe(self, device_idx, sample_format='int16', open_stream=False):
+        """probe_format, а с open_stream ещё и пробный поток.
+
+        Открыть и закрыть поток - значит убедиться, что устройство не
+        занято, но это дольше. Вся проверка идёт под lock: rescan не
+        перезапустит PortAudio посреди неё, а потоки открываются по одному
+        (PortAudio не обещает, что открывать их из нескольких потоков
+        сразу безопасно - WASAPI, ASIO). Удачная проверка запоминается, и
+        повторная проверка того же устройства мгновенна.
+        """
+        with self.lock:
+            fmt = self.probe_format(device_idx, sample_format)
+            if not open_stream:
+                return fmt
+            key = (device_idx, self._signature(self.get(device_idx)), sample_format)
+            cached = self._probed.get(key)
+            if cached is None or not cached[1]:
+                test_stream = sd.InputStream(device=device_idx, channels=fmt['channels'],
+                                             samplerate=fmt['samplerate'], dtype=fmt['dtype'])
+                test_stream.close()
+                self._probed[key] = (fmt, True)
+        return fmt
+
+    def add_listener(self, callback):
+        """callback вызывается из фонового потока при изменении таблицы"""
+        self.listeners.append(callback)
+
+    def request_refresh(self):
+        self._refresh_requested.set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._refresh_requested.set()
+
+    def rescan(self):
+        """Переинициализирует PortAudio и перечитывает таблицу устройств.
+
+        Возвращает, изменилась ли таблица, или None, если устройства
+        заняты и опрос надо повторить позже.
+        """
+        with self.lock:
+            if self.is_busy():
+                return None
+            sd._terminate()
+            sd._initialize()
+            devices = [dict(dev) for dev in sd.query_devices()]
+            changed = [self._signature(d) for d in devices] != [self._signature(d) for d in self.devices]
+            self.devices = devices
+            if changed:
+                self._probed = {}
+        if changed:
+            for callback in self.listeners:
+                callback()
+        return changed
+
+    @staticmethod
+    def _signature(device_info):
+        return (device_info['name'], device_info['hostapi'], device_info['max_input_channels'],
+                device_info['max_output_channels'], device_info['default_samplerate'])
+
+    def _watch(self):
+        try:
+            first = not self._loaded.is_set()
+            self._ensure_loaded()
+            if first:
+                for callback in self.listeners:
+                    callback()
+        except Exception as e:
+            print(f"Ошибка опроса устройств: {e}")
+        deferred = False
+        while not self._stopped:
+            # Без запроса поток спит: PortAudio переинициализируется только по событию
+            if self._refresh_requested.wait(self.RETRY_INTERVAL if deferred else None):
+                # Склеиваем серию запросов в один опрос
+                time.sleep(self.debounce)
+                self._refresh_requested.clear()
+            if self._stopped:
+                break
+            try:
+                deferred = self.rescan() is None
+            except Exception as e:
+                deferred = False
+                print(f"Ошибка опроса устройств: {e}")
+
+
+def probe_device(device_idx, sample_format='int16', device_info=None):
+    """Подбирает родные параметры входа устройства.
+
+    Возвращает словарь с частотой default_samplerate, полным числом входных
+    каналов, dtype потока и subtype WAV. Если устройство не принимает
+    выбранный формат, пробует остальные по порядку. device_info можно
+    передать из кэша DeviceRegistry, чтобы не опрашивать PortAudio.
+    """
+    if device_info is None:
+        device_info = sd.query_devices(device_idx)
+    samplerate = int(device_info['default_samplerate'])
+    channels = device_info['max_input_channels']
+    if channels <= 0:
+        raise ValueError(f"Устройство {device_idx} не имеет входов")
+
+    candidates = [sample_format] + [f for f in SAMPLE_FORMATS if f != sample_format]
+    error = None
+    for name in candidates:
+        dtype, subtype = SAMPLE_FORMATS[name]
+        try:
+            sd.check_input_settings(device=device_idx, channels=channels,
+                                    dtype=dtype, samplerate=samplerate)
+        except Exception as e:
+            error = error or e
+            continue
+        return {
+            'name': device_info['name'],
+            'samplerate': samplerate,
+            'channels': channels,
+            'dtype': dtype,
+            'subtype': subtype,
+        }
+    raise error
@@ -0,0 +1,911 @@
+"""Движок захвата: потоки устройств, мгновенный повтор и сохранение дублей.
+
+Не зависит от GUI: окно и консольный режим задают настройки атрибутами
+CaptureEngine и получают ошибки через on_error, а ход сохранения - из
+очереди save_jobs.events.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from functools import partial
+
+import numpy as np
+
+from .analysis import TakeAnalyzer
+from .alignment import LinearResampler, TakeAligner, correct_drift_file
+from .buffers import MappedRingBuffer, RingBuffer
+from .devices import DeviceRegistry
+from .jobs import SaveJobManager
+from .lazy import LazyModule
+from .lifecycle import IDLE, Lifecycle
+from .manifest import ChecksumFile, add_manifest_files, archive_take, describe_audio, describe_file, new_manifest, \
+    write_manifest
+from .metering import LevelMeters, StreamMetrics
+from .peaks import PeakWriter, peaks_path, write_peaks
+from .resampling import PolyphaseResampler, ResamplingStage
+from .trigger import TriggeredRecorder
+from .writers import (AggregateTrackWriter, SegmentedTrackWriter, StreamingTrackWriter, aggregate_format,
+                      recover_segments, resolve_output_format, safe_filename)
+
+sd = LazyModule('sounddevice')
+sf = LazyModule('soundfile')
+# Рабочие процессы (и multiprocessing) нужны только при capture_processes
+workers = LazyModule('recorder.workers')
+
+
+class CaptureEngine:
+    """Запись и буферизация с нескольких входных устройств.
+
+    Настройки - обычные атрибуты, их читают в момент старта записи,
+    буферизации или сохранения:
+    sample_format, output_format - ключи SAMPLE_FORMATS и OUTPUT_FORMATS;
+    stream_to_disk - писать дорожки на диск во время записи;
+    segment_limits - (секунды, байты) для сегментной записи или None;
+    aggregate - писать все устройства в один многоканальный файл
+    (частоты устройств в файле должны совпадать, дрейф не корректируется);
+    session_samplerate - частота файлов дубля: устройства захватываются на
+    родных частотах, и отличающиеся дорожки переводятся в неё
+    (recorder.resampling); None - каждая дорожка на своей частоте;
+    align_tracks, correct_drift - выравнивание дорожек и коррекция дрейфа;
+    export_metrics - сохранять метрики потоков рядом с дублем;
+    write_peaks - писать рядом с дорожками обзор волны (.peaks);
+    analyze_takes - после сохранения дубля считать громкость, пики,
+    клиппинг и карту тишины (recorder.analysis) в пуле процессов;
+    archive_takes - упаковывать каждый дубль с манифестом в один .tar
+    вместо отдельных файлов (recorder.manifest);
+    buffer_minutes - длительность буфера мгновенного повтора;
+    replay_windows - длительности (с) окон "сохранить последние N секунд",
+    которые обслуживает один общий буфер: он не короче самого длинного;
+    длину буфера и окна можно менять на ходу (resize_buffer);
+    buffer_on_disk - держать буфер повтора в файлах в output_dir, а не в RAM;
+    trigger_threshold_db, trigger_hold_seconds, trigger_pre_roll_seconds -
+    порог, удержание и предзапись дублей по сигналу (см. TriggeredRecorder);
+    capture_processes - сколько рабочих процессов захвата: потоки устройств
+    открываются в них и не делят GIL с остальным (recorder.workers);
+    0 - потоки открываются в этом процессе.
+
+    Запись и буферизация проходят состояния idle, arming, recording,
+    flushing (recorder.lifecycle); о переходах сообщает
+    on_state_change('recording' или 'buffering', состояние).
+    """
+
+    # Запас в начале полного буфера, который не попадает в сохраняемое окно
+    SNAPSHOT_RESERVE_SECONDS = 0.5
+    # На сколько устройство может отстать от остальных при сведении в один файл
+    AGGREGATE_MAX_LAG_SECONDS = 2.0
+
+    def __init__(self, output_dir, registry=None, save_jobs=None):
+        self.output_dir = output_dir
+        self.sample_format = 'int16'
+        self.output_format = 'WAV'
+        self.stream_to_disk = False
+        self.segment_limits = None
+        self.aggregate = False
+        self.session_samplerate = None
+        self.align_tracks = True
+        self.correct_drift = False
+        self.export_metrics = True
+        self.write_peaks = True
+        self.analyze_takes = False
+        self.archive_takes = False
+        self.buffer_minutes = 2
+        self.replay_windows = []
+        self.buffer_on_disk = False
+        self.trigger_threshold_db = -40.0
+        self.trigger_hold_seconds = 2.0
+        self.trigger_pre_roll_seconds = 2.0
+        self.capture_processes = 0
+        # on_error(заголовок, текст) и on_state_change(что, состояние) вызываются из рабочих потоков
+        self.on_error = None
+        self.on_state_change = None
+
+        self.recording_lifecycle = None
+        self.buffer_lifecycle = None
+        self.recording_thread = None
+        self.buffer_thread = None
+        self.selected_inputs = set()
+        self.buffer_inputs = set()
+        self.device_formats = {}
+        self.streams = []
+        self.writers = {}
+        self.aligner = None
+        self.audio_data = {}
+        self.buffer_queue = {}
+        self.buffer_formats = {}
+        self.buffer_streams = []
+        self.buffer_lock = threading.Lock()
+        self.buffer_generation = 0
+        self.last_buffer_save = (None, 0)
+        self.trigger = None
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.registry = registry or DeviceRegistry(is_busy=self.is_busy)
+        self.save_jobs = save_jobs or SaveJobManager()
+        self.meters = LevelMeters()
+        self.analyzer = TakeAnalyzer()
+        self.take_metrics = StreamMetrics()
+        self.buffer_metrics = StreamMetrics()
+
+    # Как часто поток буферизации отпускает кольца, заменённые resize_buffer
+    TRIM_INTERVAL = 0.1
+
+    @property
+    def is_recording(self):
+        return self.recording_lifecycle is not None and self.recording_lifecycle.active
+
+    @property
+    def is_buffering(self):
+        return self.buffer_lifecycle is not None and self.buffer_lifecycle.active
+
+    @property
+    def recording_state(self):
+        return self.recording_lifecycle.state if self.recording_lifecycle is not None else IDLE
+
+    @property
+    def buffering_state(self):
+        return self.buffer_lifecycle.state if self.buffer_lifecycle is not None else IDLE
+
+    def new_lifecycle(self, what):
+        def on_change(state):
+            if self.on_state_change is not None:
+                self.on_state_change(what, state)
+        lifecycle = Lifecycle(on_change)
+        on_change(lifecycle.state)
+        return lifecycle
+
+    def is_busy(self):
+        return self.is_recording or self.is_buffering or self.trigger is not None
+
+    def report_error(self, title, message):
+        if self.on_error is not None:
+            self.on_error(title, message)
+        else:
+            print(f"{title}: {message}")
+
+    def prepare_devices(self, device_ids):
+        """Проверяет, что устройства можно открыть в родном формате.
+
+        Возвращает словарь {устройство: параметры probe_device} и список
+        описаний устройств, которые записать не получится.
+        """
+        formats = {}
+        invalid = []
+        # Устройства проверяются по одному под lock: фоновый опрос не
+        # переинициализирует PortAudio посреди проверки, а WASAPI и ASIO не
+        # обещают, что проверять форматы и открывать потоки из нескольких
+        # потоков сразу безопасно. Проверенные устройства берутся из кэша.
+        with self.registry.lock:
+            for device_idx in device_ids:
+                device_name = str(device_idx)
+                try:
+                    device_info = self.registry.get(device_idx)
+                    device_name = device_info['name']
+                    if device_info['max_input_channels'] <= 0:
+                        invalid.append(device_name)
+                        continue
+                    fmt = self.registry.probe_format(device_idx, self.sample_format)
+                    resolve_output_format(self.output_format, self.session_format(fmt))
+                    # Проверяем, что устройство действительно доступно для записи:
+                    # пробный поток открывается только при первой проверке
+                    self.registry.probe(device_idx, self.sample_format, open_stream=True)
+                except Exception as e:
+                    invalid.append(f"{device_name} (ошибка: {str(e)})")
+                    continue
+                formats[device_idx] = fmt
+        return formats, invalid
+
+    def capture_pool(self, device_ids):
+        """Рабочие процессы захвата на один сеанс или None, если потоки открываются здесь"""
+        if not self.capture_processes or not device_ids:
+            return None
+        return workers.CapturePool(min(self.capture_processes, len(device_ids)), on_error=self.report_error)
+
+    @staticmethod
+    def open_input_stream(pool, device_idx, fmt, callback):
+        """Открывает поток устройства здесь или, если есть pool, в рабочем процессе"""
+        if pool is not None:
+            return pool.open(device_idx, fmt, callback)
+        return sd.InputStream(
+            device=device_idx,
+            channels=fmt['channels'],
+            samplerate=fmt['samplerate'],
+            callback=callback,
+            dtype=fmt['dtype']
+        )
+
+    def start_recording(self, device_ids, device_formats=None, duration=None):
+        """Запускает поток записи; device_formats - результат prepare_devices.
+
+        В режиме aggregate сразу проверяет, что устройства можно свести в
+        один файл (иначе ValueError). С duration дубль останавливается сам,
+        когда каждое устройство запишет ровно duration секунд своих кадров.
+        """
+        if self.is_recording:
+            return
+        if self.aggregate and device_formats:
+            aggregate_format({idx: self.session_format(fmt) for idx, fmt in device_formats.items()})
+        self.selected_inputs = set(device_ids)
+        self.device_formats = dict(device_formats or {})
+        self.audio_data = {idx: [] for idx in self.selected_inputs}
+        self.recording_lifecycle = lifecycle = self.new_lifecycle('recording')
+        self.recording_thread = threading.Thread(target=self.record_audio, args=(lifecycle, duration), daemon=True)
+        self.recording_thread.start()
+
+    def stop_recording(self):
+        if self.recording_lifecycle is not None:
+            self.recording_lifecycle.request_stop()
+
+    def wait_recording_stop(self, timeout=None):
+        """Ждёт, пока дубль остановят или он кончится по таймеру; True - остановлен"""
+        lifecycle = self.recording_lifecycle
+        return lifecycle is None or lifecycle.wait_stop(timeout)
+
+    def timer_seconds_left(self):
+        """Сколько секунд осталось до конца дубля по таймеру (по кадрам, а не по часам)"""
+        lifecycle = self.recording_lifecycle
+        return lifecycle.seconds_left() if lifecycle is not None else None
+
+    def wait_recording(self, timeout=None):
+        """Ждёт закрытия потоков записи (сохранение уже поставлено в очередь)"""
+        if self.recording_thread is not None:
+            self.recording_thread.join(timeout)
+
+    def session_format(self, fmt):
+        """Параметры файла дорожки: при другой частоте сессии - она и float32"""
+        session = self.session_samplerate
+        if not session or int(session) == fmt['samplerate']:
+            return fmt
+        return dict(fmt, samplerate=int(session), dtype='float32')
+
+    def resampling_stage(self, target, fmt, file_fmt):
+        """Ставит перед target передискретизацию, если частота файла не родная"""
+        if fmt['samplerate'] == file_fmt['samplerate']:
+            return target
+        resampler = PolyphaseResampler(fmt['samplerate'], file_fmt['samplerate'], fmt['channels'])
+        return ResamplingStage(target, resampler)
+
+    @staticmethod
+    def session_offsets(aligner, formats, file_formats):
+        """start_offset(устройство) в кадрах файлов: aligner считает в родных частотах"""
+        def offset_frames(device_idx, force=False):
+            frames = aligner.offset_frames(device_idx, force=force)
+            if frames is None:
+                return None
+            return round(frames * file_formats[device_idx]['samplerate'] / formats[device_idx]['samplerate'])
+        return offset_frames
+
+    def start_buffering(self, device_ids):
+        """Запускает буферизацию для мгновенного повтора"""
+        if self.is_buffering:
+            return
+        if not device_ids:
+            raise ValueError("Не выбраны устройства для буферизации")
+
+        # Дожидаемся предыдущего потока, если он ещё закрывает устройства
+        if self.buffer_thread and self.buffer_thread.is_alive():
+            self.buffer_thread.join(1.0)
+
+        self.buffer_inputs = set(device_ids)
+        self.buffer_queue = {}
+        self.buffer_lifecycle = lifecycle = self.new_lifecycle('buffering')
+        self.buffer_thread = threading.Thread(target=self.buffer_audio, args=(lifecycle,), daemon=True)
+        self.buffer_thread.start()
+
+    def stop_buffering(self):
+        """Останавливает буферизацию и освобождает буферы"""
+        if not self.is_buffering:
+            return
+        self.buffer_lifecycle.request_stop()
+        if self.buffer_thread is not None:
+            self.buffer_thread.join(1.0)
+        self.buffer_queue = {}
+
+    def buffer_seconds(self):
+        """Длина буфера повтора: buffer_minutes, но не короче самого длинного окна"""
+        return max([self.buffer_minutes * 60] + list(self.replay_windows))
+
+    def resize_buffer(self, minutes=None, windows=None):
+        """Меняет длину буфера и окна повтора, не перезапуская потоки устройств.
+
+        Каждое кольцо заменяется новым нужного размера (см. RingBuffer):
+        накопленные кадры не копируются и не теряются, их читают из прежнего
+        кольца, пока новое не заполнится.
+        """
+        if minutes is not None:
+            self.buffer_minutes = minutes
+        if windows is not None:
+            self.replay_windows = sorted(windows)
+        with self.buffer_lock:
+            if not self.is_buffering:
+                return
+            for device_idx, ring in list(self.buffer_queue.items()):
+                fmt = self.buffer_formats[device_idx]
+                capacity = int(fmt['samplerate'] * self.buffer_seconds())
+                if capacity != ring.capacity:
+                    self.buffer_queue[device_idx] = self.new_ring(device_idx, fmt, capacity,
+                                                                  isinstance(ring, MappedRingBuffer), ring)
+
+    def new_ring(self, device_idx, fmt, capacity, on_disk, predecessor=None):
+        """Кольцо буфера повтора устройства; predecessor - кольцо, которое оно заменяет"""
+        if not on_disk:
+            return RingBuffer(capacity, fmt['channels'], fmt['dtype'], predecessor)
+        # У каждого кольца свой файл: прежний читается, пока новое не заполнится
+        suffix = f".{self.buffer_generation}" if self.buffer_generation else ""
+        self.buffer_generation += 1
+        filename = f".replay_{device_idx}_{safe_filename(fmt['name'])}{suffix}.ring"
+        return MappedRingBuffer(os.path.join(self.output_dir, filename), capacity, fmt['channels'], fmt['dtype'],
+                                predecessor=predecessor)
+
+    def arm_trigger(self, device_ids, device_formats=None):
+        """Начинает ждать сигнал: дубли будут записываться сами"""
+        if self.trigger is not None:
+            return
+        if not device_ids:
+            raise ValueError("Не выбраны устройства для записи по сигналу")
+        self.trigger = TriggeredRecorder(
+            self, device_ids, device_formats, threshold_db=self.trigger_threshold_db,
+            hold_seconds=self.trigger_hold_seconds, pre_roll_seconds=self.trigger_pre_roll_seconds)
+        try:
+            self.trigger.start()
+        except Exception:
+            self.trigger = None
+            raise
+
+    def disarm_trigger(self):
+        """Перестаёт ждать сигнал; начатый дубль сохраняется"""
+        trigger, self.trigger = self.trigger, None
+        if trigger is not None:
+            trigger.stop()
+
+    def buffer_audio(self, lifecycle):
+        """Тело потока буферизации"""
+        sample_format = self.sample_format
+        on_disk = self.buffer_on_disk
+
+        self.buffer_queue = rings = {}
+        self.buffer_formats = {}
+        self.buffer_generation = 0
+
+        self.buffer_metrics = metrics = StreamMetrics()
+
+        def callback(indata, frames, time_info, status, device_idx):
+            started = time.perf_counter()
+            ring = rings.get(device_idx)
+            if lifecycle.active and ring is not None:
+                ring.write(indata)
+                self.meters.update(device_idx, indata)
+                if on_disk:
+                    metrics.record_queue(device_idx, len(ring.queue), ring.dropped_blocks)
+                metrics.record(device_idx, frames, time_info, status, started)
+
+        self.buffer_streams = []
+        pool = None
+        try:
+            pool = self.capture_pool(self.buffer_inputs)
+            # Пока открываются потоки, опрос устройств не переинициализирует PortAudio
+            with self.registry.lock, self.buffer_lock:
+                for device_idx in self.buffer_inputs:
+                    fmt = self.registry.probe(device_idx, sample_format)
+                    max_samples = int(fmt['samplerate'] * self.buffer_seconds())
+                    self.buffer_formats[device_idx] = fmt
+                    metrics.add_device(device_idx, fmt['name'])
+                    rings[device_idx] = self.new_ring(device_idx, fmt, max_samples, on_disk)
+
+                    stream = self.open_input_stream(
+                        pool, device_idx, fmt,
+                        lambda indata, frames, time, status, idx=device_idx: callback(indata, frames, time, status, idx))
+                    self.buffer_streams.append(stream)
+                    stream.start()
+            lifecycle.started()
+
+            # Остановка будит поток сразу; таймаут нужен только для trim
+            while not lifecycle.wait_stop(self.TRIM_INTERVAL):
+                for ring in list(rings.values()):
+                    ring.trim()
+
+        except Exception as e:
+            self.report_error("Ошибка буферизации", str(e))
+        finally:
+            lifecycle.request_stop()
+            with self.registry.lock:
+                for stream in self.buffer_streams:
+                    try:
+                        stream.stop()
+                        stream.close()
+                    except:
+                        pass
+            if pool is not None:
+                pool.close()
+            self.buffer_streams = []
+            with self.buffer_lock:
+                for ring in rings.values():
+                    ring.close()
+            lifecycle.finished()
+
+    def save_buffer(self, seconds=None):
+        """Сохраняет последние seconds секунд буфера (по умолчанию весь буфер).
+
+        Возвращает номер задания сохранения или None, если буфер не активен.
+        """
+        if not self.is_buffering or not self.buffer_queue:
+            return None
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # Несколько сохранений в одну секунду не должны писать в одни файлы
+        last_timestamp, count = self.last_buffer_save
+        count = count + 1 if timestamp == last_timestamp else 1
+        self.last_buffer_save = (timestamp, count)
+        if count > 1:
+            timestamp = f"{timestamp}_{count}"
+        output_format = self.output_format
+        output_dir = self.output_dir
+        with_peaks = self.write_peaks
+        tasks = []
+
+        def save_track(device_idx, fmt, file_fmt, ring, start, frames):
+            file_format, subtype, extension = resolve_output_format(output_format, file_fmt)
+            filename = f"buffer_{safe_filename(fmt['name'])}_{timestamp}.{extension}"
+            filepath = os.path.join(output_dir, filename)
+            lost_frames = 0
+            resampler = None
+            if file_fmt['samplerate'] != fmt['samplerate']:
+                resampler = PolyphaseResampler(fmt['samplerate'], file_fmt['samplerate'], fmt['channels'])
+            peaks = PeakWriter(peaks_path(filepath), file_fmt['samplerate'], fmt['channels']) if with_peaks else None
+
+            try:
+                with ChecksumFile(filepath) as raw, sf.SoundFile(raw, 'w', file_fmt['samplerate'], fmt['channels'],
+                                                                 subtype=subtype, format=file_format) as f:
+                    def write(chunk):
+                        f.write(chunk)
+                        if peaks is not None:
+                            peaks.add(chunk)
+
+                    for chunk, lost in ring.iter_window(start, frames):
+                        write(chunk if resampler is None else resampler.process(chunk))
+                        lost_frames += lost
+                    if resampler is not None:
+                        write(resampler.flush())
+            finally:
+                if peaks is not None:
+                    peaks.close()
+            result = {'path': filepath, 'device': device_idx, 'name': fmt['name'], 'file': filename,
+                      'checksums': {filename: raw.checksum()}}
+            if resampler is not None:
+                result['file_samplerate'] = file_fmt['samplerate']
+            if lost_frames:
+                result['warning'] = (f"Устройство {device_idx}: начало окна перезаписано "
+                                     f"до сохранения ({lost_frames / fmt['samplerate']:.2f} с заменено тишиной)")
+            return result
+
+        for device_idx, ring in list(self.buffer_queue.items()):
+            if not len(ring):
+                continue
+
+            # Окно только помечается; копирование и кодирование идут в фоне кусками
+            fmt = self.buffer_formats[device_idx]
+            frames = None if seconds is None else int(seconds * fmt['samplerate'])
+            start, frames = ring.snapshot(frames, self.SNAPSHOT_RESERVE_SECONDS * fmt['samplerate'])
+            tasks.append((device_idx, partial(save_track, device_idx, fmt, self.session_format(fmt),
+                                              ring, start, frames)))
+
+        return self.save_jobs.submit(f"буфер {timestamp}", tasks, done_text="Буфер успешно сохранен",
+                                     on_finished=partial(self.finish_take, timestamp, None, prefix='buffer',
+                                                         analyze=False, window_seconds=seconds))
+
+    def record_audio(self, lifecycle, duration=None):
+        """Тело потока записи; duration - длительность дубля по таймеру"""
+        self.streams = streams = []
+        self.writers = writers = {}
+        self.aligner = aligner = TakeAligner()
+        self.take_metrics = metrics = StreamMetrics()
+        audio_data = self.audio_data
+        selected_inputs = set(self.selected_inputs)
+        formats = {}
+        file_formats = {}
+        output_format = self.output_format
+        segment_limits = self.segment_limits
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        take_fields = {}
+
+        aggregate = None
+        pool = None
+
+        try:
+            pool = self.capture_pool(selected_inputs)
+            # Пока открываются потоки, опрос устройств не переинициализирует PortAudio
+            with self.registry.lock:
+                for device_idx in selected_inputs:
+                    fmt = self.device_formats.get(device_idx) or self.registry.probe(device_idx, self.sample_format)
+                    formats[device_idx] = fmt
+                    file_formats[device_idx] = self.session_format(fmt)
+                    aligner.add_track(device_idx, fmt['samplerate'])
+                    metrics.add_device(device_idx, fmt['name'])
+                if duration:
+                    lifecycle.set_timer(duration, {idx: fmt['samplerate'] for idx, fmt in formats.items()})
+
+                offsets = self.session_offsets(aligner, formats, file_formats) if self.align_tracks else None
+                if self.aggregate:
+                    aggregate = self.open_aggregate_writer(timestamp, offsets, file_formats, output_format,
+                                                           segment_limits)
+                    for device_idx, target in aggregate.inputs.items():
+                        writers[device_idx] = self.resampling_stage(target, formats[device_idx],
+                                                                    file_formats[device_idx])
+                elif self.stream_to_disk or segment_limits:
+                    for device_idx, fmt in formats.items():
+                        file_fmt = file_formats[device_idx]
+                        start_offset = partial(offsets, device_idx) if offsets else None
+                        writer = self.open_track_writer(
+                            f"recording_{safe_filename(fmt['name'])}_{timestamp}", file_fmt,
+                            *resolve_output_format(output_format, file_fmt), segment_limits, start_offset=start_offset)
+                        writers[device_idx] = self.resampling_stage(writer, fmt, file_fmt)
+
+                def make_callback(idx):
+                    return lambda indata, frames, time, status: self.audio_callback(indata, idx, time, status)
+
+                for device_idx, fmt in formats.items():
+                    stream = self.open_input_stream(pool, device_idx, fmt, make_callback(device_idx))
+                    streams.append(stream)
+                    stream.start()
+            lifecycle.started()
+            stalled = lifecycle.wait_timer()
+            if stalled:
+                # Кадры не добраны к сроку: устройство зависло или отключено
+                warnings = [f"Устройство {idx} ({formats[idx]['name']}): по таймеру не записано "
+                            f"{left / formats[idx]['samplerate']:.2f} с" for idx, left in sorted(stalled.items())]
+                take_fields['warnings'] = warnings
+                self.report_error("Таймер дубля", "\n".join(warnings))
+
+        except Exception as e:
+            self.report_error("Ошибка записи", str(e))
+        finally:
+            lifecycle.request_stop()
+            with self.registry.lock:
+                for stream in streams:
+                    try:
+                        stream.stop()
+                        stream.close()
+                    except:
+                        pass
+            if pool is not None:
+                pool.close()
+
+            if self.export_metrics and metrics.devices:
+                try:
+                    metrics.export(os.path.join(self.output_dir, f"metrics_{timestamp}"))
+                except Exception as e:
+                    print(f"Ошибка записи метрик: {e}")
+
+            if aggregate is not None:
+                self.finish_aggregate(timestamp, aligner, formats, aggregate, writers, **take_fields)
+            elif writers:
+                self.finish_streaming(timestamp, aligner, formats, writers, **take_fields)
+            else:
+                self.save_audio_files(formats, aligner, audio_data, output_format, file_formats, timestamp,
+                                      **take_fields)
+            lifecycle.finished()
+
+    def open_track_writer(self, basename, fmt, file_format, subtype, extension, segment_limits, **options):
+        """Открывает потоковую (или сегментную) запись файла basename.extension"""
+        options.update(dtype=fmt['dtype'], subtype=subtype, file_format=file_format, peaks=self.write_peaks)
+        if segment_limits:
+            segment_seconds, segment_bytes = segment_limits
+            filename = f"{basename}_part{{part:03d}}.{extension}"
+            return SegmentedTrackWriter(
+                os.path.join(self.output_dir, filename), fmt['samplerate'], fmt['channels'],
+                segment_seconds=segment_seconds, segment_bytes=segment_bytes, **options)
+        return StreamingTrackWriter(
+            os.path.join(self.output_dir, f"{basename}.{extension}"), fmt['samplerate'], fmt['channels'],
+            **options)
+
+    def open_aggregate_writer(self, timestamp, start_offset, formats, output_format, segment_limits):
+        """Открывает общий многоканальный файл для всех устройств дубля.
+
+        formats - параметры дорожек в файле (после передискретизации).
+        """
+        fmt = aggregate_format(formats)
+        file_format, subtype, extension = resolve_output_format(output_format, fmt)
+        # Без сегментов многоканальный WAV быстро упирается в 4 ГБ
+        if file_format == 'WAV' and not segment_limits:
+            file_format = 'RF64'
+        target = self.open_track_writer(f"recording_aggregate_{timestamp}", fmt, file_format, subtype,
+                                        extension, segment_limits)
+        tracks = [(device_idx, formats[device_idx]['channels']) for device_idx in sorted(formats)]
+        return AggregateTrackWriter(
+            target, tracks, fmt['dtype'], start_offset=start_offset,
+            max_lag_frames=int(self.AGGREGATE_MAX_LAG_SECONDS * fmt['samplerate']))
+
+    def audio_callback(self, indata, device_idx, time_info=None, status=None):
+        """Callback для записи аудиоданных"""
+        started = time.perf_counter()
+        lifecycle = self.recording_lifecycle
+        if lifecycle is not None and lifecycle.active:
+            frames = len(indata)
+            # Таймер дубля: блок, на котором кончается лимит, обрезается до кадра
+            taken = lifecycle.take_frames(device_idx, frames)
+            if not taken:
+                return
+            if taken < frames:
+                indata = indata[:taken]
+            self.aligner.on_block(device_idx, len(indata), time_info)
+            self.meters.update(device_idx, indata)
+            writer = self.writers.get(device_idx)
+            if writer is not None:
+                writer.push(indata)
+                self.take_metrics.record_queue(device_idx, len(writer.queue), writer.dropped_blocks)
+            else:
+                self.audio_data[device_idx].append(indata.copy())
+            self.take_metrics.record(device_idx, frames, time_info, status, started)
+
+    def finish_streaming(self, timestamp, aligner, formats, writers, **take_fields):
+        """Дописывает очереди потоковой записи и закрывает файлы в фоне.
+
+        take_fields добавляются в описание дубля; без aligner дрейф не корректируется.
+        """
+        correct_drift = self.correct_drift
+        aligned = self.align_tracks
+
+        def finish_track(device_idx, writer):
+            writer.close()
+            if writer.error:
+                raise writer.error
+            if not writer.frames_written:
+                return None
+            checksums = {os.path.basename(path): checksum for path, checksum in writer.checksums.items()}
+            drift_factor = aligner.drift_factor(device_idx) if correct_drift and aligner else 1.0
+            if abs(drift_factor - 1.0) > 1e-6:
+                for filepath in writer.files:
+                    correct_drift_file(filepath, drift_factor)
+                # Файлы переписаны, суммы посчитает манифест
+                checksums = {}
+            else:
+                drift_factor = 1.0
+            result = {'path': writer.files[0], 'device': device_idx, 'name': formats[device_idx]['name'],
+                      'file': os.path.basename(writer.files[0]), 'drift_factor': drift_factor,
+                      'checksums': checksums}
+            if writer.samplerate != formats[device_idx]['samplerate']:
+                result['file_samplerate'] = writer.samplerate
+            if len(writer.files) > 1:
+                result['segments'] = [os.path.basename(filepath) for filepath in writer.files]
+            if writer.dropped_blocks:
+                result['warning'] = f"Устройство {device_idx}: потеряно блоков {writer.dropped_blocks}"
+            return result
+
+        tasks = [(device_idx, partial(finish_track, device_idx, writer))
+                 for device_idx, writer in writers.items()]
+        on_finished = partial(self.finish_take, timestamp, aligner, aligned=aligned, **take_fields)
+        self.save_jobs.submit(f"запись {timestamp}", tasks, done_text="Аудиофайлы успешно сохранены",
+                              on_finished=on_finished)
+
+    def finish_aggregate(self, timestamp, aligner, formats, aggregate, inputs, **take_fields):
+        """Закрывает общий файл в фоне и пишет рядом карту каналов.
+
+        inputs - то, во что писали callback устройств: входы aggregate или
+        стадии передискретизации перед ними; take_fields добавляются в
+        описание дубля.
+        """
+        aligned = self.align_tracks
+        output_dir = self.output_dir
+        map_name = f"recording_aggregate_{timestamp}.channels.json"
+        stages = [stage for stage in inputs.values() if isinstance(stage, ResamplingStage)]
+
+        def finish():
+            # Хвосты фильтров должны попасть в файл до сведения последнего куска
+            for stage in stages:
+                stage.close()
+            aggregate.close()
+            aggregate.error = aggregate.error or next((stage.error for stage in stages if stage.error), None)
+            if aggregate.error:
+                raise aggregate.error
+            if not aggregate.frames_written:
+                return None
+            files = [os.path.basename(filepath) for filepath in aggregate.files]
+            with open(os.path.join(output_dir, map_name), 'w', encoding='utf-8') as f:
+                json.dump({
+                    'files': files,
+                    'samplerate': aggregate.target.samplerate,
+                    'channels': aggregate.channels,
+                    'format': aggregate.target.file_format,
+                    'subtype': aggregate.target.subtype,
+                    'map': aggregate.channel_map(formats),
+                    'padded_frames': {str(idx): frames for idx, frames in aggregate.padded_frames.items()},
+                }, f, ensure_ascii=False, indent=2)
+            result = {'path': aggregate.files[0], 'file': files[0], 'channel_map': map_name,
+                      'checksums': {os.path.basename(path): checksum
+                                    for path, checksum in aggregate.checksums.items()}}
+            if stages:
+                result['file_samplerate'] = aggregate.target.samplerate
+            if len(files) > 1:
+                result['segments'] = files
+            dropped_blocks = aggregate.target.dropped_blocks + sum(i.dropped_blocks for i in inputs.values())
+            if dropped_blocks:
+                result['warning'] = f"Общий файл: потеряно блоков {dropped_blocks}"
+            return result
+
+        def on_finished(results):
+            tracks = [{'device': device_idx, 'name': formats[device_idx]['name'], 'file': results[0]['file'],
+                       'first_channel': column + 1, 'channels': channels}
+                      for device_idx, (column, channels) in aggregate.columns.items()]
+            self.finish_take(timestamp, aligner, results, aligned, tracks=tracks, channel_map=map_name,
+                             **take_fields)
+
+        self.save_jobs.submit(f"запись {timestamp}", [("общий файл", finish)],
+                              done_text="Аудиофайлы успешно сохранены", on_finished=on_finished)
+
+    def save_audio_files(self, formats, aligner=None, audio_data=None, output_format='WAV', file_formats=None,
+                         timestamp=None, **take_fields):
+        """Сохраняет записанные аудиофайлы в фоне, по дорожке на задачу.
+
+        file_formats - параметры файлов, если частота сессии не родная
+        (по умолчанию - по текущей session_samplerate); timestamp - метка
+        дубля, под которой уже сохранены его метрики; take_fields
+        добавляются в описание дубля.
+        """
+        timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
+        audio_data = self.audio_data if audio_data is None else audio_data
+        if file_formats is None:
+            file_formats = {idx: self.session_format(fmt) for idx, fmt in formats.items()}
+        aligned = self.align_tracks
+        correct_drift = self.correct_drift
+        output_dir = self.output_dir
+        with_peaks = self.write_peaks
+
+        def save_track(device_idx, data_list):
+            fmt = formats[device_idx]
+            file_fmt = file_formats[device_idx]
+            file_format, subtype, extension = resolve_output_format(output_format, file_fmt)
+            device_name = fmt['name']
+            filename = f"recording_{safe_filename(device_name)}_{timestamp}.{extension}"
+            filepath = os.path.join(output_dir, filename)
+
+            drift_factor = 1.0
+            if aligner is not None:
+                offset = aligner.offset_frames(device_idx, force=True) if aligned else 0
+                if offset > 0:
+                    silence = np.zeros((offset, data_list[0].shape[1]), dtype=data_list[0].dtype)
+                    data_list = [silence] + data_list
+                if correct_drift:
+                    drift_factor = aligner.drift_factor(device_idx)
+                if abs(drift_factor - 1.0) > 1e-6:
+                    resampler = LinearResampler(drift_factor)
+                    data_list = [resampler.process(block) for block in data_list]
+                else:
+                    drift_factor = 1.0
+
+            result = {'path': filepath, 'device': device_idx, 'name': device_name,
+                      'file': filename, 'drift_factor': drift_factor}
+            if file_fmt['samplerate'] != fmt['samplerate']:
+                resampler = PolyphaseResampler(fmt['samplerate'], file_fmt['samplerate'], fmt['channels'])
+                data_list = [resampler.process(block) for block in data_list] + [resampler.flush()]
+                result['file_samplerate'] = file_fmt['samplerate']
+
+            data = np.concatenate(data_list)
+            with ChecksumFile(filepath) as raw:
+                sf.write(raw, data, file_fmt['samplerate'], subtype=subtype, format=file_format)
+            result['checksums'] = {filename: raw.checksum()}
+            if with_peaks:
+                write_peaks(filepath, data, file_fmt['samplerate'])
+            return result
+
+        tasks = [(device_idx, partial(save_track, device_idx, data_list))
+                 for device_idx, data_list in audio_data.items() if data_list]
+        on_finished = partial(self.finish_take, timestamp, aligner, aligned=aligned, **take_fields)
+        self.save_jobs.submit(f"запись {timestamp}", tasks, done_text="Аудиофайлы успешно сохранены",
+                              on_finished=on_finished)
+
+    def finish_take(self, timestamp, aligner, results, aligned=True, prefix='take', analyze=True, **fields):
+        """Пишет манифест сохранённого дубля, затем анализ и архив, если они включены.
+
+        Выполняется в пуле сохранения (on_finished задания). Анализ читает
+        файлы дубля, поэтому архив собирается после него.
+        """
+        manifest = self.write_take_info(timestamp, aligner, results, aligned, prefix=prefix, **fields)
+        archive = self.archive_takes
+
+        def after_analysis(analysis_results):
+            add_manifest_files(manifest, [result['path'] for result in analysis_results], 'analysis')
+            if archive:
+                self.archive_saved(timestamp, manifest)
+
+        if not analyze or self.analyze_saved(timestamp, results, on_finished=after_analysis) is None:
+            if archive:
+                self.archive_saved(timestamp, manifest)
+
+    def archive_saved(self, timestamp, manifest):
+        """Упаковывает дубль по манифесту в .tar отдельным заданием"""
+        return self.save_jobs.submit(
+            f"архив {timestamp}", [("архив", lambda: {'path': archive_take(manifest, remove=True)})],
+            done_text="Дубль упакован в архив")
+
+    def analyze_saved(self, timestamp, results, on_finished=None):
+        """Ставит анализ сохранённых файлов дубля отдельным заданием, если он включён"""
+        if not self.analyze_takes:
+            return None
+        paths = []
+        for result in results:
+            if result.get('segments'):
+                directory = os.path.dirname(result['path'])
+                paths += [os.path.join(directory, name) for name in result['segments']]
+            else:
+                paths.append(result['path'])
+        tasks = [(os.path.basename(path), partial(self.analyzer.analyze, path)) for path in paths]
+        return self.save_jobs.submit(f"анализ {timestamp}", tasks, done_text="Анализ дорожек завершён",
+                                     on_finished=on_finished)
+
+    def write_take_info(self, timestamp, aligner, results, aligned=True, tracks=None, prefix='take', **take_fields):
+        """Записывает манифест дубля <prefix>_<timestamp>.json и возвращает его путь.
+
+        results - результаты заданий сохранения (пути, сегменты, суммы
+        файлов); tracks - описание дорожек, если оно не совпадает с results
+        (общий файл). Кроме дорожек в манифест попадают общее время старта,
+        смещения выравнивания и все файлы дубля с контрольными суммами.
+        """
+        directory = os.path.dirname(results[0]['path'])
+        take_tracks = []
+        for track in tracks if tracks is not None else results:
+            track = {key: value for key, value in track.items() if key not in ('path', 'warning', 'checksums')}
+            if aligner is not None:
+                track.update(aligner.describe(track['device']))
+                if not aligned:
+                    track['offset_frames'] = 0
+            take_tracks.append(track)
+
+        files = []
+        for result in results:
+            checksums = result.get('checksums') or {}
+            for name in result.get('segments') or [os.path.basename(result['path'])]:
+                path = os.path.join(directory, name)
+                files.append(describe_audio(path, checksums.get(name)))
+                if os.path.exists(peaks_path(path)):
+                    files.append(describe_file(peaks_path(path), 'peaks'))
+        extras = [(take_fields.get('channel_map'), 'channel_map')]
+        if prefix == 'take':
+            extras += [(f"metrics_{timestamp}{ext}", 'metrics') for ext in ('.json', '.csv')]
+        for name, role in extras:
+            if name and os.path.exists(os.path.join(directory, name)):
+                files.append(describe_file(os.path.join(directory, name), role))
+
+        manifest = new_manifest(timestamp, take_tracks, files,
+                                start_time=aligner.start_time() if aligner is not None else None, **take_fields)
+        filepath = os.path.join(directory, f"{prefix}_{timestamp}.json")
+        write_manifest(filepath, manifest)
+        return filepath
+
+    def status(self):
+        """Состояние движка для внешнего управления"""
+        trigger = self.trigger
+        buffered = {}
+        for device_idx, ring in list(self.buffer_queue.items()):
+            fmt = self.buffer_formats.get(device_idx)
+            if fmt is not None:
+                buffered[str(device_idx)] = round(len(ring) / fmt['samplerate'], 3)
+        return {
+            'recording': self.is_recording,
+            'buffering': self.is_buffering,
+            'recording_state': self.recording_state,
+            'buffering_state': self.buffering_state,
+            'recording_devices': sorted(self.selected_inputs) if self.is_recording else [],
+            'buffer_devices': sorted(self.buffer_inputs) if self.is_buffering else [],
+            'buffered_seconds': buffered,
+            'buffer_minutes': self.buffer_minutes,
+            'replay_windows': self.replay_windows,
+            'buffer_on_disk': self.buffer_on_disk,
+            'aggregate': self.aggregate,
+            'session_samplerate': self.session_samplerate,
+            'analyze_takes': self.analyze_takes,
+            'archive_takes': self.archive_takes,
+            'write_peaks': self.write_peaks,
+            'trigger_armed': trigger is not None,
+            'trigger_recording': trigger is not None and trigger.recording,
+            'trigger_takes': trigger.takes if trigger is not None else 0,
+            'output_dir': self.output_dir,
+            'output_format': self.output_format,
+            'capture_processes': self.capture_processes,
+            'save_jobs_active': self.save_jobs.active_jobs(),
+        }
+
+    def recover_interrupted_segments(self):
+        """Чинит сегменты, оставшиеся недописанными после аварийного завершения"""
+        return recover_segments(self.output_dir)
@@ -0,0 +1,96 @@
+"""Фоновое сохранение дорожек"""
+
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+
+class SaveJobManager:
+    """Фоновое сохранение дорожек на пуле потоков.
+
+    Задание - набор дорожек одного дубля или буфера; каждая дорожка
+    кодируется и пишется отдельной задачей, параллельно с остальными.
+    Прогресс и завершение кладутся в очередь events, которую опрашивает
+    Tk-цикл, так что GUI не ждёт диск и новый дубль можно начинать, пока
+    предыдущий ещё сохраняется. Последние завершённые задания хранятся в
+    history, чтобы о них можно было спросить по номеру.
+    """
+
+    def __init__(self, max_workers=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or min(8, os.cpu_count() or 4),
+                                           thread_name_prefix="save")
+        self.events = queue.Queue()
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.history = deque(maxlen=100)
+        self.next_job_id = 1
+
+    def submit(self, title, tasks, done_text="", on_finished=None):
+        """tasks - список (имя, функция); функция возвращает словарь с ключом 'path' или None.
+
+        on_finished(results) выполняется в пуле после последней задачи.
+        """
+        with self.lock:
+            job = {
+                'id': self.next_job_id,
+                'title': title,
+                'done_text': done_text,
+                'total': len(tasks),
+                'done': 0,
+                'results': [],
+                'errors': [],
+                'finished': False,
+                'on_finished': on_finished,
+            }
+            self.next_job_id += 1
+            self.jobs[job['id']] = job
+        
+        if not tasks:
+            self._finish(job)
+            return job['id']
+        
+        self.events.put(('progress', job))
+        for name, func in tasks:
+            future = self.executor.submit(func)
+            future.add_done_callback(partial(self._task_done, job, name))
+        return job['id']
+
+    def active_jobs(self):
+        with self.lock:
+            return len(self.jobs)
+
+    def find(self, job_id):
+        """Задание по номеру: выполняющееся или из недавних (None - неизвестно)"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                job = next((j for j in self.history if j['id'] == job_id), None)
+            return job
+
+    def _task_done(self, job, name, future):
+        with self.lock:
+            error = future.exception()
+            if error is not None:
+                job['errors'].append((name, error))
+            elif future.result() is not None:
+                job['results'].append(future.result())
+            job['done'] += 1
+            finished = job['done'] == job['total']
+        self.events.put(('progress', job))
+        if finished:
+            self._finish(job)
+
+    def _finish(self, job):
+        if job['on_finished'] is not None and job['results']:
+            try:
+                job['on_finished'](job['results'])
+            except Exception as e:
+                job['errors'].append((job['title'], e))
+        with self.lock:
+            self.jobs.pop(job['id'], None)
+            self.history.append(job)
+            job['finished'] = True
+        self.events.put(('finished', job))
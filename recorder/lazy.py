@@ -0,0 +1,38 @@
+"""Отложенный импорт тяжёлых модулей.
+
+sounddevice при импорте загружает PortAudio и опрашивает все хост-API,
+soundfile загружает libsndfile. Окну и консольным командам, которым звук
+не нужен сразу, незачем ждать этого при запуске: LazyModule подставляется
+вместо модуля и импортирует его при первом обращении к атрибуту.
+"""
+
+import importlib
+
+
+class LazyModule:
+    """Заместитель модуля name: sd = LazyModule('sounddevice'), дальше sd.X как обычно"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    @property
+    def module(self):
+        """Сам модуль (импортирует его): атрибуты подменяются на нём, а не на заместителе"""
+        return self._load()
+
+    def __getattr__(self, attr):
+        # Вызывается только для атрибутов, которых нет у самого заместителя
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        return f"<отложенный модуль {self._name}{'' if self.loaded else ' (не загружен)'}>"
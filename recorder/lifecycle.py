@@ -0,0 +1,119 @@
+"""Жизненный цикл записи и буферизации без опроса флагов.
+
+Поток записи (или буферизации) проходит состояния:
+idle -> arming (открываются устройства) -> recording (потоки устройств
+запущены) -> flushing (потоки закрываются, дубль уходит на сохранение)
+-> idle. Переходы идут под threading.Condition, так что поток, который
+ждёт остановки, просыпается сразу, как её запросили - из окна, по сети или
+из callback устройства, - а не на следующем тике sleep.
+
+Таймер дубля считает кадры, а не секунды на часах: у каждого устройства
+свой лимит в кадрах (длительность * частота), callback пропускает ровно
+столько кадров и на последнем блоке сам запрашивает остановку. Если
+устройство зависло или отключено и своих кадров не доберёт, дубль
+останавливается по страховочному сроку: длительность плюс TIMER_MARGIN.
+"""
+
+import threading
+
+IDLE = 'idle'
+ARMING = 'arming'
+RECORDING = 'recording'
+FLUSHING = 'flushing'
+
+
+class Lifecycle:
+    """Состояние одного запуска записи или буферизации.
+
+    На каждый запуск создаётся свой объект: поток предыдущего дубля,
+    который ещё закрывает устройства, переводит в idle только свой.
+    on_change(состояние) вызывается из того потока, который сменил
+    состояние (в том числе из callback устройства).
+    """
+
+    # Запас страховочного срока таймера сверх длительности дубля, секунд
+    TIMER_MARGIN = 2.0
+
+    def __init__(self, on_change=None):
+        self.state = ARMING
+        self.on_change = on_change
+        self._condition = threading.Condition()
+        self.duration = None
+        self._samplerates = {}
+        self._frames_left = None
+
+    @property
+    def active(self):
+        """Идут ли данные в дубль: устройства открываются или уже пишут"""
+        return self.state in (ARMING, RECORDING)
+
+    def _set(self, state, only_from=None):
+        with self._condition:
+            if self.state == state or (only_from is not None and self.state not in only_from):
+                return False
+            self.state = state
+            self._condition.notify_all()
+        if self.on_change is not None:
+            self.on_change(state)
+        return True
+
+    def started(self):
+        """Все потоки устройств запущены (если остановку ещё не запросили)"""
+        self._set(RECORDING, only_from=(ARMING,))
+
+    def request_stop(self):
+        """Просит поток остановиться; возвращает, был ли запуск активен"""
+        return self._set(FLUSHING, only_from=(ARMING, RECORDING))
+
+    def finished(self):
+        self._set(IDLE)
+
+    def wait_stop(self, timeout=None):
+        """Ждёт запроса остановки не дольше timeout; True - остановку запросили"""
+        with self._condition:
+            return self._condition.wait_for(lambda: not self.active, timeout)
+
+    def wait_timer(self):
+        """Ждёт остановки; с таймером - не дольше duration + TIMER_MARGIN от вызова.
+
+        Вызывается сразу после started(). Если к сроку не все устройства
+        записали свой лимит, запуск останавливается, а возвращается
+        {устройство: недостающие кадры}; иначе - пустой словарь.
+        """
+        timeout = self.duration + self.TIMER_MARGIN if self._frames_left is not None else None
+        if self.wait_stop(timeout) or not self.request_stop():
+            return {}
+        return {idx: left for idx, left in self._frames_left.items() if left > 0}
+
+    def set_timer(self, duration, samplerates):
+        """Таймер дубля: duration секунд кадров каждого устройства ({устройство: частота}).
+
+        Когда все устройства запишут свой лимит, запуск останавливается сам.
+        """
+        self.duration = duration
+        self._samplerates = dict(samplerates)
+        self._frames_left = {idx: round(duration * rate) for idx, rate in self._samplerates.items()}
+
+    def take_frames(self, device_idx, frames):
+        """Сколько кадров из блока устройства ещё входит в дубль.
+
+        Вызывается из callback. Без лимита возвращает frames; блок, на
+        котором лимит кончился, обрезается, а последний такой блок среди
+        всех устройств запрашивает остановку.
+        """
+        if self._frames_left is None:
+            return frames
+        left = self._frames_left.get(device_idx, 0)
+        if left <= 0:
+            return 0
+        taken = min(frames, left)
+        self._frames_left[device_idx] = left - taken
+        if taken == left and not any(self._frames_left.values()):
+            self.request_stop()
+        return taken
+
+    def seconds_left(self):
+        """Сколько секунд осталось самому отстающему устройству (None - таймера нет)"""
+        if self._frames_left is None:
+            return None
+        return max((self._frames_left[idx] / rate for idx, rate in self._samplerates.items()), default=0.0)
@@ -0,0 +1,257 @@
+"""Манифест дубля и упаковка дубля в один архив.
+
+Манифест (take_<дубль>.json, для буфера повтора - buffer_<дубль>.json)
+описывает дубль целиком: дорожки устройств, частоты, карту каналов,
+смещения выравнивания, длительности и контрольные суммы всех файлов,
+так что приёмной стороне не нужно обходить директорию.
+
+Суммы аудиофайлов считаются по ходу записи: ChecksumFile стоит между
+libsndfile и диском и хэширует байты по мере дописывания. Заголовок
+libsndfile переписывает при закрытии (у WAV - первые десятки байт, у
+FLAC - блок STREAMINFO), поэтому sha256 в манифесте покрывает байты от
+checksum_offset до конца файла: у Ogg это весь файл, у WAV - всё после
+заголовка. Длина, частота и число кадров заголовка записаны в манифесте
+отдельно.
+
+archive_take складывает манифест (первым) и файлы дубля в один tar за
+один последовательный проход, попутно сверяя суммы; verify_take
+проверяет дубль по манифесту - в директории или в архиве.
+"""
+
+import hashlib
+import io
+import json
+import os
+import tarfile
+from datetime import datetime
+
+from .lazy import LazyModule
+
+sf = LazyModule('soundfile')
+
+MANIFEST_VERSION = 1
+READ_CHUNK = 1 << 20
+
+
+class ChecksumFile(io.FileIO):
+    """Файл для записи через libsndfile, который хэширует дописываемые байты.
+
+    Пока файл пишется, неизвестно, какое начало libsndfile перепишет при
+    закрытии, поэтому хэши ведутся от нескольких первых позиций записи
+    (CANDIDATES). checksum() выбирает самое раннее начало, после которого
+    ничего не переписывалось.
+    """
+
+    CANDIDATES = 4
+
+    def __init__(self, path):
+        super().__init__(path, 'w+b')
+        self._end = 0
+        self._hashes = []
+        self._rewritten_to = 0
+        self._broken = False
+
+    def write(self, data):
+        position = self.tell()
+        written = super().write(data)
+        if position == self._end:
+            if len(self._hashes) < self.CANDIDATES:
+                self._hashes.append((position, hashlib.sha256()))
+            chunk = memoryview(data)[:written]
+            for _, digest in self._hashes:
+                digest.update(chunk)
+            self._end += written
+        elif position + written <= self._end:
+            self._rewritten_to = max(self._rewritten_to, position + written)
+        else:
+            # Дыра или перезапись с заходом за конец: по ходу сумму не посчитать
+            self._broken = True
+        return written
+
+    def checksum(self):
+        """(смещение, sha256 байтов от смещения до конца) или None"""
+        if self._broken:
+            return None
+        for start, digest in self._hashes:
+            if start >= self._rewritten_to:
+                return start, digest.hexdigest()
+        return None
+
+
+def file_checksum(path, offset=0):
+    """sha256 байтов файла от offset до конца, чтением с диска"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for chunk in iter(lambda: f.read(READ_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def describe_file(path, role, checksum=None):
+    """Запись манифеста о файле; checksum - (смещение, sha256) из ChecksumFile"""
+    if checksum is None:
+        checksum = (0, file_checksum(path))
+    offset, digest = checksum
+    return {
+        'file': os.path.basename(path),
+        'role': role,
+        'bytes': os.path.getsize(path),
+        'sha256': digest,
+        'checksum_offset': offset,
+    }
+
+
+def describe_audio(path, checksum=None):
+    entry = describe_file(path, 'audio', checksum)
+    info = sf.info(path)
+    entry.update({
+        'format': info.format,
+        'subtype': info.subtype,
+        'samplerate': info.samplerate,
+        'channels': info.channels,
+        'frames': info.frames,
+        'duration': round(info.frames / info.samplerate, 6) if info.samplerate else 0.0,
+    })
+    return entry
+
+
+def write_manifest(path, manifest):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+
+def add_manifest_files(path, paths, role):
+    """Дописывает в манифест файлы, появившиеся после него (например, анализ)"""
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    known = {entry['file'] for entry in manifest['files']}
+    for file_path in paths:
+        if os.path.basename(file_path) not in known and os.path.exists(file_path):
+            manifest['files'].append(describe_file(file_path, role))
+    write_manifest(path, manifest)
+    return manifest
+
+
+def archive_path(manifest_path):
+    return os.path.splitext(manifest_path)[0] + ".tar"
+
+
+class _HashingReader:
+    """Обёртка для чтения, считающая sha256 байтов начиная с offset"""
+
+    def __init__(self, f, offset):
+        self.f = f
+        self.offset = offset
+        self.position = 0
+        self.digest = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        skip = max(0, self.offset - self.position)
+        if skip < len(data):
+            self.digest.update(memoryview(data)[skip:])
+        self.position += len(data)
+        return data
+
+
+def archive_take(manifest_path, remove=False):
+    """Упаковывает дубль в tar рядом с манифестом за один проход по файлам.
+
+    Каждый файл читается ровно один раз; по пути пересчитываются суммы из
+    манифеста, и при расхождении архив не создаётся (ValueError). С remove
+    исходные файлы и манифест удаляются после того, как архив записан.
+    Возвращает путь архива.
+    """
+    directory = os.path.dirname(manifest_path)
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    target = archive_path(manifest_path)
+    partial_target = target + ".partial"
+    try:
+        with tarfile.open(partial_target, 'w', format=tarfile.PAX_FORMAT, copybufsize=READ_CHUNK) as tar:
+            # Манифест первым: приёмной стороне хватает начала архива, чтобы знать всё о дубле
+            tar.add(manifest_path, arcname=os.path.basename(manifest_path))
+            for entry in manifest['files']:
+                path = os.path.join(directory, entry['file'])
+                info = tar.gettarinfo(path, arcname=entry['file'])
+                if info.size != entry['bytes']:
+                    raise ValueError(f"{entry['file']}: размер {info.size} вместо {entry['bytes']} из манифеста")
+                with open(path, 'rb') as f:
+                    reader = _HashingReader(f, entry['checksum_offset'])
+                    tar.addfile(info, reader)
+                if reader.digest.hexdigest() != entry['sha256']:
+                    raise ValueError(f"{entry['file']}: контрольная сумма не совпадает с манифестом")
+        with open(partial_target, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(partial_target, target)
+    except BaseException:
+        if os.path.exists(partial_target):
+            os.remove(partial_target)
+        raise
+
+    if remove:
+        for entry in manifest['files']:
+            os.remove(os.path.join(directory, entry['file']))
+        os.remove(manifest_path)
+    return target
+
+
+def verify_take(path):
+    """Сверяет файлы дубля с манифестом (путь к .json или к архиву .tar).
+
+    Возвращает список описаний расхождений; пустой список - всё сходится.
+    """
+    problems = []
+    if tarfile.is_tarfile(path):
+        with tarfile.open(path) as tar:
+            members = tar.getmembers()
+            if not members:
+                return ["архив пуст"]
+            manifest = json.load(tar.extractfile(members[0]))
+            by_name = {member.name: member for member in members[1:]}
+            for entry in manifest['files']:
+                member = by_name.get(entry['file'])
+                if member is None:
+                    problems.append(f"{entry['file']}: нет в архиве")
+                    continue
+                problems += _verify_entry(entry, member.size, tar.extractfile(member))
+        return problems
+
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    directory = os.path.dirname(path)
+    for entry in manifest['files']:
+        file_path = os.path.join(directory, entry['file'])
+        if not os.path.exists(file_path):
+            problems.append(f"{entry['file']}: файл отсутствует")
+            continue
+        with open(file_path, 'rb') as f:
+            problems += _verify_entry(entry, os.path.getsize(file_path), f)
+    return problems
+
+
+def _verify_entry(entry, size, f):
+    if size != entry['bytes']:
+        return [f"{entry['file']}: размер {size} вместо {entry['bytes']}"]
+    reader = _HashingReader(f, entry['checksum_offset'])
+    while reader.read(READ_CHUNK):
+        pass
+    if reader.digest.hexdigest() != entry['sha256']:
+        return [f"{entry['file']}: контрольная сумма не совпадает"]
+    return []
+
+
+def new_manifest(take, tracks, files, **fields):
+    """Манифест дубля take: tracks - описания дорожек, files - записи describe_*"""
+    durations = [entry['duration'] for entry in files if entry['role'] == 'audio']
+    manifest = {
+        'manifest_version': MANIFEST_VERSION,
+        'take': take,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'duration': max(durations, default=0.0),
+        'tracks': tracks,
+        'files': files,
+    }
+    manifest.update(fields)
+    return manifest
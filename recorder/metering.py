@@ -0,0 +1,187 @@
+"""Индикаторы уровня и метрики входных потоков"""
+
+import csv
+import json
+import time
+from bisect import bisect_right
+from datetime import datetime
+
+import numpy as np
+
+
+class LevelMeters:
+    """Пиковые и RMS-уровни входов по устройствам.
+
+    Callback сводит каждый блок к двум числам векторными редукциями NumPy
+    и пишет их в небольшой общий массив без блокировок: у каждого
+    устройства своя строка, в ней копится максимум с прошлого чтения.
+    GUI забирает значения методом read примерно 30 раз в секунду.
+    """
+
+    FLOOR_DB = -60.0
+
+    def __init__(self):
+        self._state = ({}, np.zeros((0, 2), dtype=np.float32))
+
+    def set_devices(self, device_ids):
+        rows = {device_idx: row for row, device_idx in enumerate(sorted(device_ids))}
+        # Строки и массив заменяются одной операцией, чтобы callback не увидел их вразнобой
+        self._state = (rows, np.zeros((len(rows), 2), dtype=np.float32))
+
+    def devices(self):
+        return list(self._state[0])
+
+    def update(self, device_idx, block):
+        """Вызывается из callback потока"""
+        rows, levels = self._state
+        row = rows.get(device_idx)
+        if row is None or not len(block):
+            return
+        scale = 1.0 / -np.iinfo(block.dtype).min if block.dtype.kind == 'i' else 1.0
+        peak = max(float(block.max()), -float(block.min())) * scale
+        rms = float(np.sqrt(np.mean(np.square(block, dtype=np.float32)))) * scale
+        if peak > levels[row, 0]:
+            levels[row, 0] = peak
+        if rms > levels[row, 1]:
+            levels[row, 1] = rms
+
+    def read(self):
+        """Возвращает {устройство: (пик, RMS)} и сбрасывает накопленные максимумы"""
+        rows, levels = self._state
+        snapshot = levels.copy()
+        levels[:] = 0
+        return {device_idx: (float(snapshot[row, 0]), float(snapshot[row, 1]))
+                for device_idx, row in rows.items()}
+
+    @classmethod
+    def to_db(cls, value):
+        return max(cls.FLOOR_DB, 20 * np.log10(max(value, 1e-9)))
+
+
+class StreamMetrics:
+    """Метрики callback-ов входных потоков по устройствам.
+
+    Считает переполнения и опустошения буфера (флаги status), гистограмму
+    длительности callback, размеры блоков, задержку от АЦП до вызова
+    callback (по структуре time) и глубину очереди потока-писателя. Запись
+    из callback - несколько операций со словарём, без блокировок.
+
+    first_sample_ms - время от создания метрик (запуска записи или
+    буферизации) до первого callback устройства: сколько ждёт пользователь,
+    пока звук действительно пошёл.
+    """
+
+    DURATION_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0)
+
+    def __init__(self):
+        self.devices = {}
+        self.started = datetime.now()
+        self.armed = time.perf_counter()
+
+    def add_device(self, device_idx, name):
+        self.devices[device_idx] = {
+            'name': name,
+            'callbacks': 0,
+            'frames': 0,
+            'input_overflows': 0,
+            'input_underflows': 0,
+            'duration_hist': [0] * (len(self.DURATION_BUCKETS_MS) + 1),
+            'duration_ms_total': 0.0,
+            'duration_ms_max': 0.0,
+            'block_sizes': {},
+            'latency_ms_total': 0.0,
+            'latency_ms_max': 0.0,
+            'latency_samples': 0,
+            'queue_depth': 0,
+            'queue_depth_max': 0,
+            'dropped_blocks': 0,
+            'first_sample_ms': None,
+        }
+
+    def record(self, device_idx, frames, time_info, status, started):
+        """Вызывается в конце callback; started - time.perf_counter() в его начале"""
+        stats = self.devices.get(device_idx)
+        if stats is None:
+            return
+        duration_ms = (time.perf_counter() - started) * 1000
+        if not stats['callbacks']:
+            stats['first_sample_ms'] = round((started - self.armed) * 1000, 3)
+        stats['callbacks'] += 1
+        stats['frames'] += frames
+        stats['duration_hist'][bisect_right(self.DURATION_BUCKETS_MS, duration_ms)] += 1
+        stats['duration_ms_total'] += duration_ms
+        if duration_ms > stats['duration_ms_max']:
+            stats['duration_ms_max'] = duration_ms
+        block_sizes = stats['block_sizes']
+        block_sizes[frames] = block_sizes.get(frames, 0) + 1
+        if status:
+            if status.input_overflow:
+                stats['input_overflows'] += 1
+            if status.input_underflow:
+                stats['input_underflows'] += 1
+        if time_info is not None and time_info.currentTime and time_info.inputBufferAdcTime:
+            latency_ms = (time_info.currentTime - time_info.inputBufferAdcTime) * 1000
+            stats['latency_ms_total'] += latency_ms
+            stats['latency_samples'] += 1
+            if latency_ms > stats['latency_ms_max']:
+                stats['latency_ms_max'] = latency_ms
+
+    def record_queue(self, device_idx, depth, dropped_blocks):
+        stats = self.devices.get(device_idx)
+        if stats is None:
+            return
+        stats['queue_depth'] = depth
+        if depth > stats['queue_depth_max']:
+            stats['queue_depth_max'] = depth
+        stats['dropped_blocks'] = dropped_blocks
+
+    def summary(self):
+        """Плоская сводка по устройствам для таблицы и CSV"""
+        rows = []
+        for device_idx, stats in list(self.devices.items()):
+            callbacks = stats['callbacks'] or 1
+            row = {
+                'device': device_idx,
+                'name': stats['name'],
+                'callbacks': stats['callbacks'],
+                'frames': stats['frames'],
+                'input_overflows': stats['input_overflows'],
+                'input_underflows': stats['input_underflows'],
+                'callback_ms_avg': round(stats['duration_ms_total'] / callbacks, 4),
+                'callback_ms_max': round(stats['duration_ms_max'], 4),
+                'block_sizes': " ".join(f"{size}x{count}" for size, count in sorted(stats['block_sizes'].items())),
+                'latency_ms_avg': round(stats['latency_ms_total'] / (stats['latency_samples'] or 1), 3),
+                'latency_ms_max': round(stats['latency_ms_max'], 3),
+                'queue_depth': stats['queue_depth'],
+                'queue_depth_max': stats['queue_depth_max'],
+                'dropped_blocks': stats['dropped_blocks'],
+                'first_sample_ms': stats['first_sample_ms'],
+            }
+            for bound, count in zip(self.DURATION_BUCKETS_MS, stats['duration_hist']):
+                row[f"callback_lt_{bound}ms"] = count
+            row[f"callback_ge_{self.DURATION_BUCKETS_MS[-1]}ms"] = stats['duration_hist'][-1]
+            rows.append(row)
+        return rows
+
+    def first_sample_ms(self):
+        """Через сколько мс после запуска пошёл звук со всех устройств (None - ещё не со всех)"""
+        latencies = [stats['first_sample_ms'] for stats in list(self.devices.values())]
+        if not latencies or None in latencies:
+            return None
+        return max(latencies)
+
+    def export(self, basepath):
+        """Записывает метрики в basepath.json (полностью) и basepath.csv (сводка)"""
+        with open(basepath + ".json", 'w', encoding='utf-8') as f:
+            json.dump({
+                'started': self.started.isoformat(timespec='seconds'),
+                'first_sample_ms': self.first_sample_ms(),
+                'duration_buckets_ms': self.DURATION_BUCKETS_MS,
+                'devices': {str(idx): stats for idx, stats in self.devices.items()},
+            }, f, ensure_ascii=False, indent=2)
+        rows = self.summary()
+        if rows:
+            with open(basepath + ".csv", 'w', encoding='utf-8', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+                writer.writeheader()
+                writer.writerows(rows)
@@ -0,0 +1,188 @@
+"""Обзор волны (.peaks): минимумы и максимумы блоков в нескольких масштабах.
+
+Файл пишет поток-писатель дорожки по мере записи, так что обзор многочасового
+дубля открывается сразу, без повторного чтения звука. Формат (little-endian):
+
+    заголовок HEADER_SIZE байт:
+        b'MTRPEAKS', версия u16, каналы u16, частота u32,
+        кадров в блоке нулевого уровня u32, множитель уровней u16,
+        число уровней u16, всего кадров u64,
+        затем для каждого из MAX_LEVELS уровней: смещение u64, записей u64;
+    записи: для каждого блока по каждому каналу (минимум, максимум) int16
+    в долях полной шкалы.
+
+Нулевой уровень дописывается сразу за заголовком во время записи, более
+грубые (каждый в factor раз) считаются попутно и пишутся вместе с
+заголовком при закрытии. Если процесс упал до закрытия, в заголовке
+нули, и PeakFile берёт нулевой уровень по размеру файла.
+"""
+
+import os
+import struct
+
+import numpy as np
+
+MAGIC = b'MTRPEAKS'
+VERSION = 1
+MAX_LEVELS = 4
+HEADER = struct.Struct('<8sHHIIHHQ')
+LEVEL = struct.Struct('<QQ')
+HEADER_SIZE = HEADER.size + MAX_LEVELS * LEVEL.size
+
+PEAK_BLOCK_FRAMES = 256
+PEAK_LEVEL_FACTOR = 16
+PEAK_LEVELS = 3
+
+
+def peaks_path(path):
+    return os.path.splitext(path)[0] + ".peaks"
+
+
+def _to_int16(values):
+    """Отсчёты формата потока в int16 той же шкалы"""
+    if values.dtype == np.int16:
+        return values
+    if values.dtype.kind == 'i':
+        return (values >> (8 * values.dtype.itemsize - 16)).astype(np.int16)
+    return np.clip(np.round(values * 32767.0), -32768, 32767).astype(np.int16)
+
+
+class PeakWriter:
+    """Пишет .peaks для потока блоков (кадры, каналы) в формате потока"""
+
+    def __init__(self, path, samplerate, channels, block_frames=PEAK_BLOCK_FRAMES,
+                 factor=PEAK_LEVEL_FACTOR, levels=PEAK_LEVELS):
+        if not 1 <= levels <= MAX_LEVELS:
+            raise ValueError(f"Уровней обзора может быть от 1 до {MAX_LEVELS}")
+        self.path = path
+        self.samplerate = samplerate
+        self.channels = channels
+        self.block_frames = block_frames
+        self.factor = factor
+        self.level_count = levels
+        self.frames = 0
+        self.level0_records = 0
+        self.rest = None
+        empty = np.zeros((0, channels, 2), dtype=np.int16)
+        self.pending = [empty] * levels
+        self.coarse = [[] for _ in range(levels)]
+        self.file = open(path, 'wb')
+        self.file.write(self._header([]))
+
+    def add(self, block):
+        self.frames += len(block)
+        data = block if self.rest is None or not len(self.rest) else np.concatenate([self.rest, block])
+        whole = len(data) // self.block_frames * self.block_frames
+        if whole:
+            records = self._reduce(data[:whole].reshape(-1, self.block_frames, self.channels))
+            self.file.write(records.tobytes())
+            self.level0_records += len(records)
+            self._cascade(1, records)
+        self.rest = data[whole:].copy()
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        """Дописывает неполные блоки, грубые уровни и заголовок"""
+        records = np.zeros((0, self.channels, 2), dtype=np.int16)
+        if self.rest is not None and len(self.rest):
+            records = self._reduce(self.rest[None])
+            self.file.write(records.tobytes())
+            self.level0_records += len(records)
+        self._cascade(1, records, final=True)
+
+        table = [(HEADER_SIZE, self.level0_records)]
+        offset = HEADER_SIZE + self.level0_records * self.channels * 4
+        for level in range(1, self.level_count):
+            data = np.concatenate(self.coarse[level]) if self.coarse[level] else records[:0]
+            self.file.write(data.tobytes())
+            table.append((offset, len(data)))
+            offset += data.nbytes
+        self.file.seek(0)
+        self.file.write(self._header(table))
+        self.file.close()
+
+    def _reduce(self, blocks):
+        """Блоки (n, кадры, каналы) -> записи (n, каналы, 2) int16"""
+        return np.stack([_to_int16(blocks.min(axis=1)), _to_int16(blocks.max(axis=1))], axis=2)
+
+    def _cascade(self, level, records, final=False):
+        """Сводит записи уровня level - 1 в записи уровня level по factor штук"""
+        if level >= self.level_count:
+            return
+        pending = np.concatenate([self.pending[level], records]) if len(self.pending[level]) else records
+        whole = len(pending) // self.factor * self.factor
+        groups = [pending[:whole].reshape(-1, self.factor, self.channels, 2)] if whole else []
+        if final and whole < len(pending):
+            groups.append(pending[whole:][None])
+            whole = len(pending)
+        coarse = [np.stack([group[..., 0].min(axis=1), group[..., 1].max(axis=1)], axis=2) for group in groups]
+        coarse = np.concatenate(coarse) if coarse else pending[:0]
+        self.pending[level] = pending[whole:].copy()
+        if len(coarse):
+            self.coarse[level].append(coarse)
+        if len(coarse) or final:
+            self._cascade(level + 1, coarse, final)
+
+    def _header(self, table):
+        """Заголовок; пустая table - заготовка на время записи"""
+        frames = self.frames if table else 0
+        table = list(table) + [(0, 0)] * (MAX_LEVELS - len(table))
+        return HEADER.pack(MAGIC, VERSION, self.channels, self.samplerate, self.block_frames, self.factor,
+                           self.level_count, frames) \
+            + b''.join(LEVEL.pack(offset, count) for offset, count in table)
+
+
+def write_peaks(path, data, samplerate):
+    """Обзор для уже записанного в память массива (кадры, каналы)"""
+    writer = PeakWriter(peaks_path(path), samplerate, data.shape[1])
+    try:
+        writer.add(data)
+    finally:
+        writer.close()
+
+
+class PeakFile:
+    """Чтение .peaks через memmap: levels[i] - массив (записи, каналы, 2) int16.
+
+    block_frames[i] - сколько кадров звука покрывает запись уровня i.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE or header[:8] != MAGIC:
+            raise ValueError(f"{path}: не файл обзора волны")
+        (_, version, self.channels, self.samplerate, block_frames, factor,
+         level_count, self.frames) = HEADER.unpack_from(header)
+        if version != VERSION:
+            raise ValueError(f"{path}: неизвестная версия обзора {version}")
+        table = [LEVEL.unpack_from(header, HEADER.size + i * LEVEL.size) for i in range(level_count)]
+        record_size = self.channels * 4
+        if not table[0][1]:
+            # Файл не закрыт: есть только нулевой уровень, его длина - по размеру файла
+            count = (os.path.getsize(path) - HEADER_SIZE) // record_size
+            table = [(HEADER_SIZE, count)]
+            self.frames = count * block_frames
+        self.block_frames = [block_frames * factor ** level for level in range(len(table))]
+        self.levels = [np.memmap(path, dtype=np.int16, mode='r', offset=offset, shape=(count, self.channels, 2))
+                       if count else np.zeros((0, self.channels, 2), dtype=np.int16)
+                       for offset, count in table]
+
+    def overview(self, width, start=0, end=None):
+        """Минимумы и максимумы (width, каналы, 2) в долях полной шкалы для кадров [start, end)"""
+        end = self.frames if end is None else min(end, self.frames)
+        frames_per_column = max((end - start) / max(width, 1), 1)
+        # Самый грубый уровень, у которого на столбец приходится хотя бы одна запись
+        level = max(i for i, size in enumerate(self.block_frames) if size <= frames_per_column or i == 0)
+        records = self.levels[level]
+        size = self.block_frames[level]
+        first, last = start // size, min(-(-end // size), len(records))
+        if last <= first:
+            return np.zeros((0, self.channels, 2), dtype=np.float32)
+        bounds = np.unique(np.linspace(first, last, width + 1).astype(np.int64)[:-1])
+        data = np.asarray(records[first:last])
+        result = np.stack([np.minimum.reduceat(data[..., 0], bounds - first, axis=0),
+                           np.maximum.reduceat(data[..., 1], bounds - first, axis=0)], axis=2)
+        return result.astype(np.float32) / 32768.0
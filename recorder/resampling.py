@@ -0,0 +1,208 @@
+"""Передискретизация дорожек в общую частоту сессии.
+
+Устройства захватываются на своих родных частотах, а в файлы дубля идут
+на частоте сессии. Переводит их PolyphaseResampler - многофазный фильтр
+(окно Кайзера), который считает сразу блок выходных отсчётов одной
+векторной операцией. Работает он не в callback, а в ResamplingStage -
+своём потоке на каждое устройство между callback и писателем.
+"""
+
+import math
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class PolyphaseResampler:
+    """Потоковая передискретизация samplerate_in -> samplerate_out.
+
+    Отношение частот сокращается до up/down; выходной отсчёт n лежит во
+    входной шкале в точке n * down / up, и для каждой дробной части
+    (фазы) заранее посчитана строка фильтра из taps коэффициентов
+    (при понижении частоты - пропорционально больше). Фильтр центрирован,
+    так что задержки нет: после flush выходных кадров ceil(вход * up / down),
+    и нулевой отсчёт выхода совпадает с нулевым входа. Если фаз больше
+    MAX_PHASES (нестандартные частоты), фаза округляется до ближайшей из
+    MAX_PHASES. Выход - float32 в долях полной шкалы.
+    """
+
+    MAX_PHASES = 4096
+    CHUNK_FRAMES = 4096   # сколько выходных кадров считается за один проход
+
+    def __init__(self, samplerate_in, samplerate_out, channels, taps=48, beta=8.0, rolloff=0.95):
+        samplerate_in, samplerate_out = int(samplerate_in), int(samplerate_out)
+        if samplerate_in <= 0 or samplerate_out <= 0:
+            raise ValueError("Частота дискретизации должна быть больше нуля")
+        common = math.gcd(samplerate_in, samplerate_out)
+        self.up = samplerate_out // common
+        self.down = samplerate_in // common
+        self.samplerate_in = samplerate_in
+        self.samplerate_out = samplerate_out
+        self.channels = channels
+
+        # Срез - по Найквисту меньшей из частот, в долях Найквиста входа
+        ratio = min(1.0, self.up / self.down)
+        cutoff = ratio * rolloff
+        self.half = int(math.ceil(taps / 2 / ratio))
+        self.offsets = np.arange(-self.half + 1, self.half + 1)
+        phases = min(self.up, self.MAX_PHASES)
+        tau = (np.arange(phases) / phases)[:, None] - self.offsets[None, :]
+        window = np.i0(beta * np.sqrt(np.clip(1 - (tau / self.half) ** 2, 0, None))) / np.i0(beta)
+        kernel = cutoff * np.sinc(cutoff * tau) * window
+        self.table = (kernel / kernel.sum(axis=1, keepdims=True)).astype(np.float32)
+        self.phases = phases
+
+        # buffer[0] - входной кадр с номером buffer_start; до нуля - тишина
+        self.buffer_start = -(self.half - 1)
+        self.buffer = np.zeros((self.half - 1, channels), dtype=np.float32)
+        self.frames_in = 0
+        self.frames_out = 0
+
+    @property
+    def taps(self):
+        return len(self.offsets)
+
+    def _to_float(self, block):
+        if block.dtype.kind == 'i':
+            return block.astype(np.float32) * (1.0 / -np.iinfo(block.dtype).min)
+        return block.astype(np.float32, copy=False)
+
+    def process(self, block):
+        """Принимает блок (кадры, каналы), возвращает готовые выходные кадры"""
+        self.frames_in += len(block)
+        self.buffer = np.concatenate([self.buffer, self._to_float(block)])
+        return self._produce()
+
+    def flush(self):
+        """Дописывает хвост фильтра в конце потока"""
+        self.buffer = np.concatenate([self.buffer, np.zeros((self.half, self.channels), dtype=np.float32)])
+        return self._produce()
+
+    def _produce(self):
+        # Отсчёту n нужны входные кадры до base + half включительно
+        last_input = self.buffer_start + len(self.buffer) - 1 - self.half
+        end = -(-(last_input + 1) * self.up // self.down)
+        end = min(end, -(-self.frames_in * self.up // self.down))
+        if end <= self.frames_out:
+            return np.zeros((0, self.channels), dtype=np.float32)
+
+        windows = sliding_window_view(self.buffer, len(self.offsets), axis=0)
+        parts = []
+        for start in range(self.frames_out, end, self.CHUNK_FRAMES):
+            n = np.arange(start, min(start + self.CHUNK_FRAMES, end), dtype=np.int64)
+            position = n * self.down
+            base = position // self.up
+            phase = (position % self.up) * self.phases // self.up
+            # windows[i] начинается с входного кадра buffer_start + i
+            frames = windows[base + self.offsets[0] - self.buffer_start]
+            parts.append(np.einsum('nct,nt->nc', frames, self.table[phase]))
+        self.frames_out = end
+
+        # Следующему отсчёту нужны кадры начиная с его base + offsets[0]
+        keep_from = (end * self.down) // self.up + self.offsets[0]
+        drop = keep_from - self.buffer_start
+        if drop > 0:
+            self.buffer = self.buffer[drop:].copy()
+            self.buffer_start += drop
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+def measure_resampler_throughput(samplerate_in, samplerate_out, channels=1, seconds=5.0, blocksize=1024):
+    """Передискретизирует seconds секунд шума блоками так же, как ResamplingStage.
+
+    Возвращает словарь: realtime - во сколько раз быстрее реального
+    времени, cpu_per_channel - доля одного ядра на канал (время
+    процессора потока на секунду звука одного канала).
+    """
+    frames = int(samplerate_in * seconds)
+    noise = (np.random.default_rng(0).standard_normal((frames, channels)) * 0.1).astype(np.float32)
+    resampler = PolyphaseResampler(samplerate_in, samplerate_out, channels)
+    started = time.perf_counter()
+    cpu_started = time.thread_time()
+    for start in range(0, frames, blocksize):
+        resampler.process(noise[start:start + blocksize])
+    resampler.flush()
+    cpu = time.thread_time() - cpu_started
+    elapsed = time.perf_counter() - started
+    return {
+        'realtime': seconds / elapsed if elapsed > 0 else float('inf'),
+        'cpu_per_channel': cpu / (seconds * channels),
+        'taps': resampler.taps,
+    }
+
+
+class ResamplingStage:
+    """Передискретизация одного устройства в своём потоке.
+
+    Для callback повторяет интерфейс StreamingTrackWriter (push, queue,
+    dropped_blocks): блок только копируется в ограниченную очередь, а
+    поток стадии переводит его в частоту сессии и передаёт в target.push.
+    target - писатель дорожки или вход AggregateTrackWriter. close
+    дописывает хвост фильтра и закрывает target, если у него есть close
+    (общий файл закрывается отдельно, после всех своих стадий).
+    """
+
+    def __init__(self, target, resampler, max_blocks=1024):
+        self.target = target
+        self.resampler = resampler
+        self.samplerate = resampler.samplerate_out
+        self.max_blocks = max_blocks
+        self.queue = deque()
+        self.error = None
+        self._dropped_blocks = 0
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def files(self):
+        return self.target.files
+
+    @property
+    def frames_written(self):
+        return self.target.frames_written
+
+    @property
+    def checksums(self):
+        return self.target.checksums
+
+    @property
+    def dropped_blocks(self):
+        return self._dropped_blocks + self.target.dropped_blocks
+
+    def push(self, block):
+        """Вызывается из callback потока: копирует блок в очередь"""
+        if len(self.queue) >= self.max_blocks:
+            self._dropped_blocks += 1
+            return
+        self.queue.append(block.copy())
+
+    def _run(self):
+        try:
+            while True:
+                try:
+                    block = self.queue.popleft()
+                except IndexError:
+                    if self._closing.is_set():
+                        break
+                    self._closing.wait(0.01)
+                    continue
+                out = self.resampler.process(block)
+                if len(out):
+                    self.target.push(out)
+            tail = self.resampler.flush()
+            if len(tail):
+                self.target.push(tail)
+        except Exception as e:
+            self.error = e
+
+    def close(self):
+        """Переводит оставшиеся блоки и закрывает target"""
+        self._closing.set()
+        self._thread.join()
+        if hasattr(self.target, 'close'):
+            self.target.close()
+            self.error = self.error or self.target.error
@@ -0,0 +1,209 @@
+"""Запись по уровню сигнала с предзаписью"""
+
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from .buffers import RingBuffer
+from .metering import StreamMetrics
+from .writers import StreamingTrackWriter, resolve_output_format, safe_filename
+
+
+def block_rms(chunk, block_frames):
+    """RMS каждого блока по каждому каналу в долях полной шкалы.
+
+    Все блоки и каналы считаются одной векторной редукцией: массив
+    (кадры, каналы) раскладывается в (блоки, кадры блока, каналы).
+    Возвращает массив (блоки, каналы); хвост короче блока не учитывается.
+    """
+    blocks = len(chunk) // block_frames
+    if not blocks:
+        return np.zeros((0, chunk.shape[1]), dtype=np.float32)
+    data = chunk[:blocks * block_frames].reshape(blocks, block_frames, chunk.shape[1])
+    data = data.astype(np.float32)
+    if chunk.dtype.kind == 'i':
+        data *= 1.0 / -np.iinfo(chunk.dtype).min
+    energy = np.einsum('ijk,ijk->ik', data, data) / block_frames
+    return np.sqrt(energy)
+
+
+class TriggeredRecorder:
+    """Дубли, которые начинаются сами, когда сигнал превышает порог.
+
+    Callback каждого устройства только пишет блоки в короткий кольцевой
+    буфер (и в индикаторы уровня). Отдельный поток раз в POLL_INTERVAL
+    забирает новые кадры всех устройств, считает RMS по блокам
+    BLOCK_SECONDS векторно и сравнивает максимум с порогом. Когда порог
+    превышен на любом устройстве, начинается дубль: в файлы уходят
+    pre_roll_seconds секунд из буфера и дальше всё новое. Дубль
+    заканчивается, когда сигнал держится ниже порога hold_seconds секунд.
+    Файлы пишут потоки-писатели, закрываются они через save_jobs движка.
+    """
+
+    BLOCK_SECONDS = 0.01
+    POLL_INTERVAL = 0.02
+    # Запас буфера сверх предзаписи на случай, если поток детектора отстанет
+    LAG_SECONDS = 5.0
+
+    def __init__(self, engine, device_ids, formats=None, threshold_db=-40.0,
+                 hold_seconds=2.0, pre_roll_seconds=2.0):
+        self.engine = engine
+        self.device_ids = list(device_ids)
+        self.formats = dict(formats or {})
+        self.threshold = 10 ** (threshold_db / 20)
+        self.threshold_db = threshold_db
+        self.hold_seconds = hold_seconds
+        self.pre_roll_seconds = pre_roll_seconds
+        self.rings = {}
+        self.streams = []
+        self.pool = None
+        self.metrics = StreamMetrics()
+        self.writers = None
+        self.take_timestamp = None
+        self.take_started = None
+        self.takes = 0
+        self.last_loud = 0.0
+        self.lost_frames = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def recording(self):
+        return self.writers is not None
+
+    def start(self):
+        """Открывает потоки устройств и запускает детектор"""
+        engine = self.engine
+        try:
+            self.pool = engine.capture_pool(self.device_ids)
+            with engine.registry.lock:
+                for device_idx in self.device_ids:
+                    fmt = self.formats.get(device_idx) or engine.registry.probe(device_idx, engine.sample_format)
+                    self.formats[device_idx] = fmt
+                    capacity = int(fmt['samplerate'] * (self.pre_roll_seconds + self.LAG_SECONDS))
+                    self.rings[device_idx] = RingBuffer(capacity, fmt['channels'], fmt['dtype'])
+                    self.metrics.add_device(device_idx, fmt['name'])
+
+                    stream = engine.open_input_stream(
+                        self.pool, device_idx, fmt,
+                        lambda indata, frames, time, status, idx=device_idx: self.callback(indata, frames, time, status, idx))
+                    self.streams.append(stream)
+                    stream.start()
+        except Exception:
+            self._close_streams()
+            raise
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Закрывает потоки; незаконченный дубль сохраняется"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._close_streams()
+
+    def _close_streams(self):
+        with self.engine.registry.lock:
+            for stream in self.streams:
+                try:
+                    stream.stop()
+                    stream.close()
+                except:
+                    pass
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+        self.streams = []
+
+    def callback(self, indata, frames, time_info, status, device_idx):
+        started = time.perf_counter()
+        self.rings[device_idx].write(indata)
+        self.engine.meters.update(device_idx, indata)
+        self.metrics.record(device_idx, frames, time_info, status, started)
+
+    def _read_new(self, device_idx, cursor):
+        """Новые целые блоки устройства начиная с cursor: (копия, число кадров)"""
+        ring = self.rings[device_idx]
+        block_frames = max(1, int(self.formats[device_idx]['samplerate'] * self.BLOCK_SECONDS))
+        frames = (ring.frames_written - cursor) // block_frames * block_frames
+        if frames <= 0:
+            return None, block_frames
+        chunks = []
+        for chunk, lost in ring.iter_window(cursor, frames):
+            chunks.append(chunk)
+            self.lost_frames[device_idx] = self.lost_frames.get(device_idx, 0) + lost
+        return (chunks[0] if len(chunks) == 1 else np.concatenate(chunks)), block_frames
+
+    def _run(self):
+        cursors = {device_idx: 0 for device_idx in self.rings}
+        try:
+            while not self._stopped.wait(self.POLL_INTERVAL):
+                pending = {}
+                loud = False
+                for device_idx, cursor in cursors.items():
+                    chunk, block_frames = self._read_new(device_idx, cursor)
+                    if chunk is None:
+                        continue
+                    pending[device_idx] = (cursor, chunk)
+                    cursors[device_idx] = cursor + len(chunk)
+                    if not loud and block_rms(chunk, block_frames).max(initial=0.0) >= self.threshold:
+                        loud = True
+
+                now = time.monotonic()
+                if loud:
+                    self.last_loud = now
+                    if not self.recording:
+                        self._start_take(pending, cursors)
+                if self.recording:
+                    for device_idx, (cursor, chunk) in pending.items():
+                        self.writers[device_idx].push(chunk)
+                    if now - self.last_loud >= self.hold_seconds:
+                        self._finish_take()
+        except Exception as e:
+            self.engine.report_error("Ошибка записи по сигналу", str(e))
+        finally:
+            if self.recording:
+                self._finish_take()
+
+    def _start_take(self, pending, cursors):
+        """Открывает файлы дубля и пишет в них предзапись из буфера"""
+        engine = self.engine
+        now = datetime.now()
+        timestamp = now.strftime("%Y%m%d_%H%M%S")
+        # Дубли, начатые в одну секунду, не должны писать в одни файлы
+        if self.take_timestamp and self.take_timestamp.startswith(timestamp):
+            timestamp = f"{timestamp}_{self.takes + 1}"
+        self.take_timestamp = timestamp
+        self.take_started = now.isoformat(timespec='milliseconds')
+        self.lost_frames = {}
+        writers = {}
+        for device_idx, fmt in self.formats.items():
+            file_fmt = engine.session_format(fmt)
+            file_format, subtype, extension = resolve_output_format(engine.output_format, file_fmt)
+            filename = f"recording_{safe_filename(fmt['name'])}_{self.take_timestamp}.{extension}"
+            writer = StreamingTrackWriter(os.path.join(engine.output_dir, filename), file_fmt['samplerate'],
+                                          fmt['channels'], dtype=file_fmt['dtype'], subtype=subtype,
+                                          file_format=file_format, peaks=engine.write_peaks)
+            writer = engine.resampling_stage(writer, fmt, file_fmt)
+            # Предзапись - до начала кадров, прочитанных в этом опросе
+            ring = self.rings[device_idx]
+            start = pending[device_idx][0] if device_idx in pending else cursors[device_idx]
+            pre_roll_start = max(start - int(self.pre_roll_seconds * fmt['samplerate']),
+                                 ring.frames_written - len(ring), 0)
+            for chunk, lost in ring.iter_window(pre_roll_start, start - pre_roll_start):
+                writer.push(chunk)
+                self.lost_frames[device_idx] = self.lost_frames.get(device_idx, 0) + lost
+            writers[device_idx] = writer
+        self.writers = writers
+        self.takes += 1
+
+    def _finish_take(self):
+        writers, self.writers = self.writers, None
+        self.engine.finish_streaming(
+            self.take_timestamp, None, self.formats, writers,
+            trigger={'triggered_at': self.take_started, 'threshold_db': self.threshold_db,
+                     'hold_seconds': self.hold_seconds, 'pre_roll_seconds': self.pre_roll_seconds,
+                     'lost_frames': {str(idx): lost for idx, lost in self.lost_frames.items() if lost}})
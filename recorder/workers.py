@@ -0,0 +1,392 @@
+"""Захват в отдельных процессах, чтобы callback-и не делили GIL с остальным.
+
+Устройства раскладываются по рабочим процессам CapturePool (по кругу).
+Рабочий процесс открывает потоки PortAudio своих устройств, и его callback
+только копирует блок в SharedRingBuffer - кольцо в разделяемой памяти - и
+дописывает запись о блоке: кадры, флаги status, время АЦП и время вызова.
+Ни Tk, ни hook клавиатуры, ни писатели в этом процессе не работают, так
+что callback не ждёт GIL.
+
+В главном процессе поток-насос раз в POLL_INTERVAL забирает новые блоки
+всех колец и вызывает для них обычные callback-и движка с представлениями
+кольца (без копирования): индикаторы, буфер повтора, писатели и
+выравнивание работают как с потоками в своём процессе. RemoteInputStream
+повторяет интерфейс sd.InputStream (start, stop, close); stop дожидается,
+пока насос передаст последние блоки. Если насос отстанет на всё кольцо
+(RING_SECONDS), пропущенные блоки отмечаются как переполнение входа.
+
+Время вызова callback в рабочем процессе передаётся в time_info.host_time
+(часы time.perf_counter общие для процессов), по нему TakeAligner считает
+старт дорожки. Длительность callback в метриках - время обработки блока
+в главном процессе.
+"""
+
+import multiprocessing
+import signal
+import threading
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .buffers import RingBuffer
+from .lazy import LazyModule
+
+sd = LazyModule('sounddevice')
+
+# Флаги status в записи о блоке - как у PortAudio
+INPUT_UNDERFLOW = 0x1
+INPUT_OVERFLOW = 0x2
+
+BlockTime = namedtuple('BlockTime', 'inputBufferAdcTime currentTime outputBufferDacTime host_time')
+
+
+class BlockStatus:
+    """Флаги блока для callback движка, как у sounddevice.CallbackFlags"""
+
+    def __init__(self, flags=0):
+        self.flags = int(flags)
+
+    @property
+    def input_underflow(self):
+        return bool(self.flags & INPUT_UNDERFLOW)
+
+    @property
+    def input_overflow(self):
+        return bool(self.flags & INPUT_OVERFLOW)
+
+    def __bool__(self):
+        return bool(self.flags)
+
+
+class SharedRingBuffer(RingBuffer):
+    """RingBuffer в разделяемой памяти с журналом последних BLOCKS блоков.
+
+    Пишет callback рабочего процесса (push), читает насос главного.
+    Счётчики кольца лежат в той же памяти; blocks_written увеличивается
+    последним, когда кадры и запись о блоке уже на месте. Память создаёт
+    главный процесс (name=None) и удаляет её в unlink, рабочий
+    подключается по spec.
+    """
+
+    BLOCKS = 4096
+    COUNTERS = 4   # frames_written, max_block, blocks_written, резерв
+
+    def __init__(self, capacity, channels, dtype='float32', name=None):
+        capacity = int(capacity)
+        itemsize = np.dtype(dtype).itemsize
+        journal = self.BLOCKS * 3 * 8
+        self._data_offset = self.COUNTERS * 8 + 2 * journal
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True,
+                                                  size=self._data_offset + capacity * channels * itemsize)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.counters = np.ndarray((self.COUNTERS,), np.int64, self.shm.buf)
+        # Запись о блоке: (первый кадр, кадров, флаги) и (время АЦП, текущее время потока, время вызова)
+        self.block_index = np.ndarray((self.BLOCKS, 3), np.int64, self.shm.buf, self.COUNTERS * 8)
+        self.block_times = np.ndarray((self.BLOCKS, 3), np.float64, self.shm.buf, self.COUNTERS * 8 + journal)
+        super().__init__(capacity, channels, dtype)
+
+    def _allocate(self, dtype):
+        return np.ndarray((self.capacity, self.channels), dtype, self.shm.buf, self._data_offset)
+
+    @property
+    def spec(self):
+        """Аргументы, по которым рабочий процесс подключается к кольцу"""
+        return self.capacity, self.channels, self.data.dtype.str, self.shm.name
+
+    @property
+    def frames_written(self):
+        return int(self.counters[0])
+
+    @frames_written.setter
+    def frames_written(self, value):
+        self.counters[0] = value
+
+    @property
+    def max_block(self):
+        return int(self.counters[1])
+
+    @max_block.setter
+    def max_block(self, value):
+        self.counters[1] = value
+
+    @property
+    def blocks_written(self):
+        return int(self.counters[2])
+
+    def push(self, block, time_info, status, host_time):
+        """Вызывается из callback рабочего процесса"""
+        start = self.frames_written
+        self.write(block)
+        slot = self.blocks_written % self.BLOCKS
+        flags = 0
+        if status:
+            flags = ((INPUT_UNDERFLOW if status.input_underflow else 0)
+                     | (INPUT_OVERFLOW if status.input_overflow else 0))
+        self.block_index[slot] = (start, len(block), flags)
+        if time_info is not None:
+            self.block_times[slot] = (time_info.inputBufferAdcTime, time_info.currentTime, host_time)
+        else:
+            self.block_times[slot] = (0.0, 0.0, host_time)
+        self.counters[2] += 1
+
+    def close(self):
+        """Отключается от памяти (сама память остаётся до unlink)"""
+        self.data = self.counters = self.block_index = self.block_times = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # Кто-то ещё держит представление кольца - память освободится вместе с ним
+            pass
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def _worker_main(connection):
+    """Тело рабочего процесса: открывает потоки устройств по командам главного"""
+    streams = {}
+    rings = {}
+
+    def callback(indata, frames, time_info, status, device_idx):
+        host_time = time.perf_counter()
+        rings[device_idx].push(indata, time_info, status, host_time)
+
+    # Ctrl+C и SIGTERM получает вся группа процессов: останавливает захват главный
+    # процесс, а если он погибнет, канал закроется и рабочий выйдет сам
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    try:
+        while True:
+            try:
+                command, device_idx, args = connection.recv()
+            except EOFError:
+                break
+            if command == 'exit':
+                break
+            try:
+                if command == 'open':
+                    fmt, spec = args
+                    name = sd.query_devices(device_idx)['name']
+                    if name != fmt['name']:
+                        raise RuntimeError(f"Устройство {device_idx} в процессе захвата - другое ({name}), "
+                                           "обновите список устройств")
+                    rings[device_idx] = SharedRingBuffer(*spec[:3], name=spec[3])
+                    streams[device_idx] = sd.InputStream(
+                        device=device_idx,
+                        channels=fmt['channels'],
+                        samplerate=fmt['samplerate'],
+                        callback=lambda indata, frames, time, status, idx=device_idx: callback(indata, frames, time, status, idx),
+                        dtype=fmt['dtype']
+                    )
+                elif command == 'start':
+                    streams[device_idx].start()
+                elif command == 'stop':
+                    streams[device_idx].stop()
+                elif command == 'close':
+                    streams.pop(device_idx).close()
+                    rings.pop(device_idx).close()
+                connection.send((True, None))
+            except Exception as e:
+                connection.send((False, str(e)))
+    finally:
+        for stream in streams.values():
+            try:
+                stream.stop()
+                stream.close()
+            except:
+                pass
+        for ring in rings.values():
+            ring.close()
+
+
+class CaptureWorker:
+    """Рабочий процесс захвата и канал команд к нему"""
+
+    def __init__(self):
+        # spawn везде: форк процесса с запущенными потоками и PortAudio небезопасен
+        context = multiprocessing.get_context('spawn')
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child,), daemon=True,
+                                       name="recorder-capture")
+        self.process.start()
+        child.close()
+        self.lock = threading.Lock()
+        self.failure_reported = False
+
+    def call(self, command, device_idx=None, args=None):
+        with self.lock:
+            try:
+                self.connection.send((command, device_idx, args))
+                ok, message = self.connection.recv()
+            except (EOFError, OSError):
+                raise RuntimeError(f"Процесс захвата завершился (код {self.process.exitcode})")
+        if not ok:
+            raise RuntimeError(message)
+
+    def exit(self):
+        try:
+            with self.lock:
+                self.connection.send(('exit', None, None))
+        except OSError:
+            pass
+        self.process.join(2.0)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.connection.close()
+
+
+class RemoteInputStream:
+    """Поток устройства в рабочем процессе с интерфейсом sd.InputStream"""
+
+    def __init__(self, pool, worker, device_idx, callback, ring):
+        self.pool = pool
+        self.worker = worker
+        self.device_idx = device_idx
+        self.callback = callback
+        self.ring = ring
+        self.active = False
+        self.blocks_read = 0
+        self.lost_blocks = 0
+        self._pending_flags = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.worker.call('start', self.device_idx)
+        self.active = True
+
+    def stop(self):
+        """Останавливает поток и передаёт callback-у всё, что он успел записать"""
+        if not self.active:
+            return
+        self.worker.call('stop', self.device_idx)
+        with self.lock:
+            self.deliver()
+            self.active = False
+
+    def close(self):
+        self.stop()
+        try:
+            self.worker.call('close', self.device_idx)
+        finally:
+            self.pool.release(self)
+
+    def deliver(self):
+        """Вызывает callback для новых блоков кольца; вызывается под lock"""
+        ring = self.ring
+        written = ring.blocks_written
+        if written - self.blocks_read > ring.BLOCKS:
+            # Записи о блоках уже перезаписаны: насос отстал больше чем на журнал
+            self.lost_blocks += written - ring.BLOCKS - self.blocks_read
+            self._pending_flags |= INPUT_OVERFLOW
+            self.blocks_read = written - ring.BLOCKS
+        while self.blocks_read < written:
+            slot = self.blocks_read % ring.BLOCKS
+            start, frames, flags = (int(value) for value in ring.block_index[slot])
+            adc_time, current_time, host_time = (float(value) for value in ring.block_times[slot])
+            self.blocks_read += 1
+            if ring.overwritten(start):
+                self.lost_blocks += 1
+                self._pending_flags |= INPUT_OVERFLOW
+                continue
+            views = ring.views(start, frames)
+            block = views[0] if len(views) == 1 else np.concatenate(views)
+            status = BlockStatus(flags | self._pending_flags)
+            self._pending_flags = 0
+            self.callback(block, frames, BlockTime(adc_time, current_time, 0.0, host_time), status)
+
+
+class CapturePool:
+    """Рабочие процессы захвата на один сеанс записи, буфера или ожидания сигнала.
+
+    open(устройство, параметры probe_device, callback) раскладывает
+    устройства по processes процессам. Процессы запускаются сразу все
+    (параллельно, чтобы потоки открывались без пауз на запуск Python) и
+    завершаются в close. Ошибки callback-ов и падения процессов
+    передаются в on_error(заголовок, текст).
+    """
+
+    POLL_INTERVAL = 0.005
+    RING_SECONDS = 4.0
+
+    def __init__(self, processes, on_error=None):
+        if processes <= 0:
+            raise ValueError("Процессов захвата должно быть больше нуля")
+        self.processes = processes
+        self.on_error = on_error
+        self.workers = [CaptureWorker() for _ in range(processes)]
+        self.streams = []
+        self.opened = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def open(self, device_idx, fmt, callback):
+        worker = self.workers[self.opened % self.processes]
+        ring = SharedRingBuffer(int(fmt['samplerate'] * self.RING_SECONDS), fmt['channels'], fmt['dtype'])
+        try:
+            worker.call('open', device_idx, (dict(fmt), ring.spec))
+        except Exception:
+            ring.close()
+            ring.unlink()
+            raise
+        stream = RemoteInputStream(self, worker, device_idx, callback, ring)
+        with self._lock:
+            self.streams.append(stream)
+        self.opened += 1
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return stream
+
+    def release(self, stream):
+        with self._lock:
+            if stream in self.streams:
+                self.streams.remove(stream)
+        stream.ring.close()
+        stream.ring.unlink()
+
+    def _run(self):
+        while not self._stopped.wait(self.POLL_INTERVAL):
+            with self._lock:
+                streams = list(self.streams)
+            for stream in streams:
+                if not stream.active:
+                    continue
+                try:
+                    with stream.lock:
+                        if stream.active:
+                            stream.deliver()
+                except Exception as e:
+                    stream.active = False
+                    self._report("Ошибка обработки блока", f"Устройство {stream.device_idx}: {e}")
+            for worker in self.workers:
+                if not worker.process.is_alive() and not worker.failure_reported:
+                    worker.failure_reported = True
+                    self._report("Ошибка захвата",
+                                 f"Процесс захвата завершился (код {worker.process.exitcode})")
+
+    def _report(self, title, message):
+        if self.on_error is not None:
+            self.on_error(title, message)
+        else:
+            print(f"{title}: {message}")
+
+    def close(self):
+        """Закрывает оставшиеся потоки и завершает рабочие процессы"""
+        for stream in list(self.streams):
+            try:
+                stream.close()
+            except Exception:
+                self.release(stream)
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        for worker in self.workers:
+            worker.failure_reported = True
+            worker.exit()
+        self.workers = []
@@ -0,0 +1,572 @@
+"""Форматы файлов и потоковая запись дорожек на диск"""
+
+import io
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from .lazy import LazyModule
+from .manifest import ChecksumFile
+from .peaks import PeakWriter, peaks_path
+
+sf = LazyModule('soundfile')
+
+
+# Форматы файлов: формат libsndfile, subtype (None - по формату сэмплов), расширение
+OUTPUT_FORMATS = {
+    'WAV': ('WAV', None, 'wav'),
+    'WAV PCM_16': ('WAV', 'PCM_16', 'wav'),
+    'WAV PCM_24': ('WAV', 'PCM_24', 'wav'),
+    'RF64': ('RF64', None, 'wav'),
+    'W64': ('W64', None, 'w64'),
+    'FLAC': ('FLAC', None, 'flac'),
+    'Ogg Vorbis': ('OGG', 'VORBIS', 'ogg'),
+    'Ogg Opus': ('OGG', 'OPUS', 'opus'),
+}
+
+OPUS_SAMPLERATES = (8000, 12000, 16000, 24000, 48000)
+
+# Несжатые контейнеры и байты на сэмпл в них: размер такого файла известен до записи
+PCM_CONTAINERS = ('WAV', 'RF64', 'W64')
+PCM_SAMPLE_BYTES = {'PCM_S8': 1, 'PCM_U8': 1, 'PCM_16': 2, 'PCM_24': 3, 'PCM_32': 4, 'FLOAT': 4, 'DOUBLE': 8}
+FLAC_MAX_CHANNELS = 8
+
+
+def safe_filename(name):
+    """Имя устройства, пригодное для имени файла"""
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+def resolve_output_format(output_format, fmt):
+    """Возвращает (format, subtype, расширение) файла для устройства с параметрами fmt"""
+    file_format, subtype, extension = OUTPUT_FORMATS[output_format]
+    if subtype is None:
+        subtype = fmt['subtype']
+        # FLAC хранит только целые сэмплы
+        if file_format == 'FLAC' and subtype not in ('PCM_16', 'PCM_24'):
+            subtype = 'PCM_24'
+    if subtype == 'OPUS' and fmt['samplerate'] not in OPUS_SAMPLERATES:
+        raise ValueError(f"Opus не поддерживает частоту {fmt['samplerate']} Гц")
+    if file_format == 'FLAC' and fmt['channels'] > FLAC_MAX_CHANNELS:
+        raise ValueError(f"FLAC не поддерживает больше {FLAC_MAX_CHANNELS} каналов")
+    return file_format, subtype, extension
+
+
+def measure_encoder_throughput(output_format, fmt, seconds=5.0, blocksize=4096):
+    """Кодирует seconds секунд шума в памяти так же, как поток-писатель.
+
+    Возвращает словарь: realtime - во сколько раз кодирование быстрее
+    реального времени, bytes_per_second - размер потока на диске.
+    """
+    file_format, subtype, _ = resolve_output_format(output_format, fmt)
+    frames = int(fmt['samplerate'] * seconds)
+    noise = np.random.default_rng(0).standard_normal((frames, fmt['channels'])) * 0.1
+    if np.issubdtype(np.dtype(fmt['dtype']), np.integer):
+        noise = (noise * np.iinfo(fmt['dtype']).max).astype(fmt['dtype'])
+    else:
+        noise = noise.astype(fmt['dtype'])
+
+    buffer = io.BytesIO()
+    started = time.perf_counter()
+    with sf.SoundFile(buffer, 'w', fmt['samplerate'], fmt['channels'],
+                      subtype=subtype, format=file_format) as f:
+        for start in range(0, frames, blocksize):
+            f.write(noise[start:start + blocksize])
+    elapsed = time.perf_counter() - started
+    return {
+        'realtime': seconds / elapsed if elapsed > 0 else float('inf'),
+        'bytes_per_second': len(buffer.getvalue()) / seconds,
+    }
+
+
+class StreamingTrackWriter:
+    """Потоковая запись одной дорожки на диск.
+
+    Callback кладёт блоки в ограниченную очередь без блокировок (append и
+    popleft у deque атомарны), а отдельный поток-писатель сбрасывает их в
+    открытый SoundFile. При переполнении очереди блок отбрасывается и
+    учитывается в dropped_blocks - callback никогда не ждёт диск.
+
+    start_offset - необязательная функция, возвращающая число кадров тишины
+    перед началом дорожки (или None, пока оно неизвестно); до её ответа
+    блоки копятся в очереди. При peaks тот же поток пишет рядом с каждым
+    файлом обзор волны (recorder.peaks). Байты файлов хэшируются по ходу
+    записи: после close в checksums для каждого файла лежит
+    (смещение, sha256) или None (см. recorder.manifest).
+    """
+
+    def __init__(self, filepath, samplerate, channels, max_blocks=1024, start_offset=None,
+                 dtype='float32', subtype=None, file_format='WAV', peaks=False):
+        self.filepath = filepath
+        self.files = [filepath]
+        self.samplerate = samplerate
+        self.channels = channels
+        self.dtype = dtype
+        self.subtype = subtype
+        self.file_format = file_format
+        self.max_blocks = max_blocks
+        self.start_offset = start_offset
+        self.peaks = peaks
+        self.queue = deque()
+        self.frames_written = 0
+        self.dropped_blocks = 0
+        self.checksums = {}
+        self.error = None
+        self._closing = threading.Event()
+        self._raw = None
+        self._file = self._open(filepath)
+        self._peaks = self._open_peaks(filepath)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def push(self, block):
+        """Вызывается из callback потока: копирует блок в очередь"""
+        if len(self.queue) >= self.max_blocks:
+            self.dropped_blocks += 1
+            return
+        self.queue.append(block.copy())
+
+    def _write_start_offset(self):
+        offset = self.start_offset()
+        while offset is None and not self._closing.is_set():
+            self._closing.wait(0.01)
+            offset = self.start_offset()
+        if offset is None:
+            offset = self.start_offset(force=True)
+        if offset > 0:
+            self._write(np.zeros((offset, self.channels), dtype=self.dtype))
+
+    def _open(self, filepath):
+        self._raw = ChecksumFile(filepath)
+        try:
+            return sf.SoundFile(self._raw, 'w', self.samplerate, self.channels,
+                                subtype=self.subtype, format=self.file_format)
+        except Exception:
+            self._raw.close()
+            raise
+
+    def _open_peaks(self, filepath):
+        if not self.peaks:
+            return None
+        return PeakWriter(peaks_path(filepath), self.samplerate, self.channels)
+
+    def _write(self, block):
+        self._file.write(block)
+        if self._peaks is not None:
+            self._peaks.add(block)
+        self.frames_written += len(block)
+
+    def _close_peaks(self):
+        peaks, self._peaks = self._peaks, None
+        if peaks is not None:
+            peaks.close()
+
+    def _close_raw(self):
+        """Закрывает файл на диске, возвращает его сумму"""
+        self._file.close()
+        self._raw.close()
+        return self._raw.checksum()
+
+    def _close_file(self):
+        self.checksums[self.filepath] = self._close_raw()
+        self._close_peaks()
+
+    def _run(self):
+        try:
+            if self.start_offset is not None:
+                self._write_start_offset()
+            while True:
+                try:
+                    block = self.queue.popleft()
+                except IndexError:
+                    if self._closing.is_set():
+                        break
+                    self._closing.wait(0.01)
+                    continue
+                self._write(block)
+        except Exception as e:
+            self.error = e
+        finally:
+            try:
+                self._close_file()
+            except Exception as e:
+                self.error = self.error or e
+
+    def close(self):
+        """Дописывает оставшиеся блоки и закрывает файл"""
+        self._closing.set()
+        self._thread.join()
+
+
+def repair_wav_header(filepath, truncate=False):
+    """Прописывает в заголовке WAV размеры по фактической длине файла.
+
+    Размер блока data округляется до целого кадра, при truncate лишний
+    хвост отрезается. Возвращает число кадров или None, если это не WAV.
+    """
+    with open(filepath, 'r+b') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            return None
+        file_size = os.fstat(f.fileno()).st_size
+        block_align = None
+        fact_offset = None
+        offset = 12
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            chunk_id, chunk_size = struct.unpack('<4sI', f.read(8))
+            if chunk_id == b'fmt ':
+                block_align = struct.unpack('<H', f.read(16)[12:14])[0]
+            elif chunk_id == b'fact':
+                fact_offset = offset + 8
+            elif chunk_id == b'data':
+                data_size = min(file_size - offset - 8, 0xFFFFFFFF - offset)
+                if block_align:
+                    data_size -= data_size % block_align
+                end = offset + 8 + data_size
+                f.seek(offset + 4)
+                f.write(struct.pack('<I', data_size))
+                if fact_offset is not None and block_align:
+                    f.seek(fact_offset)
+                    f.write(struct.pack('<I', data_size // block_align))
+                f.seek(4)
+                f.write(struct.pack('<I', end - 8))
+                if truncate and end < file_size:
+                    f.truncate(end)
+                f.flush()
+                os.fsync(f.fileno())
+                return data_size // block_align if block_align else None
+            offset += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+class SegmentedTrackWriter(StreamingTrackWriter):
+    """Запись дорожки сегментами с защитой от сбоев.
+
+    Каждые segment_seconds секунд или segment_bytes байт дорожка
+    переходит в новый файл, так что файлы остаются ограниченными и WAV не
+    упирается в 4 ГБ. Размер сегмента считается на каждой записи: в
+    несжатом файле блок, который перешёл бы предел, делится по кадру, в
+    сжатом (FLAC, Ogg) сегмент закрывается после такого блока. Пока сегмент пишется, к имени добавлен суффикс
+    .partial. Раз в sync_interval секунд поток-писатель обновляет размеры
+    в заголовке WAV и сбрасывает файл на диск, так что после падения
+    процесса сегмент восстанавливает recover_segments.
+
+    filepath_template - путь с полем {part} для номера сегмента.
+    """
+
+    PARTIAL_SUFFIX = '.partial'
+
+    def __init__(self, filepath_template, samplerate, channels, segment_seconds=600,
+                 segment_bytes=1 << 30, sync_interval=2.0, **kwargs):
+        self.filepath_template = filepath_template
+        self.segment_frames = int(segment_seconds * samplerate) if segment_seconds else None
+        self.segment_bytes = segment_bytes
+        self.sync_interval = sync_interval
+        self.segment_index = 1
+        self.segment_frames_written = 0
+        self.segment_size = 0
+        self.current_path = filepath_template.format(part=1)
+        self.last_sync = time.monotonic()
+        super().__init__(self.current_path, samplerate, channels, **kwargs)
+        self.files = []
+
+    def _open(self, filepath):
+        f = super()._open(filepath + self.PARTIAL_SUFFIX)
+        # Байт на кадр; None - сжатый формат, размер известен только после записи
+        sample_bytes = PCM_SAMPLE_BYTES.get(f.subtype) if f.format in PCM_CONTAINERS else None
+        self.frame_bytes = sample_bytes * self.channels if sample_bytes else None
+        self.segment_size = self._raw.tell()
+        return f
+
+    def _write(self, block):
+        while len(block):
+            if self._segment_full():
+                self._roll()
+            room = self._segment_room(len(block))
+            part, block = block[:room], block[room:]
+            self._file.write(part)
+            if self._peaks is not None:
+                self._peaks.add(part)
+            self.frames_written += len(part)
+            self.segment_frames_written += len(part)
+            self.segment_size = self._raw.tell()
+
+        if time.monotonic() - self.last_sync >= self.sync_interval:
+            self._sync()
+
+    def _segment_room(self, frames):
+        """Сколько кадров из блока длиной frames войдёт в текущий сегмент"""
+        room = frames
+        if self.segment_frames:
+            room = min(room, self.segment_frames - self.segment_frames_written)
+        if self.segment_bytes and self.frame_bytes:
+            room = min(room, (self.segment_bytes - self.segment_size) // self.frame_bytes)
+        # Хотя бы кадр: иначе сегмент с заголовком больше предела не сдвинулся бы
+        return max(room, 1)
+
+    def _segment_full(self):
+        if self.segment_frames and self.segment_frames_written >= self.segment_frames:
+            return True
+        if not self.segment_bytes or not self.segment_frames_written:
+            return False
+        if self.frame_bytes:
+            return self.segment_size + self.frame_bytes > self.segment_bytes
+        return self.segment_size >= self.segment_bytes
+
+    def _sync(self):
+        """Обновляет заголовок и сбрасывает сегмент на диск"""
+        self.last_sync = time.monotonic()
+        self._file.flush()
+        if self._peaks is not None:
+            self._peaks.flush()
+        partial_path = self.current_path + self.PARTIAL_SUFFIX
+        if self.file_format == 'WAV':
+            repair_wav_header(partial_path)
+
+    def _close_file(self):
+        checksum = self._close_raw()
+        self._close_peaks()
+        os.replace(self.current_path + self.PARTIAL_SUFFIX, self.current_path)
+        self.files.append(self.current_path)
+        self.checksums[self.current_path] = checksum
+
+    def _roll(self):
+        """Закрывает текущий сегмент и открывает следующий"""
+        self._close_file()
+        self.segment_index += 1
+        self.segment_frames_written = 0
+        self.current_path = self.filepath_template.format(part=self.segment_index)
+        self._file = self._open(self.current_path)
+        self._peaks = self._open_peaks(self.current_path)
+        self.last_sync = time.monotonic()
+
+
+def recover_segments(directory):
+    """Восстанавливает сегменты, оставшиеся недописанными после сбоя.
+
+    Чинит заголовки WAV, убирает суффикс .partial и возвращает два списка:
+    восстановленные файлы и файлы, которые прочитать не удалось.
+    """
+    recovered = []
+    failed = []
+    suffix = SegmentedTrackWriter.PARTIAL_SUFFIX
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(suffix):
+            continue
+        partial_path = os.path.join(directory, name)
+        final_path = partial_path[:-len(suffix)]
+        try:
+            repair_wav_header(partial_path, truncate=True)
+            sf.info(partial_path)
+            os.replace(partial_path, final_path)
+            recovered.append(final_path)
+        except Exception as e:
+            failed.append(f"{partial_path} ({e})")
+    return recovered, failed
+
+
+def aggregate_format(formats):
+    """Параметры общего многоканального файла для устройств formats.
+
+    Частота у всех устройств должна совпадать. Если форматы сэмплов
+    разные, дорожки сводятся во float32, а subtype файла остаётся общим,
+    если он один (например, передискретизированная дорожка во float32
+    рядом с родной int16). Возвращает словарь того же
+    вида, что probe_device, с суммарным числом каналов.
+    """
+    samplerates = {fmt['samplerate'] for fmt in formats.values()}
+    if len(samplerates) != 1:
+        raise ValueError("Для объединения в один файл у устройств должна быть одна частота: "
+                         + ", ".join(f"{fmt['name']} - {fmt['samplerate']} Гц" for fmt in formats.values()))
+    dtypes = {fmt['dtype'] for fmt in formats.values()}
+    subtypes = {fmt['subtype'] for fmt in formats.values()}
+    dtype = dtypes.pop() if len(dtypes) == 1 else 'float32'
+    subtype = subtypes.pop() if len(subtypes) == 1 else 'FLOAT'
+    return {
+        'name': 'aggregate',
+        'samplerate': samplerates.pop(),
+        'channels': sum(fmt['channels'] for fmt in formats.values()),
+        'dtype': dtype,
+        'subtype': subtype,
+    }
+
+
+class AggregateInput:
+    """Вход одного устройства в AggregateTrackWriter.
+
+    Повторяет интерфейс StreamingTrackWriter для callback: push, queue,
+    dropped_blocks.
+    """
+
+    def __init__(self, max_blocks):
+        self.max_blocks = max_blocks
+        self.queue = deque()
+        self.dropped_blocks = 0
+
+    def push(self, block):
+        """Вызывается из callback потока: копирует блок в очередь"""
+        if len(self.queue) >= self.max_blocks:
+            self.dropped_blocks += 1
+            return
+        self.queue.append(block.copy())
+
+
+class AggregateTrackWriter:
+    """Запись нескольких устройств в один многоканальный файл.
+
+    Каждое устройство пишет блоки в свой вход (inputs[устройство]), а
+    поток сведения раскладывает их по столбцам общего массива в порядке
+    tracks и передаёт готовые куски в target - StreamingTrackWriter или
+    SegmentedTrackWriter, который и пишет файл. Кусок собирается, когда
+    данные есть у всех устройств, так что дорожки идут по общей шкале
+    кадров; недостающий хвост в конце дополняется тишиной.
+
+    tracks - список (устройство, каналы); start_offset(устройство) -
+    необязательная функция, как у StreamingTrackWriter. Если одно
+    устройство отстаёт от другого больше чем на max_lag_frames кадров
+    (например, перестало присылать данные), его пропуск заполняется
+    тишиной и учитывается в padded_frames, чтобы очереди не росли.
+    """
+
+    def __init__(self, target, tracks, dtype, max_blocks=1024, start_offset=None, max_lag_frames=None):
+        self.target = target
+        self.max_lag_frames = max_lag_frames
+        self.padded_frames = {}
+        self.tracks = list(tracks)
+        self.dtype = np.dtype(dtype)
+        self.start_offset = start_offset
+        self.inputs = {device_idx: AggregateInput(max_blocks) for device_idx, _ in self.tracks}
+        self.columns = {}
+        column = 0
+        for device_idx, channels in self.tracks:
+            self.columns[device_idx] = (column, channels)
+            column += channels
+        self.channels = column
+        self.error = None
+        self._pending = {device_idx: deque() for device_idx, _ in self.tracks}
+        self._pending_frames = {device_idx: 0 for device_idx, _ in self.tracks}
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def files(self):
+        return self.target.files
+
+    @property
+    def frames_written(self):
+        return self.target.frames_written
+
+    @property
+    def checksums(self):
+        return self.target.checksums
+
+    @property
+    def dropped_blocks(self):
+        return self.target.dropped_blocks + sum(i.dropped_blocks for i in self.inputs.values())
+
+    def _convert(self, block):
+        if block.dtype == self.dtype:
+            return block
+        # Разные форматы сэмплов сводятся во float32 в долях полной шкалы
+        if block.dtype.kind == 'i':
+            return block.astype(self.dtype) * (1.0 / -np.iinfo(block.dtype).min)
+        return block.astype(self.dtype)
+
+    def _collect(self):
+        for device_idx, source in self.inputs.items():
+            while True:
+                try:
+                    block = source.queue.popleft()
+                except IndexError:
+                    break
+                self._pending[device_idx].append(self._convert(block))
+                self._pending_frames[device_idx] += len(block)
+
+    def _take(self, device_idx, frames):
+        """Снимает до frames кадров из начала очереди устройства"""
+        pending = self._pending[device_idx]
+        parts = []
+        while frames > 0 and pending:
+            block = pending[0]
+            if len(block) <= frames:
+                parts.append(pending.popleft())
+            else:
+                parts.append(block[:frames])
+                pending[0] = block[frames:]
+            frames -= len(parts[-1])
+            self._pending_frames[device_idx] -= len(parts[-1])
+        if not parts:
+            return None
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def _merge(self, final=False):
+        counts = self._pending_frames.values()
+        frames = max(counts) if final else min(counts)
+        if not final and self.max_lag_frames and max(counts) - frames > self.max_lag_frames:
+            frames = max(counts) - self.max_lag_frames
+            for device_idx, count in self._pending_frames.items():
+                if count < frames:
+                    self.padded_frames[device_idx] = self.padded_frames.get(device_idx, 0) + frames - count
+        if frames <= 0:
+            return
+        out = np.zeros((frames, self.channels), dtype=self.dtype)
+        for device_idx, (column, channels) in self.columns.items():
+            part = self._take(device_idx, frames)
+            if part is not None:
+                out[:len(part), column:column + channels] = part
+        self.target.push(out)
+
+    def _wait_start_offsets(self):
+        offsets = {}
+        for device_idx, channels in self.tracks:
+            offset = self.start_offset(device_idx)
+            while offset is None and not self._closing.is_set():
+                self._closing.wait(0.01)
+                offset = self.start_offset(device_idx)
+            if offset is None:
+                offset = self.start_offset(device_idx, force=True)
+            offsets[device_idx] = offset
+        for device_idx, offset in offsets.items():
+            if offset > 0:
+                self._pending[device_idx].append(np.zeros((offset, self.columns[device_idx][1]), dtype=self.dtype))
+                self._pending_frames[device_idx] += offset
+
+    def _run(self):
+        try:
+            if self.start_offset is not None:
+                self._wait_start_offsets()
+            while not self._closing.is_set():
+                self._collect()
+                self._merge()
+                self._closing.wait(0.01)
+            self._collect()
+            self._merge(final=True)
+        except Exception as e:
+            self.error = e
+
+    def close(self):
+        """Сводит оставшиеся блоки и закрывает файл"""
+        self._closing.set()
+        self._thread.join()
+        self.target.close()
+        self.error = self.error or self.target.error
+
+    def channel_map(self, formats):
+        """Описание каналов общего файла: какой канал какого устройства где лежит"""
+        channels = []
+        for device_idx, (column, count) in self.columns.items():
+            for channel in range(count):
+                channels.append({
+                    'channel': column + channel + 1,
+                    'device': device_idx,
+                    'device_name': formats[device_idx]['name'],
+                    'device_channel': channel + 1,
+                })
+        return channels
+